@@ -0,0 +1,18 @@
+CREATE TABLE `users_managerclosure` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `ancestor_id` integer NOT NULL,
+    `descendant_id` integer NOT NULL,
+    `depth` smallint UNSIGNED NOT NULL,
+    UNIQUE (`ancestor_id`, `descendant_id`)
+) ENGINE=InnoDB CHARACTER SET utf8;
+
+ALTER TABLE `users_managerclosure`
+    ADD CONSTRAINT `ancestor_id_refs_id_managerclosure`
+    FOREIGN KEY (`ancestor_id`) REFERENCES `auth_user` (`id`);
+ALTER TABLE `users_managerclosure`
+    ADD CONSTRAINT `descendant_id_refs_id_managerclosure`
+    FOREIGN KEY (`descendant_id`) REFERENCES `auth_user` (`id`);
+CREATE INDEX `users_managerclosure_descendant_id`
+    ON `users_managerclosure` (`descendant_id`);
+
+-- afterwards, populate it with: ./manage.py rebuild_manager_closure
@@ -0,0 +1,7 @@
+ALTER TABLE `dates_entry`
+    ADD COLUMN `full_days` integer NOT NULL DEFAULT 0,
+    ADD COLUMN `half_days` integer NOT NULL DEFAULT 0,
+    ADD COLUMN `birthday` bool NOT NULL DEFAULT 0,
+    ADD COLUMN `weekdays` integer NOT NULL DEFAULT 0;
+
+-- afterwards, populate it with: ./manage.py backfill_entry_summaries
@@ -0,0 +1,16 @@
+CREATE TABLE `dates_outboxemail` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `subject` varchar(255) NOT NULL,
+    `body` longtext NOT NULL,
+    `from_email` varchar(100) NOT NULL,
+    `to_addresses` longtext NOT NULL,
+    `cc_addresses` longtext NOT NULL,
+    `add_date` datetime NOT NULL,
+    `send_after` datetime NOT NULL,
+    `sent_date` datetime,
+    `attempts` integer NOT NULL,
+    `last_error` longtext NOT NULL
+) ENGINE=InnoDB CHARACTER SET utf8;
+
+CREATE INDEX `dates_outboxemail_send_after`
+    ON `dates_outboxemail` (`send_after`);
@@ -0,0 +1,11 @@
+ALTER TABLE `dates_hours`
+    ADD COLUMN `user_id` integer NULL;
+
+ALTER TABLE `dates_hours`
+    ADD CONSTRAINT `user_id_refs_id_hours_user`
+    FOREIGN KEY (`user_id`) REFERENCES `auth_user` (`id`);
+
+CREATE INDEX `dates_hours_user_id_date`
+    ON `dates_hours` (`user_id`, `date`);
+
+-- afterwards, populate it with: ./manage.py backfill_hours_user
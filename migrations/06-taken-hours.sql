@@ -0,0 +1,13 @@
+CREATE TABLE `dates_takenhours` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `user_id` integer NOT NULL,
+    `year` integer NOT NULL,
+    `hours` integer NOT NULL,
+    UNIQUE (`user_id`, `year`)
+) ENGINE=InnoDB CHARACTER SET utf8;
+
+ALTER TABLE `dates_takenhours`
+    ADD CONSTRAINT `user_id_refs_id_takenhours`
+    FOREIGN KEY (`user_id`) REFERENCES `auth_user` (`id`);
+
+-- afterwards, populate it with: ./manage.py rebuild_taken_hours
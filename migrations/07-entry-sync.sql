@@ -0,0 +1,13 @@
+CREATE INDEX `dates_entry_modify_date`
+    ON `dates_entry` (`modify_date`);
+
+CREATE TABLE `dates_tombstone` (
+    `id` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `kind` varchar(20) NOT NULL,
+    `user_id` integer NOT NULL,
+    `object_id` integer,
+    `add_date` datetime NOT NULL
+) ENGINE=InnoDB CHARACTER SET utf8;
+
+CREATE INDEX `dates_tombstone_add_date`
+    ON `dates_tombstone` (`add_date`);
@@ -0,0 +1,14 @@
+CREATE TABLE `dates_changelog` (
+    `seq` integer AUTO_INCREMENT NOT NULL PRIMARY KEY,
+    `model` varchar(10) NOT NULL,
+    `action` varchar(10) NOT NULL,
+    `object_id` integer NOT NULL,
+    `user_id` integer,
+    `entry_id` integer NOT NULL,
+    `start` date,
+    `end` date,
+    `date` date,
+    `hours` integer,
+    `birthday` bool NOT NULL,
+    `add_date` datetime NOT NULL
+) ENGINE=InnoDB CHARACTER SET utf8;
@@ -0,0 +1,2 @@
+ALTER TABLE `dates_outboxemail`
+    ADD COLUMN `claim` varchar(32) NOT NULL DEFAULT '';
@@ -0,0 +1,188 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""
+An in-process copy of the LDAP directory for the user autocomplete.
+
+The records come from the cache (see the `refresh_directory_index`
+management command) or, failing that, straight from LDAP. Each process
+rebuilds its index in a background thread once it's older than
+settings.AUTOCOMPLETE_DIRECTORY_TTL seconds. If that fails it doesn't try
+again for settings.AUTOCOMPLETE_DIRECTORY_RETRY seconds, so a struggling
+LDAP server isn't asked for the whole directory on every keystroke.
+"""
+
+import bisect
+import logging
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.models import User
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from pto.apps.users.utils import ldap_lookup
+
+
+CACHE_KEY = 'autocomplete_directory'
+# records per cache item, which keeps them well under memcached's 1MB
+CHUNK_SIZE = 1000
+
+
+class DirectoryIndex(object):
+    """Sorted arrays of lowercased attribute values for prefix searching
+    with bisect, mirroring the filters ldap_lookup.search_users() sends
+    when autocomplete=True."""
+
+    FIELDS = ('givenName', 'sn', 'mail', 'cn', 'uid')
+
+    def __init__(self, records, known_emails=()):
+        self.records = records
+        self.known_emails = set(x.lower() for x in known_emails)
+        self._keys = {}
+        for field in self.FIELDS:
+            pairs = []
+            for i, record in enumerate(records):
+                values = record.get(field)
+                if not isinstance(values, list):
+                    values = [values]
+                for value in values:
+                    if value:
+                        pairs.append((value.lower(), i))
+            pairs.sort()
+            self._keys[field] = ([x[0] for x in pairs],
+                                 [x[1] for x in pairs])
+
+    def __len__(self):
+        return len(self.records)
+
+    def _prefixed(self, field, prefix):
+        keys, positions = self._keys[field]
+        i = bisect.bisect_left(keys, prefix)
+        while i < len(keys) and keys[i].startswith(prefix):
+            yield positions[i]
+            i += 1
+
+    def is_known(self, record):
+        mail = record.get('mail')
+        return isinstance(mail, basestring) and mail.lower() in self.known_emails
+
+    def search(self, query, limit, known_only=False):
+        query = query.lower()
+        if query.startswith(':'):
+            query = query[1:]
+            fields = ('uid',)
+        else:
+            fields = ['givenName', 'sn', 'mail']
+            if ' ' in query:
+                fields.append('cn')
+        if not query:
+            return []
+
+        found = set()
+        for field in fields:
+            found.update(self._prefixed(field, query))
+        results = []
+        for i in sorted(found):
+            record = self.records[i]
+            if known_only and not self.is_known(record):
+                continue
+            results.append(record)
+            if len(results) >= limit:
+                break
+        return results
+
+
+def set_cached_records(records):
+    """Cache the directory in chunks of CHUNK_SIZE records. The chunks
+    of every generation have their own keys so that a reader never mixes
+    two of them."""
+    generation = '%d' % (time.time() * 1000)
+    chunks = {}
+    for i in range(0, len(records), CHUNK_SIZE):
+        key = '%s:%s:%d' % (CACHE_KEY, generation, i / CHUNK_SIZE)
+        chunks[key] = records[i:i + CHUNK_SIZE]
+    cache.set_many(chunks, settings.AUTOCOMPLETE_DIRECTORY_TTL)
+    # only once all the chunks are there
+    cache.set(CACHE_KEY, (generation, sorted(chunks)),
+              settings.AUTOCOMPLETE_DIRECTORY_TTL)
+
+
+def get_cached_records():
+    """The records cached by `set_cached_records()` or None if they, or
+    any chunk of them, aren't there."""
+    head = cache.get(CACHE_KEY)
+    if head is None:
+        return None
+    __, keys = head
+    chunks = cache.get_many(keys)
+    if len(chunks) != len(keys):
+        return None
+    records = []
+    for key in keys:
+        records.extend(chunks[key])
+    return records
+
+
+def build_index(records=None):
+    if records is None:
+        records = get_cached_records()
+    if records is None:
+        records = ldap_lookup.fetch_directory()
+        set_cached_records(records)
+    known_emails = (User.objects
+                    .exclude(email='')
+                    .values_list('email', flat=True))
+    return DirectoryIndex(records, known_emails)
+
+
+_index = None
+_built = 0
+_failed = 0
+_refreshing = threading.Lock()
+
+
+def refresh():
+    global _index, _built, _failed
+    try:
+        index = build_index()
+    except Exception:
+        _failed = time.time()
+        raise
+    _index, _built = index, time.time()
+    return index
+
+
+def _refresh_in_background():
+    from django.db import connection
+    try:
+        refresh()
+    except Exception:
+        logging.error("Unable to refresh the directory index", exc_info=True)
+    finally:
+        connection.close()
+        _refreshing.release()
+
+
+def get_index():
+    """Return the current DirectoryIndex, kicking off a refresh if it's
+    stale. None means there's no index (yet) and the caller should ask
+    LDAP instead."""
+    if not getattr(settings, 'AUTOCOMPLETE_DIRECTORY_INDEX', False):
+        return None
+    now = time.time()
+    stale = now - _built > settings.AUTOCOMPLETE_DIRECTORY_TTL
+    backing_off = now - _failed < settings.AUTOCOMPLETE_DIRECTORY_RETRY
+    if ((_index is None or stale) and not backing_off and
+        _refreshing.acquire(False)):
+        thread = threading.Thread(target=_refresh_in_background)
+        thread.daemon = True
+        thread.start()
+    return _index
+
+
+@receiver(post_save, sender=User)
+def remember_known_email(sender, instance, **kwargs):
+    if _index is not None and instance.email:
+        _index.known_emails.add(instance.email.lower())
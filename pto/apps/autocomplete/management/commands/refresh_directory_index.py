@@ -0,0 +1,20 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from pto.apps.users.utils import ldap_lookup
+from pto.apps.autocomplete.directory import set_cached_records
+
+
+class Command(NoArgsCommand):
+    help = """
+    Loads every account from LDAP into the cache that the autocomplete
+    directory index is built from. Run it from cron more often than
+    AUTOCOMPLETE_DIRECTORY_TTL.
+    """
+
+    def handle_noargs(self, **options):
+        records = ldap_lookup.fetch_directory()
+        set_cached_records(records)
+        print "Cached", len(records), "directory entries"
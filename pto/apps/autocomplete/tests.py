@@ -2,8 +2,10 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import time
 import ldap
 from django.conf import settings
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.utils import simplejson as json
@@ -15,6 +17,11 @@ from test_utils import TestCase
 
 class CitiesTest(TestCase):
 
+    def setUp(self):
+        super(CitiesTest, self).setUp()
+        # the list of cities is cached
+        cache.clear()
+
     def test_cities(self):
         url = reverse('autocomplete.cities')
         response = self.client.get(url)
@@ -176,3 +183,116 @@ class UsersTest(TestCase):
           'label': label,
           'value': value,
         })
+
+
+class DirectoryIndexTest(TestCase):
+
+    records = [
+      {'cn': u'Peter Bengtsson', 'givenName': u'Pet\xe3r', 'sn': u'Bengtsson',
+       'mail': u'peterbe@mozilla.com', 'uid': u'pbengtsson'},
+      {'cn': u'Peterino Gaudy', 'givenName': u'Peterino', 'sn': u'Gaudi',
+       'mail': u'peterino@mozilla.com', 'uid': u'peterino'},
+      {'cn': u'Laura Thomson', 'givenName': u'Laura', 'sn': u'Thomson',
+       'mail': u'laura@mozilla.com', 'uid': u'lthom'},
+    ]
+
+    def tearDown(self):
+        super(DirectoryIndexTest, self).tearDown()
+        from pto.apps.autocomplete import directory
+        directory._index = None
+        directory._built = 0
+        directory._failed = 0
+
+    def test_search(self):
+        from pto.apps.autocomplete.directory import DirectoryIndex
+        index = DirectoryIndex(self.records, ['LAURA@mozilla.com'])
+        eq_(len(index), 3)
+
+        uids = lambda r: [x['uid'] for x in r]
+        eq_(uids(index.search('peter', 30)), ['pbengtsson', 'peterino'])
+        eq_(uids(index.search('PETERI', 30)), ['peterino'])
+        eq_(uids(index.search('peter', 1)), ['pbengtsson'])
+        eq_(uids(index.search('thom', 30)), ['lthom'])
+        eq_(uids(index.search(':lth', 30)), ['lthom'])
+        eq_(uids(index.search(':', 30)), [])
+        # cn is only searched when there's a space
+        eq_(uids(index.search('laura t', 30)), ['lthom'])
+        eq_(uids(index.search('peter', 30, known_only=True)), [])
+        eq_(uids(index.search('la', 30, known_only=True)), ['lthom'])
+
+    def test_users_from_index(self):
+        from pto.apps.autocomplete import directory
+        ldap.initialize = Mock(side_effect=AssertionError('no LDAP please'))
+        mortal = User.objects.create(username='mortal')
+        mortal.set_password('secret')
+        mortal.save()
+        assert self.client.login(username='mortal', password='secret')
+
+        with self.settings(AUTOCOMPLETE_DIRECTORY_INDEX=True):
+            directory._index = directory.DirectoryIndex(self.records)
+            directory._built = time.time()
+
+            url = reverse('autocomplete.users')
+            response = self.client.get(url, {'term': 'peter'})
+            eq_(response.status_code, 200)
+            struct = json.loads(response.content)
+            eq_([x['id'] for x in struct], ['pbengtsson', 'peterino'])
+
+            url = reverse('autocomplete.users_known_only')
+            response = self.client.get(url, {'term': 'peter'})
+            eq_(json.loads(response.content), [])
+
+            # new local users are known straight away
+            User.objects.create(username='peterino',
+                                email='Peterino@mozilla.com')
+            response = self.client.get(url, {'term': 'peter'})
+            struct = json.loads(response.content)
+            eq_([x['id'] for x in struct], ['peterino'])
+
+    def test_cached_records(self):
+        from pto.apps.autocomplete import directory
+        cache.clear()
+        eq_(directory.get_cached_records(), None)
+        _chunk_size = directory.CHUNK_SIZE
+        directory.CHUNK_SIZE = 2
+        try:
+            directory.set_cached_records(self.records)
+        finally:
+            directory.CHUNK_SIZE = _chunk_size
+        eq_(directory.get_cached_records(), self.records)
+
+        # a chunk that's been evicted means none of it is there
+        __, keys = cache.get(directory.CACHE_KEY)
+        eq_(len(keys), 2)
+        cache.delete(keys[-1])
+        eq_(directory.get_cached_records(), None)
+
+    def test_refresh_backs_off(self):
+        from pto.apps.autocomplete import directory
+        cache.clear()
+        _fetch_directory = directory.ldap_lookup.fetch_directory
+        _thread = directory.threading.Thread
+        directory.ldap_lookup.fetch_directory = Mock(
+          side_effect=ldap.SERVER_DOWN
+        )
+        directory.threading.Thread = Mock()
+        try:
+            with self.settings(AUTOCOMPLETE_DIRECTORY_INDEX=True):
+                eq_(directory.get_index(), None)
+                eq_(directory.threading.Thread.call_count, 1)
+                # what the thread does
+                self.assertRaises(ldap.SERVER_DOWN, directory.refresh)
+                directory._refreshing.release()
+                ok_(directory._failed)
+
+                eq_(directory.get_index(), None)
+                eq_(directory.get_index(), None)
+                eq_(directory.threading.Thread.call_count, 1)
+
+                directory._failed -= settings.AUTOCOMPLETE_DIRECTORY_RETRY
+                eq_(directory.get_index(), None)
+                eq_(directory.threading.Thread.call_count, 2)
+                directory._refreshing.release()
+        finally:
+            directory.ldap_lookup.fetch_directory = _fetch_directory
+            directory.threading.Thread = _thread
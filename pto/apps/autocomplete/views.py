@@ -5,8 +5,9 @@
 import logging
 from django import http
 from pto.apps.dates.decorators import json_view
-from pto.apps.users.models import UserProfile, User
+from pto.apps.users.models import User, get_profile_cities
 from pto.apps.users.utils import ldap_lookup
+from . import directory
 
 
 @json_view
@@ -14,16 +15,10 @@ def cities(request):
     if not request.user.is_authenticated():
         return http.HttpResponseForbidden('Must be logged in')
     data = []
-    term = request.GET.get('term')
-    qs = UserProfile.objects.exclude(city='')
-    if term:
-        qs = qs.filter(city__istartswith=term)
-    for each in (qs
-                     .values('city')
-                     .distinct()
-                     .order_by('city')):
-        city = each['city']
-        data.append(city)
+    term = request.GET.get('term', '').lower()
+    for city in get_profile_cities():
+        if city.lower().startswith(term):
+            data.append(city)
     return data
 
 @json_view
@@ -37,11 +32,16 @@ def users(request, known_only=False):
     results = []
     # I chose a limit of 30 because there are about 20+ 'peter'
     # something in mozilla
-    for each in ldap_lookup.search_users(query, 30, autocomplete=True):
+    index = directory.get_index()
+    if index is not None:
+        found = index.search(query, 30, known_only=known_only)
+    else:
+        found = ldap_lookup.search_users(query, 30, autocomplete=True)
+    for each in found:
         if not each.get('givenName'):
             logging.warn("Skipping LDAP entry %s" % each)
             continue
-        if known_only:
+        if known_only and index is None:
             if not User.objects.filter(email__iexact=each['mail']).exists():
                 continue
         full_name_and_email = '%s %s <%s>' % (each['givenName'],
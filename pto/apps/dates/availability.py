@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Who is out on which day, as a users x days matrix.
+
+Every cell is one character so that each user's row is a string with one
+character per day of the window (see `CODES`), which is a lot smaller
+than a JSON object per cell.
+"""
+
+from array import array
+from django.conf import settings
+from .models import Hours
+
+NOT_OUT = '0'
+HALF_DAY = '1'
+FULL_DAY = '2'
+BIRTHDAY = '3'
+CODES = {
+  HALF_DAY: 'half day',
+  FULL_DAY: 'full day',
+  BIRTHDAY: 'birthday',
+}
+MAX_DAYS = 366
+
+
+def get_code(hours, birthday):
+    if birthday:
+        return BIRTHDAY
+    if hours >= settings.WORK_DAY:
+        return FULL_DAY
+    if hours > 0:
+        return HALF_DAY
+    return NOT_OUT
+
+
+def get_matrix(user_ids, start, end):
+    """Return a list of strings, one per user in `user_ids` with one
+    character per day from `start` to `end`, and a list of how many of
+    them are out each day."""
+    days = (end - start).days + 1
+    rows = dict((user_id, i) for i, user_id in enumerate(user_ids))
+    # like get_hours_by_date() the latest Hours of a date is what counts
+    # since it replaces (and reverses) any earlier ones
+    codes = {}
+    for user_id, date, hours, birthday in (Hours.objects
+                                           .filter(user__in=user_ids,
+                                                   date__gte=start,
+                                                   date__lte=end)
+                                           .order_by('pk')
+                                           .values_list('user', 'date',
+                                                        'hours',
+                                                        'birthday')):
+        index = rows[user_id] * days + (date - start).days
+        codes[index] = get_code(hours, birthday)
+
+    cells = array('c', NOT_OUT * (len(user_ids) * days))
+    totals = [0] * days
+    for index, code in codes.iteritems():
+        cells[index] = code
+        if code != NOT_OUT:
+            totals[index % days] += 1
+    matrix = [cells[i * days:(i + 1) * days].tostring()
+              for i in range(len(user_ids))]
+    return matrix, totals
@@ -0,0 +1,103 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Reading the change log of Entry and Hours (see `models.ChangeLog`).
+
+Consumers remember the `seq` of the last change they got and ask for the
+ones after it. Sequence numbers are handed out as the rows are inserted,
+but a change that's still in an open transaction can have a lower one
+than a change that's already committed. So only the changes up to the
+first one added less than `CHANGE_LOG_SETTLE_SECONDS` ago are returned.
+As long as every transaction commits within that long of writing to the
+log, and the clocks of the web servers agree, everything before the last
+change returned has been committed and paging by `seq` skips nothing.
+"""
+
+import datetime
+from django.conf import settings
+from django.contrib.auth.models import User
+from .models import ChangeLog
+
+CSV_HEADER = (
+  'SEQ',
+  'ADDED',
+  'MODEL',
+  'ACTION',
+  'ID',
+  'USER',
+  'EMAIL',
+  'ENTRY',
+  'START',
+  'END',
+  'DATE',
+  'HOURS',
+  'BIRTHDAY',
+)
+
+
+def get_changes(since=0, limit=None):
+    """Return a list of at most `limit` settled changes after `since`,
+    oldest first, and whether there are more."""
+    if limit is None:
+        limit = settings.CHANGE_LOG_PAGE_SIZE
+    settled = (datetime.datetime.utcnow() -
+               datetime.timedelta(seconds=settings.CHANGE_LOG_SETTLE_SECONDS))
+    changes = list(ChangeLog.objects
+                   .filter(seq__gt=since)
+                   .order_by('seq')[:limit + 1])
+    for i, change in enumerate(changes):
+        if change.add_date >= settled:
+            # changes before it might not have been committed yet
+            return changes[:i], False
+    return changes[:limit], len(changes) > limit
+
+
+def _get_emails(changes):
+    return dict(User.objects
+                .filter(pk__in=set(x.user_id for x in changes))
+                .values_list('pk', 'email'))
+
+
+def _format_date(date):
+    return date and date.strftime('%Y-%m-%d') or None
+
+
+def get_dicts(changes):
+    emails = _get_emails(changes)
+    return [{
+      'seq': x.seq,
+      'added': x.add_date.strftime('%Y-%m-%d %H:%M:%S'),
+      'model': x.model,
+      'action': x.action,
+      'id': x.object_id,
+      'user': x.user_id,
+      'email': emails.get(x.user_id),
+      'entry': x.entry_id,
+      'start': _format_date(x.start),
+      'end': _format_date(x.end),
+      'date': _format_date(x.date),
+      'hours': x.hours,
+      'birthday': x.birthday,
+    } for x in changes]
+
+
+def get_csv_rows(changes):
+    """The changes as rows of strings for `csv_export.iter_csv`, without
+    the header."""
+    emails = _get_emails(changes)
+    return [(
+      str(x.seq),
+      x.add_date.strftime('%Y-%m-%d %H:%M:%S'),
+      x.model,
+      x.action,
+      str(x.object_id),
+      x.user_id and str(x.user_id) or '',
+      emails.get(x.user_id, ''),
+      str(x.entry_id),
+      _format_date(x.start) or '',
+      _format_date(x.end) or '',
+      _format_date(x.date) or '',
+      x.hours is not None and str(x.hours) or '',
+      x.birthday and '1' or '',
+    ) for x in changes]
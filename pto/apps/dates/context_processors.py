@@ -2,17 +2,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import re
-
 from django.conf import settings
 
 
-uppercase = re.compile(r'[A-Z]')
+# The settings templates refer to directly, e.g. {{ BUILD_ID_JS }}.
+# Everything else is available as {{ settings.NAME }}. If a template
+# needs another one, add it here.
+TEMPLATE_SETTINGS = (
+  'BUILD_ID_CSS',
+  'BUILD_ID_JS',
+)
 
 
 def global_settings(request):
     context = {}
-    for k in dir(settings):
-        if uppercase.match(k[0]):
+    for k in TEMPLATE_SETTINGS:
+        if hasattr(settings, k):
             context[k] = getattr(settings, k)
     return context
@@ -31,3 +31,21 @@ class UnicodeWriter:
         self.stream.write(data)
         # empty queue
         self.queue.truncate(0)
+
+
+def iter_csv(rows, chunk_size=100, dialect=csv.excel, encoding="utf-8",
+             **kwds):
+    """
+    Generator that writes the rows as CSV and yields the encoded output
+    in chunks of `chunk_size` rows. Suitable as the content of a
+    streamed HttpResponse.
+    """
+    queue = cStringIO.StringIO()
+    writer = csv.writer(queue, dialect=dialect, **kwds)
+    for i, row in enumerate(rows, 1):
+        writer.writerow([s.encode(encoding) for s in row])
+        if not i % chunk_size:
+            yield queue.getvalue()
+            queue.truncate(0)
+    if queue.tell():
+        yield queue.getvalue()
@@ -0,0 +1,228 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Per-user bitmaps of the days people are out, so that "who is out on
+this day or in these weeks" over a set of users is a few bitwise
+operations instead of a range scan over Entry.
+
+A user's `DayMap` has one bit per day from January 1 `YEARS_BACK` years
+ago to the end of the year `YEARS_AHEAD` years from now, in two Python
+ints: `out` for the days with any hours or a birthday and `half` for the
+ones that are less than a full day. Like `get_hours_by_date()` the latest
+Hours of a date is what counts, so reversed days aren't out.
+
+Maps are kept in the cache and built from Hours when they're missing.
+Any change to Hours drops them (see the signals and `HoursQuerySet` in
+`models`), again after the transaction has committed. Use the
+`rebuild_day_maps` command to build them all and `check_day_maps` to
+compare them against the database.
+"""
+
+import datetime
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db import transaction
+from django.dispatch import receiver
+
+KEY = 'day-map:%s'
+TIMEOUT = 60 * 60 * 24 * 30
+YEARS_BACK = 1
+YEARS_AHEAD = 1
+
+
+def get_origin(today=None):
+    """The first day of the window that maps made `today` cover."""
+    if today is None:
+        today = datetime.date.today()
+    return datetime.date(today.year - YEARS_BACK, 1, 1)
+
+
+class DayMap(object):
+
+    def __init__(self, origin, out=0, half=0):
+        self.origin = origin
+        self.length = (datetime.date(origin.year + YEARS_BACK +
+                                     YEARS_AHEAD + 1, 1, 1) - origin).days
+        self.out = out
+        self.half = half
+
+    def __eq__(self, other):
+        return (isinstance(other, DayMap) and
+                (self.origin, self.out, self.half) ==
+                (other.origin, other.out, other.half))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %s %d days out>' % (self.__class__.__name__,
+                                         self.origin,
+                                         bin(self.out).count('1'))
+
+    def index(self, date):
+        """The bit of `date` or None if it's outside the window."""
+        index = (date - self.origin).days
+        if 0 <= index < self.length:
+            return index
+
+    def set_day(self, date, hours, birthday=False):
+        index = self.index(date)
+        if index is None:
+            return
+        bit = 1 << index
+        self.out &= ~bit
+        self.half &= ~bit
+        if birthday or hours > 0:
+            self.out |= bit
+            if not birthday and hours < settings.WORK_DAY:
+                self.half |= bit
+
+    def mask(self, start, end):
+        """Bits set for the days from `start` to `end` in the window."""
+        first = max(0, (start - self.origin).days)
+        last = min(self.length - 1, (end - self.origin).days)
+        if last < first:
+            return 0
+        return ((1 << (last - first + 1)) - 1) << first
+
+    def is_out(self, date):
+        return bool(self.out & self.mask(date, date))
+
+    def is_half(self, date):
+        return bool(self.half & self.mask(date, date))
+
+    def is_out_between(self, start, end):
+        return bool(self.out & self.mask(start, end))
+
+    def days_out(self, start, end):
+        index = max(0, (start - self.origin).days)
+        bits = (self.out & self.mask(start, end)) >> index
+        days = []
+        while bits:
+            if bits & 1:
+                days.append(self.origin + datetime.timedelta(days=index))
+            bits >>= 1
+            index += 1
+        return days
+
+    def absences(self, start, end):
+        """List of (first, last) day of every stretch of days out that
+        overlaps `start` to `end`. Weekends don't interrupt a stretch."""
+        # look a week either side for the ends of stretches
+        days = self.days_out(start - datetime.timedelta(days=7),
+                             end + datetime.timedelta(days=7))
+        absences = []
+        for day in days:
+            if absences:
+                gap = [absences[-1][1] + datetime.timedelta(days=x)
+                       for x in range(1, (day - absences[-1][1]).days)]
+                if all(x.weekday() > 4 for x in gap):
+                    absences[-1][1] = day
+                    continue
+            absences.append([day, day])
+        return [tuple(x) for x in absences if x[1] >= start and x[0] <= end]
+
+
+def build(user_ids, origin=None):
+    """Return a dict of user ID -> DayMap made from their Hours."""
+    if origin is None:
+        origin = get_origin()
+    from .models import Hours
+    maps = dict((x, DayMap(origin)) for x in user_ids)
+    if not maps:
+        return maps
+    end = origin + datetime.timedelta(days=maps.values()[0].length - 1)
+    for user_id, date, hours, birthday in (Hours.objects
+                                           .filter(user__in=maps.keys(),
+                                                   date__gte=origin,
+                                                   date__lte=end)
+                                           .order_by('pk')
+                                           .values_list('user', 'date',
+                                                        'hours',
+                                                        'birthday')):
+        maps[user_id].set_day(date, hours, birthday)
+    return maps
+
+
+def _store(maps):
+    cache.set_many(dict((KEY % user_id, (x.origin, x.out, x.half))
+                        for user_id, x in maps.items()),
+                   TIMEOUT)
+
+
+def get_maps(user_ids):
+    """Return a dict of user ID -> DayMap for all of `user_ids`, building
+    (in one query) the ones that aren't cached or are for an old window."""
+    origin = get_origin()
+    cached = cache.get_many([KEY % x for x in user_ids])
+    maps = {}
+    missing = []
+    for user_id in user_ids:
+        value = cached.get(KEY % user_id)
+        if value and value[0] == origin:
+            maps[user_id] = DayMap(*value)
+        else:
+            missing.append(user_id)
+    if missing:
+        built = build(missing, origin)
+        _store(built)
+        maps.update(built)
+    return maps
+
+
+def get_cached_maps(user_ids):
+    """Like `get_maps` but only the ones there are in the cache."""
+    cached = cache.get_many([KEY % x for x in user_ids])
+    return dict((user_id, DayMap(*cached[KEY % user_id]))
+                for user_id in user_ids if KEY % user_id in cached)
+
+
+def rebuild(user_ids):
+    _store(build(user_ids))
+
+
+_pending = threading.local()
+
+
+def _get_pending():
+    if not hasattr(_pending, 'user_ids'):
+        _pending.user_ids = set()
+    return _pending.user_ids
+
+
+def invalidate(*user_ids):
+    """Drop the users' maps. Inside a transaction they're dropped again
+    at the end of the request, once it has committed, so that a map built
+    from the old rows in between isn't kept."""
+    cache.delete_many([KEY % x for x in user_ids])
+    if transaction.is_managed():
+        _get_pending().update(user_ids)
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def invalidate_pending(**kwargs):
+    """Drop again the maps that were dropped inside a transaction.
+    Anything else that changes Hours in a transaction should call it
+    after committing."""
+    user_ids = _get_pending()
+    if user_ids:
+        _pending.user_ids = set()
+        cache.delete_many([KEY % x for x in user_ids])
+
+
+def who_is_out(user_ids, date):
+    """The ones of `user_ids` that are out on `date`."""
+    maps = get_maps(user_ids)
+    return [x for x in user_ids if maps[x].is_out(date)]
+
+
+def who_is_out_between(user_ids, start, end):
+    """Dict of user ID -> DayMap for the ones of `user_ids` that are out
+    on any day from `start` to `end`."""
+    maps = get_maps(user_ids)
+    return dict((x, maps[x]) for x in user_ids
+                if maps[x].is_out_between(start, end))
@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Cache of the rendered ptocalendar.ics feeds and calendar_events JSON.
+
+Every user, plus the org chart as a whole, has a version token in the
+cache that is replaced whenever something that could appear in somebody's
+calendar changes (see the signals in `models`). A cached calendar
+remembers the versions of everything it was built from and is only served
+as long as they are all unchanged, so checking one is a `get` plus a
+`get_many`.
+
+A version bumped inside a transaction is bumped again at the end of the
+request, once the transaction has committed. Otherwise a calendar built
+from the old rows in between would be cached under the new version.
+"""
+
+import time
+import uuid
+import hashlib
+import threading
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils.encoding import smart_str
+
+FEED_KEY = 'vcal-feed:%s'
+EVENTS_KEY = 'calendar-events:%s:%s:%s'
+VERSION_KEY = 'vcal-version:%s'
+ORG = 'org'
+# the version tokens have to outlive the feeds that refer to them
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def _version_keys(user_ids):
+    return [VERSION_KEY % x for x in user_ids] + [VERSION_KEY % ORG]
+
+
+_pending = threading.local()
+
+
+def _get_pending():
+    if not hasattr(_pending, 'user_ids'):
+        _pending.user_ids = set()
+    return _pending.user_ids
+
+
+def _bump(user_ids):
+    token = uuid.uuid4().hex
+    cache.set_many(dict((VERSION_KEY % x, token) for x in user_ids),
+                   VERSION_TIMEOUT)
+
+
+def bump_versions(*user_ids):
+    """Invalidate every cached feed that shows any of `user_ids`.
+    Pass `ORG` when the reporting chain changes."""
+    _bump(user_ids)
+    if transaction.is_managed():
+        _get_pending().update(user_ids)
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def bump_pending_versions(**kwargs):
+    """Bump again the versions that were bumped inside a transaction.
+    Runs when a request starts and when it has finished, after the view's
+    transaction has committed. Anything else that changes calendars in a
+    transaction should call it after committing."""
+    user_ids = _get_pending()
+    if user_ids:
+        _pending.user_ids = set()
+        _bump(user_ids)
+
+
+def get_versions(user_ids):
+    keys = _version_keys(user_ids)
+    versions = cache.get_many(keys)
+    missing = dict((x, uuid.uuid4().hex) for x in keys if x not in versions)
+    if missing:
+        cache.set_many(missing, VERSION_TIMEOUT)
+        versions.update(missing)
+    return versions
+
+
+def _get(cache_key, day=None):
+    cached = cache.get(cache_key)
+    if not cached or cached['day'] != day:
+        return
+    if cache.get_many(cached['versions'].keys()) != cached['versions']:
+        return
+    return cached
+
+
+def _set(cache_key, day, versions, body, timeout):
+    cached = {
+      'day': day,
+      'versions': versions,
+      'body': body,
+      'etag': hashlib.md5(smart_str(body)).hexdigest(),
+      'last_modified': int(time.time()),
+    }
+    cache.set(cache_key, cached, timeout)
+    return cached
+
+
+def get_feed(key, today):
+    """Return the cached feed (a dict with `body`, `etag` and
+    `last_modified`) for the calendar `key` if it's still current."""
+    return _get(FEED_KEY % key, today)
+
+
+def set_feed(key, today, versions, body):
+    """Store a rendered feed. `versions` must have been fetched, with
+    `get_versions`, before the data in `body` was queried."""
+    return _set(FEED_KEY % key, today, versions, body,
+                settings.CALENDAR_FEED_CACHE_TIMEOUT)
+
+
+def delete_feed(key):
+    cache.delete(FEED_KEY % key)
+
+
+def _events_key(user_id, start, end):
+    return EVENTS_KEY % (user_id,
+                         start.strftime('%Y%m%d%H%M%S'),
+                         end.strftime('%Y%m%d%H%M%S'))
+
+
+def get_events(user_id, start, end):
+    """Like `get_feed` but for the calendar_events JSON of `user_id`
+    between the datetimes `start` and `end`."""
+    return _get(_events_key(user_id, start, end))
+
+
+def set_events(user_id, start, end, versions, body):
+    return _set(_events_key(user_id, start, end), None, versions, body,
+                settings.CALENDAR_EVENTS_CACHE_TIMEOUT)
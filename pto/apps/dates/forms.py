@@ -8,8 +8,8 @@ from django.utils import formats
 from django.contrib.auth.models import User
 from django.core.validators import validate_email
 from django import forms
-from .models import Hours, Entry
-from pto.apps.users.models import UserProfile
+from .models import Entry, get_hours_by_date
+from pto.apps.users.models import get_profile_countries
 import utils
 
 
@@ -109,18 +109,22 @@ class AddForm(BaseForm):
 
 class HoursForm(BaseForm):
     def __init__(self, entry, *args, **kwargs):
+        # a `get_hours_by_date()` for the entry's dates, if already loaded
+        hours = kwargs.pop('hours', None)
         super(HoursForm, self).__init__(*args, **kwargs)
         self.entry = entry
+        if hours is None:
+            hours = get_hours_by_date(entry.user, entry.start, entry.end)
+        self.hours = hours
         for date in utils.get_weekday_dates(self.entry.start, self.entry.end):
             field_name = date.strftime('d-%Y%m%d')
 
-            try:
-                hours_ = Hours.objects.get(date=date, entry__user=entry.user)
+            hours_ = self.hours.get(date)
+            if hours_:
                 help_text = ('Already logged %d hours on this day' %
                              hours_.hours)
-            except Hours.DoesNotExist:
+            else:
                 help_text = ''
-                hours_ = None
 
             choices = []
             choices.append((settings.WORK_DAY,
@@ -185,11 +189,7 @@ class ListFilterForm(BaseForm):
         # insert the blank one
         self.fields['country'].choices = [('', 'Any country')]
 
-        for each in (UserProfile.objects.exclude(country='')
-                     .values('country')
-                     .distinct()
-                     .order_by('country')):
-            country = each['country']
+        for country in get_profile_countries():
             self.fields['country'].choices.append((country, country))
 
 
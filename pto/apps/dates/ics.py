@@ -0,0 +1,94 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""A minimal iCalendar (RFC 5545) writer for the ptocalendar.ics feeds.
+
+It only knows the one VEVENT shape the feeds use but is a lot faster than
+building and serializing a `vobject.iCalendar`. Properties come out in the
+same order vobject would put them in.
+"""
+
+import datetime
+from django.utils.encoding import smart_str
+
+PRODID = '-//PYVOBJECT//NONSGML Version 1//EN'
+CRLF = '\r\n'
+LINE_LENGTH = 75  # octets, not counting the CRLF
+
+
+def escape_text(value):
+    """Escape a TEXT value (RFC 5545, 3.3.11)."""
+    return (value
+            .replace('\\', '\\\\')
+            .replace(';', '\\;')
+            .replace(',', '\\,')
+            .replace('\r\n', '\\n')
+            .replace('\n', '\\n')
+            .replace('\r', '\\n'))
+
+
+def fold_line(line, line_length=LINE_LENGTH):
+    """Return the utf-8 encoded `line` folded into lines of at most
+    `line_length` octets, without splitting multi-byte characters."""
+    if len(line) <= line_length:
+        return line + CRLF
+    parts = []
+    start = 0
+    width = line_length
+    while len(line) - start > width:
+        end = start + width
+        while end > start and (ord(line[end]) & 0xC0) == 0x80:
+            # don't break inside a utf-8 sequence
+            end -= 1
+        parts.append(line[start:end])
+        start = end
+        width = line_length - 1  # continuation lines start with a space
+    parts.append(line[start:])
+    return '\r\n '.join(parts) + CRLF
+
+
+def format_date(value):
+    return value.strftime('%Y%m%d')
+
+
+def format_datetime(value):
+    # naive datetimes are taken to be UTC
+    if value.tzinfo is not None:
+        value = (value - value.utcoffset()).replace(tzinfo=None)
+    return value.strftime('%Y%m%dT%H%M%SZ')
+
+
+def _property(name, value):
+    return fold_line('%s:%s' % (name, smart_str(value)))
+
+
+def _date_property(name, value):
+    if isinstance(value, datetime.datetime):
+        return _property(name, format_datetime(value))
+    return _property('%s;VALUE=DATE' % name, format_date(value))
+
+
+def iter_vcalendar(events, calname, dtstamp=None):
+    """Generator of the lines of a VCALENDAR made from `events`, an
+    iterable of dicts with the keys `uid`, `summary`, `dtstart`, `dtend`,
+    `url` and `description`."""
+    if dtstamp is None:
+        dtstamp = datetime.datetime.utcnow()
+    dtstamp = format_datetime(dtstamp)
+
+    yield _property('BEGIN', 'VCALENDAR')
+    yield _property('VERSION', '2.0')
+    yield _property('PRODID', PRODID)
+    for event in events:
+        yield _property('BEGIN', 'VEVENT')
+        yield _property('UID', escape_text(event['uid']))
+        yield _date_property('DTSTART', event['dtstart'])
+        yield _date_property('DTEND', event['dtend'])
+        yield _property('DESCRIPTION', escape_text(event['description']))
+        yield _property('DTSTAMP', dtstamp)
+        yield _property('SUMMARY', escape_text(event['summary']))
+        yield _property('URL', event['url'])
+        yield _property('END', 'VEVENT')
+    yield _property('X-WR-CALNAME', calname)
+    yield _property('END', 'VCALENDAR')
@@ -0,0 +1,42 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from pto.apps.dates.models import Entry, get_day_summaries
+from pto.apps.dates.utils import get_weekday_dates
+
+
+class Command(NoArgsCommand):
+    help = """
+    Fills in the denormalized day summary columns on every Entry from its
+    Hours rows.
+    """
+
+    BATCH_SIZE = 500
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = 0
+        batch = []
+        for entry in (Entry.objects
+                      .only('id', 'start', 'end')
+                      .order_by('id')
+                      .iterator()):
+            batch.append(entry)
+            if len(batch) >= self.BATCH_SIZE:
+                count += self._update(batch)
+                batch = []
+        count += self._update(batch)
+        print "Updated", count, "entries"
+
+    def _update(self, entries):
+        summaries = get_day_summaries([x.pk for x in entries])
+        for entry in entries:
+            summary = summaries[entry.pk]
+            summary['weekdays'] = len(list(get_weekday_dates(entry.start,
+                                                             entry.end)))
+            # .update() so that modify_date is left alone
+            Entry.objects.filter(pk=entry.pk).update(**summary)
+        return len(entries)
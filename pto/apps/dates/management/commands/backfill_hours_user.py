@@ -0,0 +1,28 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from pto.apps.dates.models import Entry, Hours
+
+
+class Command(NoArgsCommand):
+    help = """
+    Fills in the denormalized Hours.user column from Hours.entry.user
+    where it's missing.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        count = 0
+        user_ids = (Entry.objects
+                    .filter(hours__user__isnull=True)
+                    .values_list('user', flat=True)
+                    .order_by('user')
+                    .distinct())
+        for user_id in user_ids:
+            count += (Hours.objects
+                      .filter(entry__user=user_id, user__isnull=True)
+                      .update(user=user_id))
+        print "Updated", count, "hours"
@@ -0,0 +1,157 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import math
+import time
+from optparse import make_option
+from urllib import urlencode
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.utils import simplejson as json
+from pto.apps.dates.models import Entry, Hours, UserKey
+
+
+def percentile(values, percent):
+    """The nearest-rank `percent` percentile of `values`."""
+    values = sorted(values)
+    index = int(math.ceil(percent / 100.0 * len(values))) - 1
+    return values[max(index, 0)]
+
+
+def get_endpoints(user):
+    """Return a list of (name, url) to benchmark as `user`."""
+    today = datetime.date.today()
+    start = today - datetime.timedelta(days=30)
+    end = today + datetime.timedelta(days=60)
+    list_filter = {
+      'date_from': datetime.date(today.year, 1, 1).strftime('%d %B %Y'),
+      'date_to': datetime.date(today.year, 12, 31).strftime('%d %B %Y'),
+    }
+    list_json = dict(list_filter,
+                     sEcho=1,
+                     iDisplayStart=0,
+                     iDisplayLength=25,
+                     iSortingCols=1,
+                     iSortCol_0=0,
+                     sSortDir_0='desc')
+    user_key, __ = UserKey.objects.get_or_create(user=user)
+    return [
+      ('dates.home', reverse('dates.home')),
+      ('dates.calendar_events', '%s?%s' % (
+        reverse('dates.calendar_events'),
+        urlencode({'start': int(time.mktime(start.timetuple())),
+                   'end': int(time.mktime(end.timetuple()))}))),
+      ('dates.calendar_vcal', reverse('dates.calendar_vcal',
+                                      args=(user_key.key,))),
+      ('dates.list_json', '%s?%s' % (reverse('dates.list_json'),
+                                     urlencode(list_json))),
+      ('dates.list_csv', '%s?%s' % (reverse('dates.list_csv'),
+                                    urlencode(list_filter))),
+      ('dates.following', reverse('dates.following')),
+      ('mobile.right_now', reverse('mobile.right_now')),
+    ]
+
+
+class Command(BaseCommand):
+    help = """
+    Requests the busiest pages through the test client as --username and
+    prints their p50/p95 latency and query counts as JSON, so that runs
+    can be compared between commits. Run `generate_org` first to get
+    something realistic to run against; its second user (bench00002) is
+    a manager in the middle of the org.
+    """
+
+    option_list = BaseCommand.option_list + (
+                        make_option('--username', default='bench00002',
+                                    help="User to request the pages as "
+                                         "(Optional)"),
+                        make_option('--password', default='secret',
+                                    help="Their password (Optional)"),
+                        make_option('--iterations', type='int', default=50,
+                                    help="Timed requests per page "
+                                         "(Optional)"),
+                        make_option('--warmup', type='int', default=1,
+                                    help="Untimed requests per page first "
+                                         "(Optional)"),
+                        make_option('--label', default='',
+                                    help="Put in the report to tell runs "
+                                         "apart, e.g. a commit (Optional)"),
+                        make_option('--output', default=None,
+                                    help="File to write the JSON to instead "
+                                         "of stdout (Optional)"),
+    )
+
+    def handle(self, **options):
+        if options['iterations'] < 1:
+            raise CommandError("--iterations must be at least 1")
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError("No user called %r" % options['username'])
+        client = Client()
+        if not client.login(username=options['username'],
+                            password=options['password']):
+            raise CommandError("Unable to log in as %r"
+                               % options['username'])
+
+        report = {
+          'label': options['label'],
+          'date': datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+          'username': user.username,
+          'iterations': options['iterations'],
+          'warmup': options['warmup'],
+          'data': {
+            'users': User.objects.count(),
+            'entries': Entry.objects.count(),
+            'hours': Hours.objects.count(),
+          },
+          'endpoints': {},
+        }
+        # the debug cursor records every query even when settings.DEBUG
+        # is off
+        use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        try:
+            for name, url in get_endpoints(user):
+                report['endpoints'][name] = self._benchmark(client, url,
+                                                            options)
+        finally:
+            connection.use_debug_cursor = use_debug_cursor
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            print output
+
+    def _benchmark(self, client, url, options):
+        for i in range(options['warmup']):
+            client.get(url).content
+        timings = []
+        queries = []
+        statuses = set()
+        for i in range(options['iterations']):
+            first = len(connection.queries)
+            t0 = time.time()
+            response = client.get(url)
+            response.content  # in case it's generated lazily
+            timings.append((time.time() - t0) * 1000)
+            queries.append(len(connection.queries) - first)
+            statuses.add(response.status_code)
+            # don't let the list of queries grow for ever
+            del connection.queries[:]
+        return {
+          'url': url,
+          'status': sorted(statuses),
+          'p50_ms': round(percentile(timings, 50), 2),
+          'p95_ms': round(percentile(timings, 95), 2),
+          'mean_ms': round(sum(timings) / len(timings), 2),
+          'queries_p50': percentile(queries, 50),
+          'queries_max': max(queries),
+        }
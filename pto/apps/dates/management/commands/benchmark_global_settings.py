@@ -0,0 +1,68 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import time
+from optparse import make_option
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.template import context
+from django.test.client import RequestFactory
+from pto.apps.dates import views
+
+
+def all_settings(request):
+    """What the global_settings context processor used to return."""
+    return dict((k, getattr(settings, k)) for k in dir(settings)
+                if k[0].isupper())
+
+
+class Command(BaseCommand):
+    help = """
+    Times rendering dates/home.html with the whitelisted global_settings
+    context processor against putting every setting in the context, as it
+    used to.
+    """
+
+    option_list = BaseCommand.option_list + (
+                        make_option('--username', default=None,
+                                    help="User to render the dashboard for "
+                                         "(Optional)"),
+                        make_option('--iterations', type='int', default=200,
+                                    help="Requests per run (Optional)"),
+    )
+
+    def handle(self, **options):
+        users = User.objects.all()
+        if options['username']:
+            users = users.filter(username=options['username'])
+        try:
+            user = users.order_by('pk')[0]
+        except IndexError:
+            raise CommandError("No user to render the dashboard for")
+
+        request = RequestFactory().get(reverse('dates.home'))
+        request.user = user
+        request.session = {}
+        request.MOBILE = False
+
+        processors = context.get_standard_processors()
+        timings = []
+        try:
+            for extra in ((), (all_settings,)):
+                context._standard_context_processors = processors + extra
+                views.home(request)  # warm up
+                t0 = time.time()
+                for i in range(options['iterations']):
+                    views.home(request)
+                timings.append((time.time() - t0) / options['iterations'])
+        finally:
+            context._standard_context_processors = processors
+
+        whitelisted, everything = [x * 1000 for x in timings]
+        print "dates/home.html, %d requests each" % options['iterations']
+        print "  all settings:  %.2f ms/request" % everything
+        print "  whitelisted:   %.2f ms/request" % whitelisted
+        print "  saving:        %.2f ms/request" % (everything - whitelisted)
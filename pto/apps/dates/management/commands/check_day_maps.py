@@ -0,0 +1,91 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+from optparse import make_option
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from pto.apps.dates import daymap
+from pto.apps.dates.models import Hours
+
+
+def get_expected_maps(user_ids, origin):
+    """The maps the database says `user_ids` should have, worked out
+    independently of `daymap.build()` by asking SQL for the latest Hours of
+    every date."""
+    maps = dict((x, daymap.DayMap(origin)) for x in user_ids)
+    end = origin + datetime.timedelta(days=daymap.DayMap(origin).length - 1)
+    latest = [x['latest'] for x in (Hours.objects
+                                    .filter(user__in=user_ids,
+                                            date__gte=origin,
+                                            date__lte=end)
+                                    .values('user', 'date')
+                                    .annotate(latest=Max('id'))
+                                    .order_by())]
+    for user_id, date, hours, birthday in (Hours.objects
+                                           .filter(pk__in=latest)
+                                           .values_list('user', 'date',
+                                                        'hours',
+                                                        'birthday')):
+        maps[user_id].set_day(date, hours, birthday)
+    return maps
+
+
+def get_differences(cached, expected):
+    """The dates where two maps of the same window disagree."""
+    bits = (cached.out ^ expected.out) | (cached.half ^ expected.half)
+    dates = []
+    index = 0
+    while bits:
+        if bits & 1:
+            dates.append(cached.origin + datetime.timedelta(days=index))
+        bits >>= 1
+        index += 1
+    return dates
+
+
+class Command(BaseCommand):
+    help = """
+    Compares the cached maps of the days users are out with what the Hours
+    in the database say. Exits with an error if any of them disagree.
+    """
+
+    option_list = BaseCommand.option_list + (
+                        make_option('--fix', action='store_true',
+                                    default=False,
+                                    help="Drop the maps that are wrong so "
+                                         "they get rebuilt"),
+    )
+
+    BATCH_SIZE = 100
+
+    def handle(self, **options):
+        user_ids = list(User.objects.order_by('pk')
+                        .values_list('pk', flat=True))
+        origin = daymap.get_origin()
+        checked = 0
+        wrong = []
+        for i in range(0, len(user_ids), self.BATCH_SIZE):
+            batch = user_ids[i:i + self.BATCH_SIZE]
+            # maps for an old window get rebuilt when they're next used
+            cached = dict((k, v) for k, v in
+                          daymap.get_cached_maps(batch).items()
+                          if v.origin == origin)
+            expected = get_expected_maps(cached.keys(), origin)
+            for user_id, map_ in sorted(cached.items()):
+                checked += 1
+                differences = get_differences(map_, expected[user_id])
+                if differences:
+                    wrong.append(user_id)
+                    print "User %s: %d days differ, first on %s" % (
+                      user_id, len(differences), differences[0])
+
+        print "Checked", checked, "cached day maps,", len(wrong), "wrong"
+        if wrong:
+            if options['fix']:
+                daymap.invalidate(*wrong)
+                print "Dropped", len(wrong), "day maps"
+            else:
+                raise CommandError("%d day maps are wrong" % len(wrong))
@@ -0,0 +1,320 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import random
+from collections import defaultdict, deque
+from optparse import make_option
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from pto.apps.dates import feeds
+from pto.apps.dates.models import (Entry, Hours, FollowingUser,
+                                   BlacklistedUser)
+from pto.apps.dates.utils import get_weekday_dates
+from pto.apps.users.models import (UserProfile, PROFILE_COUNTRIES_CACHE_KEY,
+                                   PROFILE_CITIES_CACHE_KEY)
+
+FIRST_NAMES = (u'Peter', u'Laura', u'Jos\xe9', u'Mei', u'Anna', u'Tom',
+               u'Fatima', u'Lars', u'Priya', u'Kenji', u'Olga', u'Sam')
+LAST_NAMES = (u'Bengtsson', u'Smith', u'N\xfa\xf1ez', u'Chen', u'Ivanova',
+              u'Murphy', u'Haddad', u'Larsen', u'Patel', u'Tanaka')
+LOCATIONS = (('USA', 'Mountain View'), ('USA', 'San Francisco'),
+             ('Canada', 'Toronto'), ('France', 'Paris'),
+             ('Germany', 'Berlin'), ('UK', 'London'),
+             ('Taiwan', 'Taipei'), ('New Zealand', 'Auckland'))
+DETAILS = (u'Vacation', u'Family visit', u'Conference', u'Sick',
+           u'Moving house', u'')
+
+# keeps every INSERT well under SQLite's 999 variables limit
+BATCH_SIZE = 50
+
+
+def bulk_create(model, objects):
+    for i in range(0, len(objects), BATCH_SIZE):
+        model.objects.bulk_create(objects[i:i + BATCH_SIZE])
+
+
+def build_manager_tree(count, depth, fanout):
+    """Return a list of the index of everyone's manager (None for the
+    root). The tree is filled breadth first with up to `fanout` reports
+    per manager and `depth` levels below the root. When it is full the
+    rest go to the managers on the last level that can have reports."""
+    managers = [None]
+    levels = [0]
+    open_ = deque([0])
+    last_level = [0] if depth == 1 else []
+    reports = defaultdict(int)
+    for i in range(1, count):
+        if open_:
+            manager = open_[0]
+            reports[manager] += 1
+            if reports[manager] >= fanout:
+                open_.popleft()
+        else:
+            manager = last_level[i % len(last_level)]
+        managers.append(manager)
+        levels.append(levels[manager] + 1)
+        if levels[i] < depth:
+            open_.append(i)
+            if levels[i] == depth - 1:
+                last_level.append(i)
+    return managers
+
+
+class Command(BaseCommand):
+    help = """
+    Generates a realistic org to benchmark against: users in a manager tree,
+    follows and blacklists, and years of entries with their hours, some of
+    them edited (i.e. with reversal entries).
+    All generated users share the --password so they can log in.
+    """
+
+    option_list = BaseCommand.option_list + (
+                        make_option('--users', type='int', default=500,
+                                    help="Number of users (Optional)"),
+                        make_option('--depth', type='int', default=4,
+                                    help="Levels of managers below the top "
+                                         "(Optional)"),
+                        make_option('--fanout', type='int', default=6,
+                                    help="Reports per manager (Optional)"),
+                        make_option('--years', type='int', default=3,
+                                    help="Years of entries up to this one "
+                                         "(Optional)"),
+                        make_option('--entries-per-year', type='int',
+                                    default=6,
+                                    help="Entries per user and year "
+                                         "(Optional)"),
+                        make_option('--edit-rate', type='float', default=0.1,
+                                    help="Share of entries that get edited "
+                                         "(Optional)"),
+                        make_option('--follows', type='int', default=3,
+                                    help="Users each user follows "
+                                         "(Optional)"),
+                        make_option('--blacklists', type='int', default=1,
+                                    help="Users each user blacklists "
+                                         "(Optional)"),
+                        make_option('--prefix', default='bench',
+                                    help="Username prefix (Optional)"),
+                        make_option('--password', default='secret',
+                                    help="Everyone's password (Optional)"),
+                        make_option('--seed', type='int', default=0,
+                                    help="Random seed (Optional)"),
+                        make_option('--replace', action='store_true',
+                                    default=False,
+                                    help="Delete previously generated users "
+                                         "with the same prefix first"),
+    )
+
+    @transaction.commit_on_success
+    def handle(self, **options):
+        if options['users'] < 1:
+            raise CommandError("--users must be at least 1")
+        if options['depth'] < 1 or options['fanout'] < 1:
+            raise CommandError("--depth and --fanout must be at least 1")
+        if not 1 <= options['entries_per_year'] <= 52:
+            raise CommandError("--entries-per-year must be from 1 to 52")
+        self.random = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        existing = User.objects.filter(username__startswith=prefix)
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError("There already are %s* users. "
+                                   "Use --replace to delete them first."
+                                   % prefix)
+            self._delete(existing)
+
+        users = self._create_users(prefix, options['users'],
+                                   options['password'])
+        self._create_profiles(users, build_manager_tree(len(users),
+                                                        options['depth'],
+                                                        options['fanout']))
+        self._create_relations(users, options['follows'],
+                               options['blacklists'])
+        entry_count, hours_count = self._create_entries(
+          users,
+          options['years'],
+          options['entries_per_year'],
+          options['edit_rate']
+        )
+
+        call_command('rebuild_manager_closure')
+        call_command('rebuild_taken_hours')
+        # bulk_create() skips the signals that invalidate these
+        cache.delete_many([PROFILE_COUNTRIES_CACHE_KEY,
+                           PROFILE_CITIES_CACHE_KEY])
+        feeds.bump_versions(feeds.ORG)
+
+        print "Created", len(users), "users,",
+        print entry_count, "entries and", hours_count, "hours"
+        print "Log in as %s%05d (top manager) to %s%05d with password %r" % (
+          prefix, 1, prefix, len(users), options['password'])
+
+    def _delete(self, users):
+        ids = list(users.values_list('pk', flat=True))
+        Hours.objects.filter(entry__user__in=ids).delete()
+        Entry.objects.filter(user__in=ids).delete()
+        # clear the manager references first so deleting cascades nowhere
+        UserProfile.objects.filter(user__in=ids).update(manager_user=None)
+        for user in User.objects.filter(pk__in=ids):
+            user.delete()
+        print "Deleted", len(ids), "users"
+
+    def _create_users(self, prefix, count, password):
+        password = make_password(password)  # hashing is slow, do it once
+        now = datetime.datetime.now()
+        users = []
+        for i in range(count):
+            first_name = self.random.choice(FIRST_NAMES)
+            last_name = self.random.choice(LAST_NAMES)
+            username = '%s%05d' % (prefix, i + 1)
+            users.append(User(
+              username=username,
+              email='%s@example.com' % username,
+              first_name=first_name,
+              last_name=last_name,
+              password=password,
+              last_login=now,
+              date_joined=now,
+            ))
+        bulk_create(User, users)
+        # bulk_create() doesn't tell us the new primary keys
+        ids = dict(User.objects
+                   .filter(username__startswith=prefix)
+                   .values_list('username', 'pk'))
+        for user in users:
+            user.pk = ids[user.username]
+        return users
+
+    def _create_profiles(self, users, managers):
+        today = datetime.date.today()
+        profiles = []
+        for user, manager in zip(users, managers):
+            country, city = self.random.choice(LOCATIONS)
+            start_date = today - datetime.timedelta(
+              days=self.random.randint(30, 365 * 10))
+            profile = UserProfile(
+              user_id=user.pk,
+              start_date=start_date,
+              office='%s:::%s' % (city, country),
+              country=country,
+              city=city,
+            )
+            if manager is not None:
+                profile.manager = users[manager].email
+                profile.manager_user_id = users[manager].pk
+            profiles.append(profile)
+        bulk_create(UserProfile, profiles)
+
+    def _create_relations(self, users, follows, blacklists):
+        if len(users) < 2:
+            return
+        following = []
+        blacklisted = []
+        for user in users:
+            count = min(follows + blacklists, len(users) - 1)
+            others = set()
+            while len(others) < count:
+                other = self.random.choice(users)
+                if other.pk != user.pk:
+                    others.add(other.pk)
+            others = sorted(others)
+            self.random.shuffle(others)
+            for other_id in others[:follows]:
+                following.append(FollowingUser(follower_id=user.pk,
+                                               following_id=other_id))
+            for other_id in others[follows:]:
+                blacklisted.append(BlacklistedUser(observer_id=user.pk,
+                                                   observable_id=other_id))
+        bulk_create(FollowingUser, following)
+        bulk_create(BlacklistedUser, blacklisted)
+
+    def _make_entry(self, user, start, end, details, hours):
+        """Return an unsaved Entry and its (date, hours) in the shape
+        save_entry_hours() would have left them."""
+        entry = Entry(
+          user_id=user.pk,
+          start=start,
+          end=end,
+          details=details,
+          total_hours=sum(hours.values()),
+          weekdays=len(list(get_weekday_dates(start, end))),
+        )
+        # what update_day_summary() would count from the Hours rows
+        for value in hours.values():
+            if value == settings.WORK_DAY:
+                entry.full_days += 1
+            elif value == settings.WORK_DAY / 2:
+                entry.half_days += 1
+        return entry, hours
+
+    def _user_entries(self, user, years, per_year, edit_rate):
+        this_year = datetime.date.today().year
+        half_day = settings.WORK_DAY / 2
+        for year in range(this_year - years + 1, this_year + 1):
+            # one entry in each slot of the year so they never overlap
+            slot = 365 / per_year
+            for i in range(per_year):
+                start = (datetime.date(year, 1, 1) +
+                         datetime.timedelta(days=i * slot +
+                                            self.random.randint(0, slot / 2)))
+                while start.weekday() > 4:
+                    start += datetime.timedelta(days=1)
+                length = max(1, min(self.random.choice((1, 1, 2, 3, 5, 10)),
+                                    slot / 2 - 2))
+                end = start + datetime.timedelta(days=length - 1)
+                dates = list(get_weekday_dates(start, end))
+                hours = dict((x, settings.WORK_DAY) for x in dates)
+                if self.random.random() < 0.2:
+                    hours[dates[-1]] = half_day
+                details = self.random.choice(DETAILS)
+                yield self._make_entry(user, start, end, details, hours)
+
+                if len(dates) > 1 and self.random.random() < edit_rate:
+                    # editing turns one day into a half day: the old hours
+                    # are reversed by an entry of negative hours and a new
+                    # entry is added for the new hours
+                    date = self.random.choice(dates[1:])
+                    yield self._make_entry(user, date, date, details,
+                                           {date: -hours[date]})
+                    yield self._make_entry(user, date, date, details,
+                                           {date: half_day})
+
+    def _create_entries(self, users, years, per_year, edit_rate):
+        entry_count = hours_count = 0
+        # a few hundred users at a time keeps memory use flat
+        for i in range(0, len(users), 200):
+            batch = users[i:i + 200]
+            made = []
+            for user in batch:
+                made.extend(self._user_entries(user, years, per_year,
+                                               edit_rate))
+            bulk_create(Entry, [entry for entry, __ in made])
+
+            # every entry of a user is unique by its start date and whether
+            # it's a reversal
+            ids = {}
+            for pk, user_id, start, total_hours in (
+                Entry.objects
+                .filter(user__in=[x.pk for x in batch])
+                .values_list('pk', 'user', 'start', 'total_hours')):
+                ids[(user_id, start, total_hours < 0)] = pk
+            hours = []
+            for entry, dates in made:
+                entry_id = ids[(entry.user_id, entry.start,
+                                entry.total_hours < 0)]
+                for date, value in sorted(dates.items()):
+                    hours.append(Hours(entry_id=entry_id,
+                                       user_id=entry.user_id,
+                                       date=date,
+                                       hours=value))
+            bulk_create(Hours, hours)
+            entry_count += len(made)
+            hours_count += len(hours)
+        return entry_count, hours_count
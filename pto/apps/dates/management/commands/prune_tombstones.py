@@ -0,0 +1,25 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from pto.apps.dates.models import Tombstone
+
+
+class Command(NoArgsCommand):
+    help = """
+    Deletes the tombstones older than settings.SYNC_TOMBSTONE_DAYS. Mobile
+    clients that haven't synced since get everything again anyway.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        oldest = (datetime.datetime.now() -
+                  datetime.timedelta(days=settings.SYNC_TOMBSTONE_DAYS))
+        tombstones = Tombstone.objects.filter(add_date__lt=oldest)
+        count = tombstones.count()
+        tombstones.delete()
+        print "Deleted", count, "tombstones"
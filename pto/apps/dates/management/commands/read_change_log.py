@@ -0,0 +1,57 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import json
+from optparse import make_option
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pto.apps.dates import changelog
+from pto.apps.dates.csv_export import iter_csv
+
+
+class Command(BaseCommand):
+    help = """
+    Writes the changes to entries and hours after a sequence number to
+    stdout, as CSV or as one JSON object per line.
+    """
+
+    option_list = BaseCommand.option_list + (
+                        make_option('--since', type='int', default=0,
+                                    help="Sequence number of the last "
+                                         "change already read"),
+                        make_option('--limit', type='int', default=None,
+                                    help="Most changes to write (default "
+                                         "all of them)"),
+                        make_option('--format', default='csv',
+                                    choices=('csv', 'json'),
+                                    help="csv or json"),
+    )
+
+    def handle(self, **options):
+        if options['since'] < 0:
+            raise CommandError("--since can't be negative")
+        out = self.stdout
+        if options['format'] == 'csv':
+            out.write(''.join(iter_csv([changelog.CSV_HEADER])))
+        for changes in self.iter_pages(options['since'], options['limit']):
+            if options['format'] == 'csv':
+                for chunk in iter_csv(changelog.get_csv_rows(changes)):
+                    out.write(chunk)
+            else:
+                for each in changelog.get_dicts(changes):
+                    out.write(json.dumps(each) + '\n')
+
+    def iter_pages(self, since, limit):
+        more = True
+        while more and (limit is None or limit > 0):
+            page_size = settings.CHANGE_LOG_PAGE_SIZE
+            if limit is not None:
+                page_size = min(page_size, limit)
+            changes, more = changelog.get_changes(since, page_size)
+            if not changes:
+                break
+            yield changes
+            since = changes[-1].seq
+            if limit is not None:
+                limit -= len(changes)
@@ -0,0 +1,23 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+from pto.apps.dates import daymap
+
+
+class Command(NoArgsCommand):
+    help = """
+    Builds every user's map of the days they are out, from their Hours,
+    into the cache.
+    """
+
+    BATCH_SIZE = 500
+
+    def handle_noargs(self, **options):
+        user_ids = list(User.objects.order_by('pk')
+                        .values_list('pk', flat=True))
+        for i in range(0, len(user_ids), self.BATCH_SIZE):
+            daymap.rebuild(user_ids[i:i + self.BATCH_SIZE])
+        print "Built", len(user_ids), "day maps"
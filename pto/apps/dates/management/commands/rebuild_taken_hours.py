@@ -0,0 +1,28 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from pto.apps.dates.models import Hours, TakenHours, get_taken_deltas
+
+
+class Command(NoArgsCommand):
+    help = """
+    Recreates the yearly TakenHours rollup from every Hours row. Run
+    backfill_hours_user first, rows without a user aren't counted.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        taken = get_taken_deltas(Hours.objects
+                                 .filter(user__isnull=False)
+                                 .values_list('user', 'date', 'hours')
+                                 .iterator())
+        rows = [
+          TakenHours(user_id=user_id, year=year, hours=hours)
+          for (user_id, year), hours in sorted(taken.items())
+        ]
+        TakenHours.objects.all().delete()
+        TakenHours.objects.bulk_create(rows)
+        print "Created", len(rows), "taken hours rows"
@@ -0,0 +1,30 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from optparse import make_option
+from django.core.management.base import NoArgsCommand
+from pto.apps.dates.outbox import send_queued_email
+
+
+class Command(NoArgsCommand):
+    help = """
+    Sends the queued notification emails that are due, retrying failed
+    ones with an exponential back off. Run it from cron or a supervisor.
+    """
+
+    option_list = NoArgsCommand.option_list + (
+                        make_option('--batch-size', type='int', default=100,
+                                    help="Emails per batch (Optional)"),
+                        make_option('--max-attempts', type='int', default=5,
+                                    help="Give up after this many failures "
+                                         "(Optional)"),
+    )
+
+    def handle_noargs(self, **options):
+        sent, failed = send_queued_email(
+          batch_size=options['batch_size'],
+          max_attempts=options['max_attempts'],
+        )
+        if int(options.get('verbosity', 1)):
+            print "Sent", sent, "emails,", failed, "failed"
@@ -4,11 +4,18 @@
 
 import uuid
 import datetime
+from collections import defaultdict
 from django.db import models
 from django.contrib.auth.models import User
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save
+from django.db.models import Count, F
+from django.db.models.signals import (post_save, pre_save, post_delete,
+                                      pre_delete, post_init)
 from django.conf import settings
+from pto.apps.users.models import UserProfile
+from .utils import get_weekday_dates
+from . import feeds
+from . import daymap
 
 
 class FollowingIntegrityError(ValueError):
@@ -19,6 +26,13 @@ class BlacklistIntegityError(ValueError):
     pass
 
 
+def hours_to_days(total_hours):
+    days = total_hours / settings.WORK_DAY
+    if total_hours % settings.WORK_DAY:
+        days += 0.5
+    return days
+
+
 class Entry(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT)
     total_hours = models.IntegerField(null=True, blank=True)
@@ -28,7 +42,13 @@ class Entry(models.Model):
 
     add_date = models.DateTimeField(default=datetime.datetime.utcnow)
     modify_date = models.DateTimeField(default=datetime.datetime.utcnow,
-                                       auto_now=True)
+                                       auto_now=True, db_index=True)
+
+    # denormalized from the Hours rows, see update_day_summary()
+    full_days = models.IntegerField(default=0)
+    half_days = models.IntegerField(default=0)
+    birthday = models.BooleanField(default=False)
+    weekdays = models.IntegerField(default=0)
 
     def __repr__(self):  # pragma: no cover
         return '<Entry: %s, %s - %s>' % (self.user,
@@ -37,10 +57,64 @@ class Entry(models.Model):
 
     @property
     def total_days(self):
-        days = self.total_hours / settings.WORK_DAY
-        if self.total_hours % settings.WORK_DAY:
-            days += 0.5
-        return days
+        return hours_to_days(self.total_hours)
+
+    @property
+    def days(self):
+        if self.half_days:
+            return self.full_days + 0.5 * self.half_days
+        return self.full_days
+
+    def update_day_summary(self):
+        self.weekdays = len(list(get_weekday_dates(self.start, self.end)))
+        summary = EMPTY_DAY_SUMMARY
+        if self.pk:
+            summary = get_day_summaries([self.pk])[self.pk]
+        for key, value in summary.items():
+            setattr(self, key, value)
+
+
+class HoursQuerySet(models.query.QuerySet):
+    """The Hours signals keep the day summaries on Entry, the TakenHours
+    and the day maps up to date but `update()` and `bulk_create()` don't
+    send any, so these update them for the rows they touch themselves."""
+
+    # the fields that the day summaries, TakenHours and day maps are
+    # made from
+    FIELDS = ('entry', 'entry_id', 'user', 'user_id', 'date', 'hours',
+              'birthday')
+
+    def update(self, **kwargs):
+        if not set(kwargs) & set(self.FIELDS):
+            return super(HoursQuerySet, self).update(**kwargs)
+        columns = ('pk', 'entry', 'user', 'date', 'hours')
+        before = list(self.values_list(*columns))
+        rows = super(HoursQuerySet, self).update(**kwargs)
+        after = list(self.model.objects
+                     .filter(pk__in=[x[0] for x in before])
+                     .values_list(*columns))
+        update_day_summaries(set(x[1] for x in before + after))
+        deltas = get_taken_deltas([x[2:] for x in after])
+        for key, hours in get_taken_deltas([x[2:] for x in before],
+                                           sign=-1).items():
+            deltas[key] += hours
+        update_taken_hours(deltas)
+        _invalidate_day_maps(x[2] for x in before + after)
+        return rows
+
+    def bulk_create(self, objs):
+        objs = super(HoursQuerySet, self).bulk_create(objs)
+        update_day_summaries(set(x.entry_id for x in objs))
+        update_taken_hours(get_taken_deltas((x.user_id, x.date, x.hours)
+                                            for x in objs))
+        _invalidate_day_maps(x.user_id for x in objs)
+        return objs
+
+
+class HoursManager(models.Manager):
+
+    def get_query_set(self):
+        return HoursQuerySet(self.model, using=self._db)
 
 
 class Hours(models.Model):
@@ -48,6 +122,152 @@ class Hours(models.Model):
     hours = models.IntegerField()
     date = models.DateField()
     birthday = models.BooleanField(default=False)
+    # denormalized from entry.user so that "what has this user logged on
+    # these dates" doesn't need a join. There's a composite (user, date)
+    # index on it, see migrations/05-hours-user.sql
+    user = models.ForeignKey(User, null=True, blank=True)
+
+    objects = HoursManager()
+
+
+def get_hours_by_date(user, start, end):
+    """Return a dict of date -> Hours of everything `user` has logged from
+    `start` to `end` (inclusive), in one query. Dates that have been logged
+    more than once (see `save_entry_hours`) map to the latest row."""
+    hours = {}
+    for each in (Hours.objects
+                 .filter(user=user, date__gte=start, date__lte=end)
+                 .order_by('pk')):
+        hours[each.date] = each
+    return hours
+
+
+EMPTY_DAY_SUMMARY = {'full_days': 0, 'half_days': 0, 'birthday': False}
+
+
+def get_day_summaries(entry_ids):
+    """Return a dict of entry ID -> full days, half days and birthday flag
+    counted from the Hours rows, in one grouped query."""
+    summaries = dict((x, dict(EMPTY_DAY_SUMMARY)) for x in entry_ids)
+    if not summaries:
+        return summaries
+    for each in (Hours.objects
+                 .filter(entry__in=summaries.keys())
+                 .values('entry', 'hours', 'birthday')
+                 .annotate(count=Count('id'))
+                 .order_by()):
+        summary = summaries[each['entry']]
+        if each['hours'] == settings.WORK_DAY:
+            summary['full_days'] += each['count']
+        elif each['hours'] == settings.WORK_DAY / 2:
+            summary['half_days'] += each['count']
+        if each['birthday']:
+            summary['birthday'] = True
+    return summaries
+
+
+def update_day_summaries(entry_ids):
+    """Recalculate the day summaries of the entries from their Hours.
+    Entries with the same summary are updated together, so this is a
+    handful of queries however many entries there are. `modify_date` is
+    bumped like a save would, so that the mobile sync sends them again."""
+    by_summary = defaultdict(list)
+    for entry_id, summary in get_day_summaries(entry_ids).items():
+        by_summary[tuple(sorted(summary.items()))].append(entry_id)
+    # auto_now uses the local time
+    now = datetime.datetime.now()
+    for summary, ids in by_summary.items():
+        (Entry.objects
+         .filter(pk__in=ids)
+         .update(modify_date=now, **dict(summary)))
+
+
+@receiver(pre_save, sender=Entry)
+def entry_day_summary(sender, instance, **kwargs):
+    instance.update_day_summary()
+
+
+@receiver(pre_save, sender=Hours)
+def hours_user(sender, instance, **kwargs):
+    if not instance.user_id:
+        instance.user_id = instance.entry.user_id
+
+
+@receiver(post_save, sender=Hours)
+@receiver(post_delete, sender=Hours)
+def hours_day_summary(sender, instance, **kwargs):
+    # changes in bulk are taken care of by HoursQuerySet
+    update_day_summaries([instance.entry_id])
+
+
+class TakenHours(models.Model):
+    """How many hours `user` has taken in `year`, rolled up from their
+    Hours rows so that an entry over New Year counts each day in its own
+    year. Kept up to date by the Hours signals below and by HoursQuerySet
+    for the changes in bulk. Use the `rebuild_taken_hours` command to
+    recompute it."""
+    user = models.ForeignKey(User)
+    year = models.IntegerField()
+    hours = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'year')
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %s %d: %d>' % (self.__class__.__name__,
+                                    self.user_id,
+                                    self.year,
+                                    self.hours)
+
+
+def get_taken_deltas(rows, sign=1):
+    """Return a dict of (user ID, year) -> hours summed from (user ID,
+    date, hours) of Hours rows, each day counting in its own year."""
+    deltas = defaultdict(int)
+    for user_id, date, hours in rows:
+        deltas[(user_id, date.year)] += sign * hours
+    return deltas
+
+
+def update_taken_hours(deltas):
+    """Add a dict of (user ID, year) -> hours to the TakenHours."""
+    for (user_id, year), hours in deltas.items():
+        # rows that haven't had their user backfilled yet
+        if not hours or user_id is None:
+            continue
+        taken, __ = TakenHours.objects.get_or_create(user_id=user_id,
+                                                     year=year)
+        (TakenHours.objects
+         .filter(pk=taken.pk)
+         .update(hours=F('hours') + hours))
+
+
+@receiver(pre_save, sender=Hours)
+def remember_previous_taken_hours(sender, instance, **kwargs):
+    instance._previous_taken_hours = {}
+    if instance.pk:
+        instance._previous_taken_hours = get_taken_deltas(
+          Hours.objects
+          .filter(pk=instance.pk)
+          .values_list('user', 'date', 'hours'),
+          sign=-1
+        )
+
+
+@receiver(post_save, sender=Hours)
+def hours_taken_hours(sender, instance, **kwargs):
+    deltas = get_taken_deltas([(instance.user_id, instance.date,
+                                instance.hours)])
+    for key, hours in getattr(instance, '_previous_taken_hours',
+                              {}).items():
+        deltas[key] += hours
+    update_taken_hours(deltas)
+
+
+@receiver(post_delete, sender=Hours)
+def hours_deleted_taken_hours(sender, instance, **kwargs):
+    update_taken_hours(get_taken_deltas([(instance.user_id, instance.date,
+                                          instance.hours)], sign=-1))
 
 
 class BlacklistedUser(models.Model):
@@ -120,3 +340,236 @@ class UserKey(models.Model):
 
     def __repr__(self):
         return '<%s: %r>' % (self.__class__.__name__, self.key)
+
+
+@receiver(post_delete, sender=UserKey)
+def calendar_feed_delete(sender, instance, **kwargs):
+    feeds.delete_feed(instance.key)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def calendar_feed_entry_changed(sender, instance, **kwargs):
+    feeds.bump_versions(instance.user_id)
+
+
+@receiver(post_save, sender=Hours)
+@receiver(post_delete, sender=Hours)
+def calendar_feed_hours_changed(sender, instance, **kwargs):
+    # the number of days in the event titles is counted from the hours
+    if instance.user_id:
+        feeds.bump_versions(instance.user_id)
+
+
+def _invalidate_day_maps(user_ids):
+    user_ids = set(x for x in user_ids if x)
+    if user_ids:
+        daymap.invalidate(*user_ids)
+
+
+@receiver(post_save, sender=Hours)
+@receiver(post_delete, sender=Hours)
+def day_map_hours_changed(sender, instance, **kwargs):
+    _invalidate_day_maps([instance.user_id])
+
+
+@receiver(post_save, sender=FollowingUser)
+@receiver(post_delete, sender=FollowingUser)
+def calendar_feed_following_changed(sender, instance, **kwargs):
+    feeds.bump_versions(instance.follower_id)
+
+
+@receiver(post_save, sender=BlacklistedUser)
+@receiver(post_delete, sender=BlacklistedUser)
+def calendar_feed_blacklist_changed(sender, instance, **kwargs):
+    feeds.bump_versions(instance.observer_id)
+
+
+# what of a User is in the event titles
+FEED_USER_FIELDS = ('username', 'first_name', 'last_name')
+
+
+def _feed_user_values(user):
+    return tuple(getattr(user, x) for x in FEED_USER_FIELDS)
+
+
+@receiver(post_init, sender=User)
+def remember_feed_user_values(sender, instance, **kwargs):
+    instance._feed_user_values = _feed_user_values(instance)
+
+
+@receiver(post_save, sender=User)
+def calendar_feed_user_changed(sender, instance, created, **kwargs):
+    # not on every login, which saves last_login
+    values = _feed_user_values(instance)
+    if created or values != getattr(instance, '_feed_user_values', None):
+        feeds.bump_versions(instance.pk)
+    instance._feed_user_values = values
+
+
+@receiver(post_save, sender=UserProfile)
+def calendar_feed_manager_changed(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_manager_user_id', None)
+    if previous != instance.manager_user_id:
+        feeds.bump_versions(feeds.ORG)
+
+
+@receiver(pre_delete, sender=User)
+def calendar_feed_user_deleted(sender, instance, **kwargs):
+    feeds.bump_versions(feeds.ORG)
+
+
+class Tombstone(models.Model):
+    """A record of something that the mobile sync can't tell from
+    Entry.modify_date alone: a deleted entry, a follow or blacklist that
+    changed or a change to the org chart. Old ones are removed by the
+    `prune_tombstones` command."""
+    ENTRY = 'entry'
+    FOLLOWING = 'following'
+    BLACKLIST = 'blacklist'
+    ORG = 'org'
+
+    kind = models.CharField(max_length=20)
+    # the owner of the entry, the follower, the observer or the user whose
+    # manager changed. Not a ForeignKey so that deleting a user, which
+    # deletes their follows, can leave tombstones behind.
+    user_id = models.IntegerField()
+    # the entry, the followed or observed user or the new manager
+    object_id = models.IntegerField(null=True)
+    # like Entry.modify_date, in server local time
+    add_date = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %s %s %s>' % (self.__class__.__name__,
+                                   self.kind,
+                                   self.user_id,
+                                   self.object_id)
+
+
+@receiver(post_delete, sender=Entry)
+def tombstone_entry_deleted(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.ENTRY,
+                             user_id=instance.user_id,
+                             object_id=instance.pk)
+
+
+@receiver(post_save, sender=FollowingUser)
+@receiver(post_delete, sender=FollowingUser)
+def tombstone_following_changed(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.FOLLOWING,
+                             user_id=instance.follower_id,
+                             object_id=instance.following_id)
+
+
+@receiver(post_save, sender=BlacklistedUser)
+@receiver(post_delete, sender=BlacklistedUser)
+def tombstone_blacklist_changed(sender, instance, **kwargs):
+    Tombstone.objects.create(kind=Tombstone.BLACKLIST,
+                             user_id=instance.observer_id,
+                             object_id=instance.observable_id)
+
+
+@receiver(post_save, sender=UserProfile)
+def tombstone_manager_changed(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_manager_user_id', None)
+    if previous != instance.manager_user_id:
+        Tombstone.objects.create(kind=Tombstone.ORG,
+                                 user_id=instance.user_id,
+                                 object_id=instance.manager_user_id)
+
+
+class ChangeLog(models.Model):
+    """An append-only record of every create, update and delete of Entry
+    and Hours so that payroll and HR systems can fetch what changed since
+    the last `seq` they saw instead of the whole list export. Written by
+    the signals below and by `save_entry_hours` for the rows it bulk
+    inserts. Read it with `dates.changes_json`, `dates.changes_csv` or the
+    `read_change_log` command."""
+    ENTRY = 'entry'
+    HOURS = 'hours'
+
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+
+    # the monotonic sequence number consumers page by
+    seq = models.AutoField(primary_key=True)
+    model = models.CharField(max_length=10)
+    action = models.CharField(max_length=10)
+    object_id = models.IntegerField()
+    # these aren't ForeignKeys so that the log outlives the rows. For
+    # entries `entry_id` is the same as `object_id`.
+    user_id = models.IntegerField(null=True)
+    entry_id = models.IntegerField()
+    # the row after the change, or as it was deleted. `start` and `end`
+    # are for entries, `date` and `birthday` for hours and `hours` is the
+    # total_hours of an entry or the hours of a day.
+    start = models.DateField(null=True)
+    end = models.DateField(null=True)
+    date = models.DateField(null=True)
+    hours = models.IntegerField(null=True)
+    birthday = models.BooleanField(default=False)
+    add_date = models.DateTimeField(default=datetime.datetime.utcnow)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %d %s %s %s>' % (self.__class__.__name__,
+                                      self.seq,
+                                      self.action,
+                                      self.model,
+                                      self.object_id)
+
+
+def make_change_log(action, instance):
+    """Return an unsaved ChangeLog of `action` on an Entry or Hours."""
+    if isinstance(instance, Entry):
+        return ChangeLog(model=ChangeLog.ENTRY,
+                         action=action,
+                         object_id=instance.pk,
+                         user_id=instance.user_id,
+                         entry_id=instance.pk,
+                         start=instance.start,
+                         end=instance.end,
+                         hours=instance.total_hours)
+    return ChangeLog(model=ChangeLog.HOURS,
+                     action=action,
+                     object_id=instance.pk,
+                     user_id=instance.user_id,
+                     entry_id=instance.entry_id,
+                     date=instance.date,
+                     hours=instance.hours,
+                     birthday=instance.birthday)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_save, sender=Hours)
+def change_log_saved(sender, instance, created, **kwargs):
+    action = created and ChangeLog.CREATE or ChangeLog.UPDATE
+    make_change_log(action, instance).save()
+
+
+@receiver(post_delete, sender=Entry)
+@receiver(post_delete, sender=Hours)
+def change_log_deleted(sender, instance, **kwargs):
+    make_change_log(ChangeLog.DELETE, instance).save()
+
+
+class OutboxEmail(models.Model):
+    """An email waiting to be sent by the `send_queued_email` command."""
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=100)
+    to_addresses = models.TextField()  # one per line
+    cc_addresses = models.TextField(blank=True)  # one per line
+    add_date = models.DateTimeField(default=datetime.datetime.utcnow)
+    send_after = models.DateTimeField(default=datetime.datetime.utcnow,
+                                      db_index=True)
+    sent_date = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # the `send_queued_email` run that last claimed it
+    claim = models.CharField(max_length=32, blank=True)
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %r to %s>' % (self.__class__.__name__,
+                                   self.subject,
+                                   self.to_addresses.replace('\n', ', '))
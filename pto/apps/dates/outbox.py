@@ -0,0 +1,140 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import logging
+import smtplib
+import socket
+import uuid
+from django.core.mail import get_connection, EmailMessage
+from django.db import transaction
+from pto.base.instrumentation import record
+from .models import OutboxEmail
+
+
+def queue_email(subject, body, from_email, to, cc=None):
+    """Store an email for the `send_queued_email` command to send.
+
+    Because it's a row written in the caller's transaction nothing gets
+    sent unless (and until) that transaction commits.
+    """
+    record('email', 'emails')
+    return OutboxEmail.objects.create(
+      subject=subject,
+      body=body,
+      from_email=from_email,
+      to_addresses='\n'.join(to),
+      cc_addresses='\n'.join(cc or []),
+    )
+
+
+# how long a run has to send the emails it has claimed before another
+# run may take them over
+CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+# errors that mean the SMTP connection is gone rather than that there's
+# something wrong with the email being sent
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, socket.error)
+
+
+def retry_delay(attempts):
+    """Back off exponentially: 2, 4, 8, ... minutes."""
+    return datetime.timedelta(minutes=2 ** attempts)
+
+
+def claim_batch(claim, batch_size, max_attempts):
+    """Claim up to `batch_size` of the emails that are due for the run
+    identified by `claim` and return the ones it got. Returns None when
+    nothing is due.
+
+    The claim pushes `send_after` out by CLAIM_TIMEOUT in one UPDATE that
+    only matches rows that are still due, so of two overlapping runs only
+    one gets each email. If a run dies its emails become due again once
+    the claim times out."""
+    now = datetime.datetime.utcnow()
+    due = OutboxEmail.objects.filter(sent_date__isnull=True,
+                                     send_after__lte=now,
+                                     attempts__lt=max_attempts)
+    ids = list(due
+               .order_by('send_after', 'pk')
+               .values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return None
+    due.filter(pk__in=ids).update(claim=claim,
+                                  send_after=now + CLAIM_TIMEOUT)
+    transaction.commit_unless_managed()
+    return list(OutboxEmail.objects
+                .filter(pk__in=ids, claim=claim)
+                .order_by('pk'))
+
+
+def send_queued_email(batch_size=100, max_attempts=5):
+    """Send everything that's due in batches of `batch_size` over a single
+    SMTP connection. Returns a (sent, failed) tuple of counts.
+
+    If the connection drops it's reopened and the email tried again
+    without counting that as one of its attempts. If that fails too the
+    run stops with the error and the rest of its emails are sent once
+    their claim times out."""
+    sent = failed = 0
+    claim = uuid.uuid4().hex
+    connection = get_connection()
+    connection.open()
+    try:
+        while True:
+            batch = claim_batch(claim, batch_size, max_attempts)
+            if batch is None:
+                break
+            for email in batch:
+                try:
+                    ok = _send(email, connection)
+                except CONNECTION_ERRORS:
+                    logging.warning('Lost the SMTP connection, reconnecting',
+                                    exc_info=True)
+                    _close(connection)
+                    # sending opens a new connection
+                    ok = _send(email, connection)
+                if ok:
+                    sent += 1
+                else:
+                    failed += 1
+            transaction.commit_unless_managed()
+    finally:
+        _close(connection)
+    return sent, failed
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except CONNECTION_ERRORS:
+        # it's gone anyway
+        pass
+
+
+def _send(email, connection):
+    message = EmailMessage(
+      subject=email.subject,
+      body=email.body,
+      from_email=email.from_email,
+      to=email.to_addresses.splitlines(),
+      cc=email.cc_addresses.splitlines() or None,
+      connection=connection,
+    )
+    try:
+        message.send()
+    except CONNECTION_ERRORS:
+        raise
+    except Exception, exc:
+        email.attempts += 1
+        logging.warning('Failed to send %r' % email, exc_info=True)
+        email.last_error = '%s: %s' % (exc.__class__.__name__, exc)
+        email.send_after = (datetime.datetime.utcnow() +
+                            retry_delay(email.attempts))
+        email.save()
+        return False
+    email.attempts += 1
+    email.sent_date = datetime.datetime.utcnow()
+    email.save()
+    return True
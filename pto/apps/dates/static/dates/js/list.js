@@ -125,8 +125,7 @@ var Filter = (function() {
 function loadDataTable() {
   $('#pto_table').dataTable({
     bProcessing: true,
-    bDeferRender: true,  // creates page 2 and onwards TRs once loaded
-    //bServerSide: true,  // more scalable but more work (for later)
+    bServerSide: true,  // paging, sorting and searching done by list_json
     sAjaxSource: Data.href(),
     //aaSorting: [[ 2, 'asc' ],[ 1, 'asc' ],[ 3, 'desc' ]],
     aaSorting: [[ 5, 'asc' ],],
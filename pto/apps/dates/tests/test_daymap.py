@@ -0,0 +1,127 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from nose.tools import eq_, ok_
+from test_utils import TestCase
+from pto.apps.dates import daymap
+from pto.apps.dates.models import Entry, Hours
+
+
+def _monday():
+    """A Monday in March of this year, well inside the window."""
+    date = datetime.date(datetime.date.today().year, 3, 1)
+    return date + datetime.timedelta(days=(7 - date.weekday()) % 7)
+
+
+class DayMapTest(TestCase):
+
+    def setUp(self):
+        super(DayMapTest, self).setUp()
+        cache.clear()
+
+    def _add(self, user, date, hours, birthday=False):
+        entry = Entry.objects.create(user=user, start=date, end=date,
+                                     total_hours=hours)
+        return Hours.objects.create(entry=entry, date=date, hours=hours,
+                                    birthday=birthday)
+
+    def test_day_map(self):
+        monday = _monday()
+        day = datetime.timedelta(days=1)
+        map_ = daymap.DayMap(daymap.get_origin())
+        map_.set_day(monday, settings.WORK_DAY)
+        map_.set_day(monday + day, settings.WORK_DAY / 2)
+        map_.set_day(monday + day * 2, 0, birthday=True)
+        map_.set_day(monday + day * 4, settings.WORK_DAY)
+        map_.set_day(monday + day * 7, settings.WORK_DAY)
+        # reversed
+        map_.set_day(monday + day * 9, settings.WORK_DAY)
+        map_.set_day(monday + day * 9, -settings.WORK_DAY)
+        # outside the window
+        map_.set_day(datetime.date(1999, 1, 1), settings.WORK_DAY)
+
+        ok_(map_.is_out(monday))
+        ok_(not map_.is_half(monday))
+        ok_(map_.is_half(monday + day))
+        ok_(map_.is_out(monday + day * 2))
+        ok_(not map_.is_half(monday + day * 2))
+        ok_(not map_.is_out(monday + day * 3))
+        ok_(not map_.is_out(monday + day * 9))
+        ok_(not map_.is_out(datetime.date(1999, 1, 1)))
+        ok_(map_.is_out_between(monday + day * 3, monday + day * 4))
+        ok_(not map_.is_out_between(monday + day * 8, monday + day * 10))
+        eq_(map_.days_out(monday - day * 100, monday + day * 2),
+            [monday, monday + day, monday + day * 2])
+        # Friday and the next Monday are one absence
+        eq_(map_.absences(monday + day * 2, monday + day * 20),
+            [(monday, monday + day * 2),
+             (monday + day * 4, monday + day * 7)])
+
+    def test_get_maps(self):
+        monday = _monday()
+        peter = User.objects.create(username='peter')
+        axel = User.objects.create(username='axel')
+        self._add(peter, monday, settings.WORK_DAY)
+        hours = self._add(axel, monday, settings.WORK_DAY / 2)
+
+        maps = daymap.get_maps([peter.pk, axel.pk])
+        ok_(maps[peter.pk].is_out(monday))
+        ok_(maps[axel.pk].is_half(monday))
+        with self.assertNumQueries(0):
+            eq_(daymap.who_is_out([peter.pk, axel.pk], monday),
+                [peter.pk, axel.pk])
+            eq_(daymap.who_is_out_between([peter.pk, axel.pk],
+                                          monday + datetime.timedelta(1),
+                                          monday + datetime.timedelta(7)),
+                {})
+
+        # changing Hours drops the map
+        hours.delete()
+        eq_(daymap.who_is_out([peter.pk, axel.pk], monday), [peter.pk])
+
+        # and so does changing it in bulk, like save_entry_hours() does
+        Hours.objects.bulk_create([Hours(entry=hours.entry, user=axel,
+                                         date=monday,
+                                         hours=settings.WORK_DAY)])
+        eq_(daymap.who_is_out([peter.pk, axel.pk], monday),
+            [peter.pk, axel.pk])
+        Hours.objects.filter(user=axel).update(hours=0)
+        eq_(daymap.who_is_out([peter.pk, axel.pk], monday), [peter.pk])
+
+    def test_invalidate_after_commit(self):
+        monday = _monday()
+        daymap.invalidate_pending()
+        peter = User.objects.create(username='peter')
+        self._add(peter, monday, settings.WORK_DAY)
+
+        # tests run in a transaction, like the views that change things,
+        # so a map built before it commits is dropped again afterwards
+        ok_(daymap.get_maps([peter.pk])[peter.pk].is_out(monday))
+        ok_(daymap.get_cached_maps([peter.pk]))
+        daymap.invalidate_pending()
+        eq_(daymap.get_cached_maps([peter.pk]), {})
+        # but only once
+        daymap.get_maps([peter.pk])
+        daymap.invalidate_pending()
+        ok_(daymap.get_cached_maps([peter.pk]))
+
+    def test_check_day_maps(self):
+        monday = _monday()
+        peter = User.objects.create(username='peter')
+        self._add(peter, monday, settings.WORK_DAY)
+        call_command('rebuild_day_maps')
+        call_command('check_day_maps')
+
+        # a map that disagrees with the database
+        daymap._store({peter.pk: daymap.DayMap(daymap.get_origin())})
+        self.assertRaises(CommandError, call_command, 'check_day_maps')
+        call_command('check_day_maps', fix=True)
+        eq_(daymap.get_cached_maps([peter.pk]), {})
+        ok_(daymap.get_maps([peter.pk])[peter.pk].is_out(monday))
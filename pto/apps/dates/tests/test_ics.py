@@ -0,0 +1,89 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import datetime
+import vobject
+from nose.tools import eq_, ok_
+from test_utils import TestCase
+from pto.apps.dates.ics import iter_vcalendar, escape_text, fold_line
+
+
+class ICSTest(TestCase):
+
+    def _events(self):
+        return [
+          {
+            'uid': 'entry-1@example.com',
+            'summary': u'Peter Bengtsson - 16 hours Vacation',
+            'dtstart': datetime.date(2012, 1, 2),
+            'dtend': datetime.date(2012, 1, 3),
+            'url': ('https://example.com/dates/list/?date_from=02+January'
+                    '+2012&date_to=03+January+2012&name=Peter+Bengtsson'),
+            'description': u'Log in to see the details',
+          },
+          {
+            'uid': 'entry-2@example.com',
+            'summary': (u'Jos\xe9 N\xfa\xf1ez, \\o/; birthday\n - ' +
+                        u'\u2603' * 40 + u' Vacation'),
+            'dtstart': datetime.date(2012, 2, 29),
+            'dtend': datetime.date(2012, 2, 29),
+            'url': 'https://example.com/dates/list/?name=Jos%C3%A9',
+            'description': u'Log in to see the details',
+          },
+        ]
+
+    def _vobject_serialize(self, events, calname):
+        cal = vobject.iCalendar()
+        cal.add('x-wr-calname').value = calname
+        for each in events:
+            event = cal.add('vevent')
+            event.add('uid').value = each['uid']
+            event.add('summary').value = each['summary']
+            event.add('dtstart').value = each['dtstart']
+            event.add('dtend').value = each['dtend']
+            event.add('url').value = each['url']
+            event.add('description').value = each['description']
+        return cal.serialize()
+
+    def test_same_as_vobject(self):
+        events = self._events()
+        body = ''.join(iter_vcalendar(events, 'Mozilla Vacation'))
+        reference = self._vobject_serialize(events, 'Mozilla Vacation')
+
+        def unfolded_lines(content):
+            # vobject doesn't add a DTSTAMP
+            return [x for x in content.replace('\r\n ', '').splitlines()
+                    if not x.startswith('DTSTAMP:')]
+        eq_(unfolded_lines(body), unfolded_lines(reference))
+
+        # and it reads back the same
+        cal = vobject.readOne(body)
+        eq_(cal.x_wr_calname.value, 'Mozilla Vacation')
+        parsed = cal.vevent_list
+        eq_(len(parsed), len(events))
+        for event, each in zip(parsed, events):
+            eq_(event.uid.value, each['uid'])
+            eq_(event.summary.value, each['summary'])
+            eq_(event.dtstart.value, each['dtstart'])
+            eq_(event.dtend.value, each['dtend'])
+            eq_(event.url.value, each['url'])
+            eq_(event.description.value, each['description'])
+            ok_(event.dtstamp.value)
+
+    def test_escape_text(self):
+        eq_(escape_text(u'a\\b;c,d\ne'), u'a\\\\b\\;c\\,d\\ne')
+
+    def test_fold_line(self):
+        eq_(fold_line('x' * 75), 'x' * 75 + '\r\n')
+        folded = fold_line('x' * 200)
+        lines = folded.split('\r\n')
+        eq_(lines[-1], '')
+        eq_([len(x) for x in lines[:-1]], [75, 75, 52])
+        ok_(lines[1].startswith(' '))
+
+        # multi-byte characters are never split
+        line = (u'SUMMARY:' + u'\u2603' * 60).encode('utf-8')
+        for part in fold_line(line).split('\r\n')[:-1]:
+            ok_(len(part) <= 75)
+            part.decode('utf-8')
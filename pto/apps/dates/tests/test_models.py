@@ -128,3 +128,270 @@ class ModelsTest(TestCase):
             if uk.key in keys:
                 raise AssertionError('same key reused')
             keys.add(uk.key)
+
+    def test_entry_day_summary(self):
+        peter = User.objects.create(username='peter')
+        monday = datetime.date(2011, 7, 25)
+        entry = Entry.objects.create(
+          user=peter,
+          start=monday,
+          end=monday + datetime.timedelta(days=6),
+          total_hours=8 + 4 + 8,
+        )
+        eq_(entry.weekdays, 5)
+        eq_(entry.days, 0)
+
+        for i, hours in enumerate((8, 4, 8)):
+            Hours.objects.create(
+              entry=entry,
+              date=monday + datetime.timedelta(days=i),
+              hours=hours,
+            )
+        entry = Entry.objects.get(pk=entry.pk)
+        eq_(entry.full_days, 2)
+        eq_(entry.half_days, 1)
+        eq_(entry.days, 2.5)
+        ok_(not entry.birthday)
+
+        birthday = Hours.objects.create(
+          entry=entry,
+          date=monday + datetime.timedelta(days=3),
+          hours=0,
+          birthday=True,
+        )
+        ok_(Entry.objects.get(pk=entry.pk).birthday)
+
+        # saving a stale instance doesn't lose the summary
+        entry.save()
+        entry = Entry.objects.get(pk=entry.pk)
+        ok_(entry.birthday)
+        eq_(entry.days, 2.5)
+
+        birthday.delete()
+        ok_(not Entry.objects.get(pk=entry.pk).birthday)
+
+        # changes in bulk don't send signals but update the summary too
+        Hours.objects.filter(entry=entry, hours=4).update(hours=8)
+        eq_(Entry.objects.get(pk=entry.pk).days, 3)
+        Hours.objects.filter(entry=entry, date=monday).update(birthday=True)
+        ok_(Entry.objects.get(pk=entry.pk).birthday)
+        Hours.objects.bulk_create([
+          Hours(entry=entry, user=peter, hours=4,
+                date=monday + datetime.timedelta(days=4))
+        ])
+        entry = Entry.objects.get(pk=entry.pk)
+        eq_(entry.days, 3.5)
+        ok_(entry.birthday)
+
+        Entry.objects.filter(pk=entry.pk).update(full_days=0, half_days=0,
+                                                 weekdays=0)
+        from django.core.management import call_command
+        call_command('backfill_entry_summaries')
+        entry = Entry.objects.get(pk=entry.pk)
+        eq_(entry.days, 3.5)
+        eq_(entry.weekdays, 5)
+
+    def test_outbox_email_retries(self):
+        from django.core import mail
+        from pto.apps.dates.models import OutboxEmail
+        from pto.apps.dates import outbox
+
+        outbox.queue_email('Subject', 'Body', 'peter@mozilla.com',
+                           ['a@mozilla.com', 'b@mozilla.com'],
+                           cc=['peter@mozilla.com'])
+        queued = OutboxEmail.objects.get()
+        ok_(not queued.sent_date)
+
+        _send = outbox.EmailMessage.send
+
+        def broken_send(self):
+            raise IOError('SMTP is down')
+
+        outbox.EmailMessage.send = broken_send
+        try:
+            eq_(outbox.send_queued_email(), (0, 1))
+        finally:
+            outbox.EmailMessage.send = _send
+        queued = OutboxEmail.objects.get()
+        eq_(queued.attempts, 1)
+        ok_('SMTP is down' in queued.last_error)
+        ok_(queued.send_after > datetime.datetime.utcnow())
+        eq_(len(mail.outbox), 0)
+
+        # not due yet
+        eq_(outbox.send_queued_email(), (0, 0))
+
+        OutboxEmail.objects.update(send_after=datetime.datetime.utcnow())
+        eq_(outbox.send_queued_email(), (1, 0))
+        eq_(len(mail.outbox), 1)
+        email = mail.outbox[0]
+        eq_(email.to, ['a@mozilla.com', 'b@mozilla.com'])
+        eq_(email.cc, ['peter@mozilla.com'])
+        eq_(email.from_email, 'peter@mozilla.com')
+        ok_(OutboxEmail.objects.get().sent_date)
+
+        # already sent
+        eq_(outbox.send_queued_email(), (0, 0))
+
+    def test_outbox_email_claims(self):
+        import socket
+        from django.core import mail
+        from pto.apps.dates.models import OutboxEmail
+        from pto.apps.dates import outbox
+
+        for i in range(3):
+            outbox.queue_email('Subject %d' % i, 'Body', 'peter@mozilla.com',
+                               ['a@mozilla.com'])
+        first, second, third = OutboxEmail.objects.order_by('pk')
+
+        # another run got to the first one
+        eq_([x.pk for x in outbox.claim_batch('other', 1, 5)], [first.pk])
+        ok_(OutboxEmail.objects.get(pk=first.pk).send_after >
+            datetime.datetime.utcnow())
+
+        # the connection drops half way and that isn't an attempt
+        _send = outbox.EmailMessage.send
+        calls = []
+
+        def flaky_send(self):
+            calls.append(self.subject)
+            if len(calls) == 1:
+                raise socket.error('Connection reset by peer')
+            return _send(self)
+
+        outbox.EmailMessage.send = flaky_send
+        try:
+            eq_(outbox.send_queued_email(), (2, 0))
+        finally:
+            outbox.EmailMessage.send = _send
+        eq_(calls, ['Subject 1', 'Subject 1', 'Subject 2'])
+        eq_(sorted(x.subject for x in mail.outbox), ['Subject 1', 'Subject 2'])
+        for email in OutboxEmail.objects.filter(pk__in=[second.pk, third.pk]):
+            eq_(email.attempts, 1)
+            ok_(email.sent_date)
+        ok_(not OutboxEmail.objects.get(pk=first.pk).sent_date)
+
+        # and if it can't reconnect the run stops without using up attempts
+        OutboxEmail.objects.filter(pk=first.pk).update(
+          send_after=datetime.datetime.utcnow()
+        )
+
+        def down_send(self):
+            raise socket.error('Connection refused')
+
+        outbox.EmailMessage.send = down_send
+        try:
+            self.assertRaises(socket.error, outbox.send_queued_email)
+        finally:
+            outbox.EmailMessage.send = _send
+        eq_(OutboxEmail.objects.get(pk=first.pk).attempts, 0)
+
+    def test_hours_user(self):
+        user = User.objects.create(username='peter')
+        entry = Entry.objects.create(
+          user=user,
+          start=datetime.date(2018, 1, 1),
+          end=datetime.date(2018, 1, 1),
+          total_hours=8,
+        )
+        hours = Hours.objects.create(
+          entry=entry,
+          hours=8,
+          date=datetime.date(2018, 1, 1),
+        )
+        eq_(hours.user, user)
+
+        Hours.objects.update(user=None)
+        from django.core.management import call_command
+        call_command('backfill_hours_user')
+        eq_(Hours.objects.get(pk=hours.pk).user, user)
+
+    def test_taken_hours(self):
+        from pto.apps.dates.models import TakenHours
+
+        def taken(user, year):
+            for each in TakenHours.objects.filter(user=user, year=year):
+                return each.hours
+            return 0
+
+        user = User.objects.create(username='peter')
+        # a half day on New Year's Eve and a full day after
+        entry = Entry.objects.create(
+          user=user,
+          start=datetime.date(2018, 12, 31),
+          end=datetime.date(2019, 1, 1),
+          total_hours=12,
+        )
+        eve = Hours.objects.create(entry=entry, date=entry.start, hours=4)
+        Hours.objects.create(entry=entry, date=entry.end, hours=8)
+        eq_(taken(user, 2018), 4)
+        eq_(taken(user, 2019), 8)
+
+        eve.hours = 8
+        eve.save()
+        eq_(taken(user, 2018), 8)
+        eq_(taken(user, 2019), 8)
+
+        # changes in bulk don't send signals but count too
+        Hours.objects.filter(entry=entry, date=entry.end).update(hours=4)
+        eq_(taken(user, 2019), 4)
+        Hours.objects.bulk_create([
+          Hours(entry=entry, user=user, date=datetime.date(2019, 1, 2),
+                hours=-4)
+        ])
+        eq_(taken(user, 2018), 8)
+        eq_(taken(user, 2019), 0)
+
+        TakenHours.objects.all().delete()
+        from django.core.management import call_command
+        call_command('rebuild_taken_hours')
+        eq_(taken(user, 2018), 8)
+        eq_(taken(user, 2019), 0)
+
+        entry.delete()
+        eq_(taken(user, 2018), 0)
+        eq_(taken(user, 2019), 0)
+
+    def test_generate_org(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from django.db.models import Sum
+        from pto.apps.dates.models import TakenHours, get_day_summaries
+        from pto.apps.users.models import UserProfile, ManagerClosure
+
+        options = dict(users=15, depth=2, fanout=3, years=2,
+                       entries_per_year=4, edit_rate=0.5, seed=1)
+        call_command('generate_org', **options)
+        users = User.objects.filter(username__startswith='bench')
+        eq_(users.count(), 15)
+        top = users.get(username='bench00001')
+        eq_(top.get_profile().manager_user, None)
+        eq_(UserProfile.objects
+            .filter(user__in=users, manager_user__isnull=True).count(), 1)
+        eq_(ManagerClosure.objects.filter(ancestor=top).count(), 14)
+        ok_(FollowingUser.objects.filter(follower__in=users).exists())
+        ok_(BlacklistedUser.objects.filter(observer__in=users).exists())
+
+        entries = Entry.objects.filter(user__in=users)
+        ok_(entries.filter(total_hours__lt=0).exists())
+        summaries = get_day_summaries([x.pk for x in entries])
+        for entry in entries:
+            hours = Hours.objects.filter(entry=entry)
+            eq_(hours.aggregate(Sum('hours'))['hours__sum'],
+                entry.total_hours)
+            eq_(hours.exclude(user=entry.user).count(), 0)
+            summary = summaries[entry.pk]
+            eq_(entry.full_days, summary['full_days'])
+            eq_(entry.half_days, summary['half_days'])
+        for user in users:
+            taken = (TakenHours.objects.filter(user=user)
+                     .aggregate(Sum('hours'))['hours__sum'])
+            eq_(taken, (entries.filter(user=user)
+                        .aggregate(Sum('total_hours'))['total_hours__sum']))
+
+        self.assertRaises(CommandError, call_command, 'generate_org',
+                          **options)
+        previous = list(users.values_list('pk', flat=True))
+        call_command('generate_org', replace=True, **options)
+        eq_(users.count(), 15)
+        eq_(User.objects.filter(pk__in=previous).count(), 0)
@@ -16,13 +16,17 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 from django.utils import simplejson as json
 from django.core import mail
+from django.core.cache import cache
 from pto.apps.dates.models import (
   Entry,
   Hours,
   BlacklistedUser,
   FollowingUser,
-  UserKey
+  UserKey,
+  TakenHours,
+  ChangeLog
 )
+from pto.apps.dates.outbox import send_queued_email
 from nose.tools import eq_, ok_
 from test_utils import TestCase
 from mock import Mock
@@ -48,6 +52,19 @@ def utf_8_encoder(unicode_csv_data, encoding):
 
 _THIS_YEAR = datetime.date.today().year
 
+
+def _count_queries(function, *args, **kwargs):
+    """Return what `function` returns and how many queries it ran."""
+    from django.db import connection
+    connection.use_debug_cursor = True
+    try:
+        before = len(connection.queries)
+        result = function(*args, **kwargs)
+        return result, len(connection.queries) - before
+    finally:
+        connection.use_debug_cursor = False
+
+
 class ViewsTestMixin(object):
     def _login(self, user=None):
         if not user:
@@ -95,6 +112,7 @@ class ViewsTest(TestCase, ViewsTestMixin):
         super(ViewsTest, self).setUp()
         # A must when code in this app relies on cache
         settings.CACHE_BACKEND = 'locmem:///'
+        cache.clear()
 
         ldap.open = Mock('ldap.open')
         ldap.open.mock_returns = Mock('ldap_connection')
@@ -271,7 +289,9 @@ class ViewsTest(TestCase, ViewsTestMixin):
         hour3 = Hours.objects.get(date=wednesday, entry=entry)
         eq_(hour3.hours, settings.WORK_DAY / 2)
 
-        # expect it also to have sent a bunch of emails
+        # expect it also to have queued a bunch of emails
+        eq_(len(mail.outbox), 0)
+        eq_(send_queued_email(), (1, 0))
         assert len(mail.outbox)
         email = mail.outbox[-1]
         #eq_(email.to, [peter.email])
@@ -766,6 +786,51 @@ class ViewsTest(TestCase, ViewsTestMixin):
         eq_(len(events), 1)
         ok_('birthday' in events[0]['title'])
 
+    def test_make_entry_titles(self):
+        from pto.apps.dates.views import make_entry_title, make_entry_titles
+        peter = User.objects.create(
+          username='peter',
+          first_name='Peter',
+          last_name='Bengtsson',
+        )
+        umpa = User.objects.create(username='umpa')
+        monday = datetime.date(2011, 7, 25)
+
+        entries = []
+        for user, hours, birthday in ((peter, (8, 4, 8), False),
+                                      (umpa, (8, 8), True),
+                                      (umpa, (4,), False),
+                                      (peter, (), False)):
+            entry = Entry.objects.create(
+              user=user,
+              start=monday,
+              end=monday + datetime.timedelta(days=max(len(hours) - 1, 0)),
+              total_hours=sum(hours),
+              details='Some details',
+            )
+            self._create_entry_hours(entry, *hours)
+            if birthday:
+                Hours.objects.filter(entry=entry, date=monday).update(
+                  birthday=True
+                )
+            entries.append(entry)
+
+        entries = list(Entry.objects.select_related('user'))
+        with self.assertNumQueries(0):
+            titles = make_entry_titles(entries, peter)
+        for entry in entries:
+            eq_(titles[entry.pk], make_entry_title(entry, peter))
+        eq_(sorted(titles.values()), [
+          '0 hours, Some details',
+          '2.5 days, Some details',
+          'umpa - 2 days (includes birthday), Some details',
+          'umpa - 4 hours, Some details',
+        ])
+
+        titles = make_entry_titles(entries, peter,
+                                   include_details=lambda u: u == peter)
+        ok_('umpa - 4 hours' in titles.values())
+
     def test_notify_free_input(self):
         hr_manager = self._create_hr_manager()
         hr_manager2 = self._create_hr_manager(
@@ -870,6 +935,7 @@ class ViewsTest(TestCase, ViewsTestMixin):
         response = self.client.post(url, data)
         eq_(response.status_code, 302)
 
+        send_queued_email()
         assert len(mail.outbox)
         email = mail.outbox[-1]
 
@@ -1266,6 +1332,99 @@ class ViewsTest(TestCase, ViewsTestMixin):
         ok_('Peter' not in response.content)
         ok_('Laura' not in response.content)
 
+    def test_list_json_server_side(self):
+        url = reverse('dates.list_json')
+        peter = self._login()
+        laura = User.objects.create(
+          username='laura',
+          email='laura@mozilla.com',
+          first_name='Laura',
+          last_name='Thomson',
+        )
+        p = laura.get_profile()
+        p.country = 'USA'
+        p.city = 'Berlin'
+        p.save()
+
+        monday = datetime.date(2018, 1, 1)
+        for i in range(12):
+            Entry.objects.create(
+              user=i % 3 and peter or laura,
+              start=monday + datetime.timedelta(days=i),
+              end=monday + datetime.timedelta(days=i),
+              total_hours=8,
+              details='Entry %d' % i,
+            )
+        params = {
+          'sEcho': '3',
+          'iDisplayStart': '0',
+          'iDisplayLength': '5',
+          'iSortingCols': '1',
+          'iSortCol_0': '5',
+          'sSortDir_0': 'desc',
+        }
+        response = self.client.get(url, params)
+        eq_(response.status_code, 200)
+        struct = json.loads(response.content)
+        eq_(struct['sEcho'], 3)
+        eq_(struct['iTotalRecords'], 12)
+        eq_(struct['iTotalDisplayRecords'], 12)
+        eq_(len(struct['aaData']), 5)
+        starts = [x[5] for x in struct['aaData']]
+        eq_(starts, sorted(starts, reverse=True))
+        eq_(starts[0], '2018-01-12')
+
+        params['iDisplayStart'] = '10'
+        struct = json.loads(self.client.get(url, params).content)
+        eq_(len(struct['aaData']), 2)
+        eq_(struct['aaData'][-1][5], '2018-01-01')
+
+        params['iDisplayStart'] = '0'
+        params['sSearch'] = 'laura'
+        struct = json.loads(self.client.get(url, params).content)
+        eq_(struct['iTotalRecords'], 12)
+        eq_(struct['iTotalDisplayRecords'], 4)
+        ok_(all(x[1] == 'Laura' for x in struct['aaData']))
+        # the city and country columns are searched too
+        for search in ('berlin', 'usa'):
+            params['sSearch'] = search
+            struct = json.loads(self.client.get(url, params).content)
+            eq_(struct['iTotalDisplayRecords'], 4)
+            ok_(all(x[1] == 'Laura' for x in struct['aaData']))
+
+        # peter can't see laura's details so can't find her entries by them
+        params['sSearch'] = 'Entry 3'
+        struct = json.loads(self.client.get(url, params).content)
+        eq_(struct['iTotalDisplayRecords'], 0)
+        params['sSearch'] = 'Entry 1'
+        struct = json.loads(self.client.get(url, params).content)
+        eq_(sorted(x[-1] for x in struct['aaData']),
+            ['Entry 1', 'Entry 10', 'Entry 11'])
+        # but can as her manager
+        self._make_manager(laura, peter)
+        params['sSearch'] = 'Entry 3'
+        struct = json.loads(self.client.get(url, params).content)
+        eq_([x[-1] for x in struct['aaData']], ['Entry 3'])
+        del params['sSearch']
+
+        # nor sort by them, which falls back to the order they were added
+        struct = json.loads(self.client.get(url, {'sEcho': '1',
+                                                  'iSortingCols': '1',
+                                                  'iSortCol_0': '9'}).content)
+        starts = [x[5] for x in struct['aaData']]
+        eq_(starts, sorted(starts))
+        for column in ('-1', '10'):
+            params['iSortCol_0'] = column
+            eq_(self.client.get(url, params).status_code, 200)
+        params['iSortCol_0'] = '5'
+
+        params['country'] = 'USA'
+        struct = json.loads(self.client.get(url, params).content)
+        eq_(struct['iTotalRecords'], 4)
+
+        params['iDisplayLength'] = 'x'
+        eq_(self.client.get(url, params).status_code, 400)
+
     def test_list(self):
         url = reverse('dates.list')
         response = self.client.get(url)
@@ -1524,6 +1683,30 @@ class ViewsTest(TestCase, ViewsTestMixin):
         eq_(row[10], profile.country)
         eq_(row[11], fmt(profile.start_date))
 
+    def test_list_csv_streamed(self):
+        from pto.apps.dates.csv_export import iter_csv
+        rows = [(u'ID', u'NAME')] + [(str(i), u'P\xe9ter') for i in range(7)]
+        chunks = list(iter_csv(rows, chunk_size=3))
+        eq_(len(chunks), 3)
+        eq_(''.join(chunks).splitlines()[1], '0,P\xc3\xa9ter')
+
+        peter = self._login()
+        today = datetime.date.today()
+        for i in range(5):
+            Entry.objects.create(
+              user=peter,
+              start=today,
+              end=today,
+              total_hours=4,
+              details=u'\xa1Ol\xe9!'
+            )
+        response = self.client.get(reverse('dates.list_csv'))
+        eq_(response.status_code, 200)
+        rows = list(csv.reader(response.content.splitlines()))
+        eq_(len(rows), 6)
+        eq_(rows[1][7], '0.5')
+        eq_(rows[1][8].decode('utf-8'), u'\xa1Ol\xe9!')
+
     def test_adding_a_single_day_of_zero(self):
         user = self._login()
         assert user
@@ -1600,8 +1783,10 @@ class ViewsTest(TestCase, ViewsTestMixin):
         result = function()
         eq_(result['taken'], '1 day')
 
+        # taken is counted from the hours of each day
         entry.total_hours = settings.WORK_DAY / 2
         entry.save()
+        Hours.objects.filter(entry=entry).update(hours=settings.WORK_DAY / 2)
         result = function()
         eq_(result['taken'], '%s hours' % (settings.WORK_DAY / 2))
 
@@ -1634,7 +1819,7 @@ class ViewsTest(TestCase, ViewsTestMixin):
           end=date + one_week * 5,
           total_hours=settings.WORK_DAY * 14,
         )
-        self._create_entry_hours(entry)
+        self._create_entry_hours(entry, *([settings.WORK_DAY] * 14 + [0]))
 
         result = function()
         eq_(result['taken'], '16 days')
@@ -1991,6 +2176,224 @@ class ViewsTest(TestCase, ViewsTestMixin):
         eq_(response.status_code, 200)
         ok_('Calendar expired' in response.content)
 
+    def test_calendar_vcal_cached(self):
+        mike = User.objects.create(username='mike')
+        axel = User.objects.create(username='axel')
+        today = datetime.date.today()
+        Entry.objects.create(
+          user=axel,
+          start=today,
+          end=today,
+          total_hours=settings.WORK_DAY,
+        )
+        uk = UserKey.objects.create(user=mike)
+        url = reverse('dates.calendar_vcal', args=[uk.key])
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        ok_('axel' not in response.content)
+        etag = response['ETag']
+        ok_(etag)
+        ok_(response['Last-Modified'])
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        eq_(response.status_code, 200)
+        eq_(response['ETag'], etag)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 304)
+        eq_(response.content, '')
+        response = self.client.get(
+          url,
+          HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        eq_(response.status_code, 304)
+
+        # following someone changes the feed
+        following = FollowingUser.objects.create(follower=mike,
+                                                 following=axel)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        ok_('SUMMARY:axel - 8 hours' in response.content)
+        ok_(response['ETag'] != etag)
+        etag = response['ETag']
+
+        # so does a change to one of their entries
+        Entry.objects.create(
+          user=axel,
+          start=today + datetime.timedelta(days=7),
+          end=today + datetime.timedelta(days=7),
+          total_hours=settings.WORK_DAY / 2,
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        ok_('SUMMARY:axel - 4 hours' in response.content)
+
+        following.delete()
+        response = self.client.get(url)
+        ok_('axel' not in response.content)
+
+        # and so does the org chart
+        profile = axel.get_profile()
+        profile.manager_user = mike
+        profile.save()
+        response = self.client.get(url)
+        ok_('SUMMARY:axel - 8 hours' in response.content)
+
+        BlacklistedUser.objects.create(observer=mike, observable=axel)
+        response = self.client.get(url)
+        ok_('axel' not in response.content)
+
+    def test_calendar_feed_bumped_after_commit(self):
+        from pto.apps.dates import feeds
+        feeds.bump_pending_versions()
+        axel = User.objects.create(username='axel')
+        key = feeds.VERSION_KEY % axel.pk
+        version = lambda: feeds.get_versions([axel.pk])[key]
+
+        # tests run in a transaction, like the views that change things
+        before = version()
+        Entry.objects.create(
+          user=axel,
+          start=datetime.date.today(),
+          end=datetime.date.today(),
+          total_hours=settings.WORK_DAY,
+        )
+        bumped = version()
+        ok_(bumped != before)
+        # a calendar cached now could have the old rows under `bumped`
+        # so it's bumped again once the request, and its transaction, is
+        # over
+        self.client.get(reverse('dates.home'))
+        ok_(version() != bumped)
+        bumped = version()
+        self.client.get(reverse('dates.home'))
+        eq_(version(), bumped)
+
+        # logging in saves last_login, which isn't in any calendar
+        axel.set_password('secret')
+        axel.save()
+        bumped = version()
+        assert self.client.login(username='axel', password='secret')
+        eq_(version(), bumped)
+        axel.first_name = 'Axel'
+        axel.save()
+        ok_(version() != bumped)
+
+    def test_calendar_events_cached(self):
+        peter = self._login()
+        axel = User.objects.create(username='axel')
+        FollowingUser.objects.create(follower=peter, following=axel)
+        today = datetime.date(2011, 7, 4)
+        entry = Entry.objects.create(
+          user=axel,
+          start=today,
+          end=today,
+          total_hours=settings.WORK_DAY,
+        )
+        url = reverse('dates.calendar_events')
+        # what it takes to load the session and the user
+        response, baseline = _count_queries(self.client.get, url)
+        eq_(response.status_code, 400)
+
+        data = {
+          'start': time.mktime(datetime.datetime(2011, 7, 1).timetuple()),
+          'end': time.mktime(datetime.datetime(2011, 7, 31).timetuple()),
+        }
+        response = self.client.get(url, data)
+        eq_(response.status_code, 200)
+        eq_(response['Content-Type'], 'application/json')
+        struct = json.loads(response.content)
+        eq_([x['id'] for x in struct['events']], [entry.pk])
+        etag = response['ETag']
+        ok_(etag)
+
+        response, count = _count_queries(self.client.get, url, data)
+        eq_(count, baseline)
+        eq_(response.status_code, 200)
+        eq_(response['ETag'], etag)
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 304)
+        eq_(response.content, '')
+
+        # another month is cached separately
+        other = {
+          'start': time.mktime(datetime.datetime(2011, 8, 1).timetuple()),
+          'end': time.mktime(datetime.datetime(2011, 8, 31).timetuple()),
+        }
+        response = self.client.get(url, other)
+        eq_(json.loads(response.content)['events'], [])
+
+        # a change to an observed user's hours invalidates it
+        Hours.objects.create(entry=entry, date=today,
+                             hours=settings.WORK_DAY)
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        ok_(response['ETag'] != etag)
+        eq_(json.loads(response.content)['events'][0]['title'],
+            'axel - 1 day')
+        etag = response['ETag']
+
+        # and so does no longer following them
+        FollowingUser.objects.filter(follower=peter).delete()
+        response = self.client.get(url, data, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        eq_(json.loads(response.content)['events'], [])
+
+    def test_availability_json(self):
+        url = reverse('dates.availability_json')
+        response = self.client.get(url)
+        eq_(response.status_code, 403)
+
+        peter = self._login()
+        axel = User.objects.create(username='axel', first_name='Axel',
+                                   last_name='H')
+        FollowingUser.objects.create(follower=peter, following=axel)
+        monday = datetime.date(2018, 1, 1)
+
+        def add(user, date, hours, birthday=False):
+            entry = Entry.objects.create(user=user, start=date, end=date,
+                                         total_hours=hours)
+            Hours.objects.create(entry=entry, date=date, hours=hours,
+                                 birthday=birthday)
+
+        add(axel, monday, settings.WORK_DAY)
+        add(axel, monday + datetime.timedelta(days=1), settings.WORK_DAY / 2)
+        add(peter, monday + datetime.timedelta(days=1), 0, birthday=True)
+        # Thursday was changed from a full day to a half day
+        thursday = monday + datetime.timedelta(days=3)
+        add(axel, thursday, settings.WORK_DAY)
+        add(axel, thursday, -settings.WORK_DAY)
+        add(axel, thursday, settings.WORK_DAY / 2)
+        # outside the window
+        add(axel, monday + datetime.timedelta(days=7), settings.WORK_DAY)
+
+        for data in ({'start': 'xxx'},
+                     {'start': '2018-01-05', 'end': '2018-01-01'},
+                     {'start': '2018-01-01', 'end': '2019-01-01'}):
+            response = self.client.get(url, data)
+            eq_(response.status_code, 400)
+
+        data = {'start': '2018-01-01', 'end': '2018-01-07'}
+        response = self.client.get(url, data)
+        eq_(response.status_code, 200)
+        struct = json.loads(response.content)
+        eq_(struct['start'], '2018-01-01')
+        eq_(struct['end'], '2018-01-07')
+        eq_(struct['users'], [{'id': peter.pk, 'name': 'Peter Bengtsson'},
+                              {'id': axel.pk, 'name': 'Axel H'}])
+        eq_(struct['rows'], ['0300000', '2102000'])
+        eq_(struct['totals'], [1, 2, 0, 1, 0, 0, 0])
+        eq_(struct['codes']['2'], 'full day')
+
+        # the hours are fetched in one query however many there are
+        __, count = _count_queries(self.client.get, url, data)
+        add(peter, monday + datetime.timedelta(days=4), settings.WORK_DAY)
+        response, count_after = _count_queries(self.client.get, url, data)
+        eq_(count_after, count)
+        eq_(json.loads(response.content)['rows'][0], '0300200')
+
     def test_calendar_vcal_expired(self):
         key_length = UserKey.KEY_LENGTH
         url = reverse('dates.calendar_vcal', args=['x' * key_length])
@@ -2166,6 +2569,237 @@ class ViewsTest(TestCase, ViewsTestMixin):
         ok_('*automatic edit*' in details)
         eq_(days, [2, 1, -1])
 
+    def test_global_settings_context(self):
+        import os
+        from django.template import RequestContext
+        from django.template.loader import render_to_string
+        from pto.apps.dates.context_processors import TEMPLATE_SETTINGS
+
+        # every setting a template refers to by name is still provided
+        root = os.path.join(os.path.dirname(__file__), '..', '..', '..')
+        variable = re.compile(r'(?:\{\{|\{%)[^}]*?\b([A-Z][A-Z0-9_]+)\b')
+        for dirpath, dirnames, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.endswith(('.html', '.txt')):
+                    continue
+                with open(os.path.join(dirpath, filename)) as f:
+                    content = f.read()
+                for name in variable.findall(content):
+                    if hasattr(settings, name):
+                        ok_(name in TEMPLATE_SETTINGS,
+                            '%s in %s' % (name, filename))
+
+        # and renders the same as with all the settings in the context
+        url = reverse('mobile.appcache')
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        all_settings = dict((k, getattr(settings, k)) for k in dir(settings)
+                            if k[0].isupper())
+        request = RequestFactory().get(url)
+        expected = render_to_string('mobile/appcache.html', all_settings,
+                                    RequestContext(request))
+        eq_(response.content, expected)
+        ok_(settings.BUILD_ID_JS in response.content)
+
+    def test_hours_queries_independent_of_length(self):
+        user = self._login()
+        monday = datetime.date(2018, 1, 1)
+
+        def count_queries(entry):
+            url = reverse('dates.hours', args=[entry.pk])
+            response, count = _count_queries(self.client.get, url)
+            eq_(response.status_code, 200)
+            return count
+
+        short = Entry.objects.create(
+          user=user,
+          start=monday,
+          end=monday + datetime.timedelta(days=1),
+        )
+        # a parental leave
+        long_ = Entry.objects.create(
+          user=user,
+          start=monday + datetime.timedelta(days=7),
+          end=monday + datetime.timedelta(days=7 + 90),
+        )
+        other = Entry.objects.create(
+          user=user,
+          start=monday + datetime.timedelta(days=8),
+          end=monday + datetime.timedelta(days=8),
+          total_hours=settings.WORK_DAY,
+        )
+        Hours.objects.create(
+          entry=other,
+          date=monday + datetime.timedelta(days=8),
+          hours=settings.WORK_DAY,
+        )
+        eq_(count_queries(short), count_queries(long_))
+
+        response = self.client.get(reverse('dates.hours', args=[long_.pk]))
+        ok_('Already logged 8 hours on this day' in response.content)
+
+    def test_save_entry_hours_long_range(self):
+        from pto.apps.dates.forms import HoursForm
+        from pto.apps.dates.views import save_entry_hours
+        from pto.apps.dates.utils import get_weekday_dates
+        user = User.objects.create(username='peter')
+        monday = datetime.date(2018, 1, 1)
+
+        def save(start, end):
+            entry = Entry.objects.create(user=user, start=start, end=end)
+            data = {}
+            for date in get_weekday_dates(start, end):
+                data[date.strftime('d-%Y%m%d')] = settings.WORK_DAY
+            form = HoursForm(entry, data=data)
+            ok_(form.is_valid())
+            (total_hours, is_edit), count = _count_queries(
+              save_entry_hours, entry, form
+            )
+            eq_(total_hours, settings.WORK_DAY * len(data))
+            ok_(not is_edit)
+            return entry, count
+
+        # a short vacation and a parental leave
+        _, short_count = save(monday, monday + datetime.timedelta(days=1))
+        leave, long_count = save(monday + datetime.timedelta(days=7),
+                                 monday + datetime.timedelta(days=7 + 90))
+        eq_(short_count, long_count)
+        leave = Entry.objects.get(pk=leave.pk)
+        eq_(leave.full_days, 65)
+        eq_(leave.days, 65)
+
+        # and both again on top, which nullifies every day
+        _, short_count = save(monday, monday + datetime.timedelta(days=1))
+        entry, long_count = save(monday + datetime.timedelta(days=7),
+                                 monday + datetime.timedelta(days=7 + 90))
+        eq_(short_count, long_count)
+
+        reversals = Entry.objects.filter(user=user, total_hours__lt=0)
+        eq_(reversals.count(), 2 + 65)
+        for reversal in reversals.filter(start__gte=leave.start):
+            eq_(reversal.start, reversal.end)
+            eq_(reversal.total_hours, -settings.WORK_DAY)
+            eq_(reversal.weekdays, 1)
+            eq_([(x.date, x.hours) for x in reversal.hours_set.all()],
+                [(reversal.start, -settings.WORK_DAY)])
+
+        # the ledger balances
+        total = sum(Hours.objects
+                    .filter(entry__user=user)
+                    .values_list('hours', flat=True))
+        eq_(total, sum(Entry.objects
+                       .filter(user=user)
+                       .values_list('total_hours', flat=True)))
+        eq_(total, settings.WORK_DAY * (2 + 65))
+        eq_(Entry.objects.get(pk=entry.pk).days, 65)
+        eq_(TakenHours.objects.get(user=user, year=2018).hours, total)
+
+    def test_change_log(self):
+        from StringIO import StringIO
+        from django.core.management import call_command
+        from pto.apps.dates.forms import HoursForm
+        from pto.apps.dates.views import save_entry_hours
+        url = reverse('dates.changes_json')
+        response = self.client.get(url)
+        eq_(response.status_code, 302)
+
+        user = self._login()
+        monday = datetime.date(2018, 1, 1)
+        key = monday.strftime('d-%Y%m%d')
+
+        def save(hours):
+            entry = Entry.objects.create(user=user, start=monday, end=monday)
+            form = HoursForm(entry, data={key: hours})
+            ok_(form.is_valid())
+            save_entry_hours(entry, form)
+            return entry
+
+        first = save(settings.WORK_DAY)
+        # which nullifies the first one
+        second = save(settings.WORK_DAY / 2)
+        reversal, = Entry.objects.filter(user=user, total_hours__lt=0)
+        unfinished = Entry.objects.create(user=user, start=monday,
+                                          end=monday)
+        response = self.client.get(reverse('dates.cancel_notify'))
+        eq_(response.status_code, 302)
+
+        # changes aren't returned until they've settled
+        struct = json.loads(self.client.get(url).content)
+        eq_(struct['changes'], [])
+        ok_(not struct['more'])
+        eq_(struct['next'], 0)
+        settled = (datetime.datetime.utcnow() - datetime.timedelta(
+          seconds=settings.CHANGE_LOG_SETTLE_SECONDS + 1))
+        ChangeLog.objects.update(add_date=settled)
+        # and not past one that hasn't
+        sixth = ChangeLog.objects.order_by('seq')[5]
+        (ChangeLog.objects
+         .filter(pk=sixth.pk)
+         .update(add_date=datetime.datetime.utcnow()))
+        struct = json.loads(self.client.get(url).content)
+        eq_(len(struct['changes']), 5)
+        ok_(not struct['more'])
+        ChangeLog.objects.update(add_date=settled)
+
+        response = self.client.get(url, {'limit': 4})
+        eq_(response.status_code, 200)
+        struct = json.loads(response.content)
+        ok_(struct['more'])
+        changes = struct['changes']
+        eq_(len(changes), 4)
+        eq_(struct['next'], changes[-1]['seq'])
+        response = self.client.get(url, {'since': struct['next']})
+        struct = json.loads(response.content)
+        ok_(not struct['more'])
+        changes.extend(struct['changes'])
+        eq_(struct['next'], changes[-1]['seq'])
+
+        seqs = [x['seq'] for x in changes]
+        eq_(seqs, sorted(set(seqs)))
+        eq_([(x['model'], x['action'], x['entry']) for x in changes], [
+          ('entry', 'create', first.pk),
+          ('hours', 'create', first.pk),
+          ('entry', 'update', first.pk),
+          ('entry', 'create', second.pk),
+          ('entry', 'create', reversal.pk),
+          ('hours', 'create', reversal.pk),
+          ('hours', 'create', second.pk),
+          ('entry', 'update', second.pk),
+          ('entry', 'create', unfinished.pk),
+          ('entry', 'delete', unfinished.pk),
+        ])
+        eq_([x['hours'] for x in changes if x['model'] == 'hours'],
+            [settings.WORK_DAY, -settings.WORK_DAY, settings.WORK_DAY / 2])
+        ok_(all(x['email'] == user.email for x in changes))
+        eq_(changes[4]['start'], monday.strftime('%Y-%m-%d'))
+        eq_(changes[4]['hours'], -settings.WORK_DAY)
+        # the hours rows that were bulk inserted have their real IDs
+        eq_(set(x['id'] for x in changes if x['model'] == 'hours'),
+            set(Hours.objects.values_list('pk', flat=True)))
+
+        response = self.client.get(url, {'since': -1})
+        eq_(response.status_code, 400)
+        response = self.client.get(url, {'limit': 'x'})
+        eq_(response.status_code, 400)
+
+        response = self.client.get(reverse('dates.changes_csv'),
+                                   {'since': seqs[7]})
+        eq_(response.status_code, 200)
+        eq_(response['Content-Type'], 'text/csv')
+        rows = list(unicode_csv_reader(response.content.splitlines()))
+        eq_(rows[0][:4], ['SEQ', 'ADDED', 'MODEL', 'ACTION'])
+        eq_([(int(x[0]), x[3]) for x in rows[1:]],
+            [(seqs[8], 'create'), (seqs[9], 'delete')])
+
+        out = StringIO()
+        call_command('read_change_log', since=seqs[0], limit=2,
+                     format='json', stdout=out)
+        eq_([json.loads(x)['seq'] for x in out.getvalue().splitlines()],
+            seqs[1:3])
+        out = StringIO()
+        call_command('read_change_log', stdout=out)
+        eq_(len(out.getvalue().splitlines()), 1 + len(seqs))
+
     def test_details_withheld(self):
 
         todd = User.objects.create(username='todd')
@@ -14,8 +14,12 @@ urlpatterns = patterns('',
     url(r'^list/$', views.list_, name='dates.list'),
     url(r'^list/csv/$', views.list_csv, name='dates.list_csv'),
     url(r'^list/json/$', views.list_json, name='dates.list_json'),
+    url(r'^changes/json/$', views.changes_json, name='dates.changes_json'),
+    url(r'^changes/csv/$', views.changes_csv, name='dates.changes_csv'),
     url(r'^calendar/events/$', views.calendar_events,
         name='dates.calendar_events'),
+    url(r'^availability/json/$', views.availability_json,
+        name='dates.availability_json'),
     url(r'^following/$', views.following, name='dates.following'),
     url(r'^following/save/$', views.save_following, name='dates.save_following'),
     url(r'^following/save/unfollow/$', views.save_unfollowing, name='dates.save_unfollowing'),
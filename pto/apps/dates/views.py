@@ -7,8 +7,8 @@ import traceback
 from StringIO import StringIO
 import re
 import datetime
+import json
 from urllib import urlencode
-from collections import defaultdict
 from django import http
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.views import redirect_to_login
@@ -19,7 +19,6 @@ from django.shortcuts import redirect, get_object_or_404
 from django.contrib import messages
 from django.db.models import Q
 from django.template import Context, loader
-from django.core.mail import get_connection, EmailMessage
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django.shortcuts import render
@@ -27,16 +26,24 @@ from django.views.decorators.http import require_POST
 from django.contrib.sites.models import RequestSite
 from django.core.cache import cache
 from django.db.models import Min, Count
-import vobject
-from .models import Entry, Hours, BlacklistedUser, FollowingUser, UserKey
-from pto.apps.users.models import UserProfile, User
+from django.utils.http import (http_date, parse_http_date_safe, parse_etags,
+                               quote_etag)
+from .models import (Entry, Hours, BlacklistedUser, FollowingUser, UserKey,
+                     TakenHours, ChangeLog, hours_to_days, get_hours_by_date,
+                     make_change_log)
+from pto.apps.users.models import UserProfile, User, ManagerClosure
 from pto.apps.users.utils import ldap_lookup
 from .utils import parse_datetime, DatetimeParseError
 from .utils.countrytotals import UnrecognizedCountryError, get_country_totals
 import utils
 import forms
 from .decorators import json_view
-from .csv_export import UnicodeWriter as CSVUnicodeWriter
+from .csv_export import iter_csv
+from .outbox import queue_email
+from . import feeds
+from .ics import iter_vcalendar
+from . import availability
+from . import changelog
 
 
 def valid_email(value):
@@ -85,22 +92,6 @@ def home(request):  # aka dashboard
         first_day = 0  # default to 0=Sunday
     data['first_day'] = first_day
 
-    if 'all-rightnow' in request.GET:
-        MAX_RIGHT_NOWS = 9999
-    else:
-        MAX_RIGHT_NOWS = 20
-
-    ## Commented out whilst we decide whether to keep it at all
-    #right_nows, right_now_users = get_right_nows()
-    #data['right_nows'] = right_nows
-    #data['right_now_users'] = right_now_users
-    #if len(right_now_users) > MAX_RIGHT_NOWS:
-    #    data['right_now_too_many'] = (len(data['right_now_users'])
-    #                                   - MAX_RIGHT_NOWS)
-    #    data['right_now_users'] = data['right_now_users'][:MAX_RIGHT_NOWS]
-    #else:
-    #    data['right_now_too_many'] = None
-
     data.update(get_taken_info(request.user))
 
     data['calendar_url'] = _get_user_calendar_url(request)
@@ -132,17 +123,9 @@ def get_taken_info(user):
             data['unrecognized_country'] = True
 
     today = datetime.date.today()
-    start_date = datetime.date(today.year, 1, 1)
-    last_date = datetime.date(today.year + 1, 1, 1)
-    from django.db.models import Sum
-    qs = Entry.objects.filter(
-      user=user,
-      start__gte=start_date,
-      end__lt=last_date
-    )
-    agg = qs.aggregate(Sum('total_hours'))
-    total_hours = agg['total_hours__sum']
-    if total_hours is None:
+    try:
+        total_hours = TakenHours.objects.get(user=user, year=today.year).hours
+    except TakenHours.DoesNotExist:
         total_hours = 0
     data['taken'] = _friendly_format_hours(total_hours)
 
@@ -166,47 +149,6 @@ def _friendly_format_hours(total_hours):
             return '%s days' % days
 
 
-def get_right_nows():
-    right_now_users = []
-    right_nows = defaultdict(list)
-    _today = datetime.date.today()
-
-    for entry in (Entry.objects
-                  .filter(start__lte=_today,
-                          end__gte=_today,
-                          total_hours__gte=0)
-                  .order_by('user__first_name',
-                            'user__last_name',
-                            'user__username')):
-        if entry.user not in right_now_users:
-            right_now_users.append(entry.user)
-        left = (entry.end - _today).days + 1
-        right_nows[entry.user].append((left, entry))
-
-    return right_nows, right_now_users
-
-
-def get_upcomings(max_days=14):
-    users = []
-    upcoming = defaultdict(list)
-    today = datetime.date.today()
-    max_future = today + datetime.timedelta(days=max_days)
-
-    for entry in (Entry.objects
-                  .filter(start__gt=today,
-                          start__lt=max_future,
-                          total_hours__gte=0)
-                  .order_by('user__first_name',
-                            'user__last_name',
-                            'user__username')):
-        if entry.user not in users:
-            users.append(entry.user)
-        days = (entry.start - today).days + 1
-        upcoming[entry.user].append((days, entry))
-
-    return upcoming, users
-
-
 def make_entry_title(entry, this_user, include_details=True):
     if entry.user != this_user:
         if entry.user.first_name:
@@ -216,22 +158,16 @@ def make_entry_title(entry, this_user, include_details=True):
             title = '%s - ' % entry.user.username
     else:
         title = ''
-    days = 0
-    for hour in Hours.objects.filter(entry=entry):
-        if hour.hours == 8:
-            days += 1
-        elif hour.hours == 4:
-            days += 0.5
+    days = entry.days
 
     if days > 1:
         if int(days) == days:
             title += '%d days' % days
         else:
             title += '%s days' % days
-        if Hours.objects.filter(entry=entry, birthday=True).exists():
+        if entry.birthday:
             title += ' (includes birthday)'
-    elif (days == 1 and entry.total_hours == 0 and
-        Hours.objects.filter(entry=entry, birthday=True)):
+    elif (days == 1 and entry.total_hours == 0 and entry.birthday):
         title += 'Birthday!'
     elif days == 1 and entry.total_hours == 8:
         title += '1 day'
@@ -251,7 +187,21 @@ def make_entry_title(entry, this_user, include_details=True):
     return title
 
 
-@json_view
+def make_entry_titles(entries, this_user, include_details=True):
+    """Like make_entry_title() but for many entries at once without a
+    query per entry. `include_details` can be a callable that takes the
+    entry's user. Returns a dict of entry ID -> title."""
+    titles = {}
+    for entry in entries:
+        if callable(include_details):
+            _include_details = include_details(entry.user)
+        else:
+            _include_details = include_details
+        titles[entry.pk] = make_entry_title(entry, this_user,
+                                            include_details=_include_details)
+    return titles
+
+
 def calendar_events(request):
     if not request.user.is_authenticated():
         return http.HttpResponseForbidden('Must be logged in')
@@ -271,20 +221,44 @@ def calendar_events(request):
     except DatetimeParseError:
         return http.HttpResponseBadRequest('Invalid end')
 
+    cached = feeds.get_events(request.user.pk, start, end)
+    if cached is None:
+        # the versions have to be fetched before the data they vouch for
+        versions = feeds.get_versions([request.user.pk])
+        observed_users = get_observed_users(request.user, max_depth=2)
+        versions.update(feeds.get_versions([x.pk for x in observed_users]))
+        data = _make_calendar_events(request.user, observed_users,
+                                     start, end)
+        cached = feeds.set_events(request.user.pk, start, end, versions,
+                                  json.dumps(data))
+
+    if _not_modified(request, cached):
+        response = http.HttpResponseNotModified()
+    else:
+        response = http.HttpResponse(cached['body'],
+                                     content_type='application/json')
+    # no Last-Modified so that browsers always revalidate
+    response['ETag'] = quote_etag(cached['etag'])
+    return response
+
+
+COLORS = ("#EAA228", "#c5b47f", "#579575", "#839557", "#958c12",
+          "#953579", "#4b5de4", "#d8b83f", "#ff5800", "#0085cc",
+          "#c747a3", "#cddf54", "#FBD178", "#26B4E3", "#bd70c7")
+
+
+def _make_calendar_events(user, observed_users, start, end):
     entries = []
 
-    COLORS = ("#EAA228", "#c5b47f", "#579575", "#839557", "#958c12",
-              "#953579", "#4b5de4", "#d8b83f", "#ff5800", "#0085cc",
-              "#c747a3", "#cddf54", "#FBD178", "#26B4E3", "#bd70c7")
-    user_ids = [request.user.pk]
+    user_ids = [user.pk]
     colors = {}
     colors_fullnames = []
-    colors[request.user.pk] = None
-    colors_fullnames.append((request.user.pk, 'Me myself and I', '#3366CC'))
-    for i, user_ in enumerate(get_observed_users(request.user, max_depth=2)):
+    colors[user.pk] = None
+    colors_fullnames.append((user.pk, 'Me myself and I', '#3366CC'))
+    for i, user_ in enumerate(observed_users):
         user_ids.append(user_.pk)
 
-        colors[user_.pk] = COLORS[i]
+        colors[user_.pk] = COLORS[i % len(COLORS)]
         full_name = user_.get_full_name()
         if not full_name:
             full_name = user_.username
@@ -296,35 +270,37 @@ def calendar_events(request):
 
     _managers = {}
 
-    def can_see_details(user):
-        if request.user.is_superuser:
+    def can_see_details(user_):
+        if user.is_superuser:
             return True
-        if request.user.pk == user.pk:
+        if user.pk == user_.pk:
             return True
-        if user.pk not in _managers:
-            _profile = user.get_profile()
+        if user_.pk not in _managers:
+            _profile = user_.get_profile()
             _manager = None
             if _profile and _profile.manager_user:
                 _manager = _profile.manager_user.pk
-            _managers[user.pk] = _manager
-        return _managers[user.pk] == request.user.pk
+            _managers[user_.pk] = _manager
+        return _managers[user_.pk] == user.pk
 
     visible_user_ids = set()
-    for entry in (Entry.objects
-                   .filter(user__in=user_ids,
-                           total_hours__gte=0,
-                           total_hours__isnull=False)
-                   .select_related('user')
-                   .exclude(Q(end__lt=start) | Q(start__gt=end))):
+    _entries = list(Entry.objects
+                    .filter(user__in=user_ids,
+                            total_hours__gte=0,
+                            total_hours__isnull=False)
+                    .select_related('user')
+                    .exclude(Q(end__lt=start) | Q(start__gt=end)))
+    titles = make_entry_titles(_entries, user,
+                               include_details=can_see_details)
+    for entry in _entries:
         visible_user_ids.add(entry.user.pk)
         entries.append({
           'id': entry.pk,
-          'title': make_entry_title(entry, request.user,
-                                  include_details=can_see_details(entry.user)),
+          'title': titles[entry.pk],
           'start': entry.start.strftime('%Y-%m-%d'),
           'end': entry.end.strftime('%Y-%m-%d'),
           'color': colors[entry.user.pk],
-          'mine': entry.user.pk == request.user.pk,
+          'mine': entry.user.pk == user.pk,
         })
 
     colors = [dict(name=x, color=y) for (pk, x, y) in colors_fullnames
@@ -332,31 +308,67 @@ def calendar_events(request):
     return {'events': entries, 'colors': colors}
 
 
-def get_minions(user, depth=1, max_depth=2):
-    minions = []
-    for minion in (UserProfile.objects.filter(manager_user=user)
-                   .select_related('manager_user')
-                   .order_by('manager_user')):
-        minions.append(minion.user)
+@json_view
+def availability_json(request):
+    """Who of the observed users is out on each day from `start` to `end`
+    (YYYY-MM-DD, the next 90 days by default). `rows` has a string per
+    user with a character per day, see `availability.CODES`, and `totals`
+    how many are out each day."""
+    if not request.user.is_authenticated():
+        return http.HttpResponseForbidden('Must be logged in')
 
-        if depth < max_depth:
-            minions.extend(get_minions(minion.user,
-                                       depth=depth + 1,
-                                       max_depth=max_depth))
-    return minions
+    try:
+        if request.GET.get('start'):
+            start = datetime.datetime.strptime(request.GET['start'],
+                                               '%Y-%m-%d').date()
+        else:
+            start = datetime.date.today()
+        if request.GET.get('end'):
+            end = datetime.datetime.strptime(request.GET['end'],
+                                             '%Y-%m-%d').date()
+        else:
+            end = start + datetime.timedelta(days=90)
+    except ValueError:
+        return http.HttpResponseBadRequest('Invalid start or end')
+    if end < start:
+        return http.HttpResponseBadRequest('end before start')
+    if (end - start).days >= availability.MAX_DAYS:
+        return http.HttpResponseBadRequest('At most %d days'
+                                           % availability.MAX_DAYS)
+
+    users = [request.user] + get_observed_users(request.user, max_depth=2)
+    rows, totals = availability.get_matrix([x.pk for x in users],
+                                           start, end)
+    return {
+      'start': start.strftime('%Y-%m-%d'),
+      'end': end.strftime('%Y-%m-%d'),
+      'codes': availability.CODES,
+      'users': [{'id': x.pk, 'name': x.get_full_name() or x.username}
+                for x in users],
+      'rows': rows,
+      'totals': totals,
+    }
+
+
+def get_minions(user, depth=1, max_depth=2):
+    levels = max(1, max_depth - depth + 1)
+    return [x.descendant for x in
+            (ManagerClosure.objects
+             .filter(ancestor=user, depth__lte=levels)
+             .select_related('descendant')
+             .order_by('depth', 'descendant'))]
 
 
 def get_siblings(user):
     profile = user.get_profile()
-    if not profile.manager_user:
+    if not profile.manager_user_id:
         return []
-    users = []
-    for profile in (UserProfile.objects
-                    .filter(manager_user=profile.manager_user)
-                    .exclude(pk=user.pk)
-                    .select_related('user')):
-        users.append(profile.user)
-    return users
+    return [x.descendant for x in
+            (ManagerClosure.objects
+             .filter(ancestor=profile.manager_user_id, depth=1)
+             .exclude(descendant=user)
+             .select_related('descendant')
+             .order_by('descendant'))]
 
 
 def get_followed_users(user):
@@ -369,33 +381,45 @@ def get_followed_users(user):
 
 
 def get_observed_users(this_user, depth=1, max_depth=2):
-    users = []
+    levels = max(1, max_depth - depth + 1)
+    blacklisted = (BlacklistedUser.objects
+                   .filter(observer=this_user)
+                   .values('observable'))
+    manager_id = this_user.get_profile().manager_user_id
+
+    # minions and siblings in one go from the closure table
+    in_org_chart = Q(ancestor=this_user, depth__lte=levels)
+    if manager_id:
+        in_org_chart |= Q(ancestor=manager_id, depth=1)
+    minions = []
+    siblings = []
+    for path in (ManagerClosure.objects
+                 .filter(in_org_chart)
+                 .exclude(descendant=this_user)
+                 .exclude(descendant__in=blacklisted)
+                 .select_related('descendant')
+                 .order_by('depth', 'descendant')):
+        if path.ancestor_id == this_user.pk:
+            minions.append(path.descendant)
+        else:
+            siblings.append(path.descendant)
 
-    def is_blacklisted(user):
-        return (BlacklistedUser.objects
-                .filter(observer=this_user, observable=user)
-                .exists())
-
-    for user in get_minions(this_user, depth=depth, max_depth=max_depth):
-        if user not in users:
-            if not is_blacklisted(user):
-                users.append(user)
-
-    for user in get_siblings(this_user):
-        if user not in users:
-            if not is_blacklisted(user):
-                users.append(user)
-
-    profile = this_user.get_profile()
-    manager = profile.manager_user
-    if manager and manager not in users:
-        if not is_blacklisted(manager):
-            users.append(manager)
-
-    for user in get_followed_users(this_user):
-        if user not in users:
-            users.append(user)
+    # the manager and anybody explicitly followed
+    others = Q(following__follower=this_user)
+    if manager_id:
+        others |= Q(pk=manager_id) & ~Q(pk__in=blacklisted)
+    manager = None
+    followed = []
+    for user in User.objects.filter(others).distinct().order_by('pk'):
+        if user.pk == manager_id:
+            manager = user
+        else:
+            followed.append(user)
 
+    users = []
+    for user in minions + siblings + [manager] + followed:
+        if user is not None and user not in users:
+            users.append(user)
     return users
 
 
@@ -480,8 +504,9 @@ def hours(request, pk):
     if entry.user != request.user:
         if not (request.user.is_staff or request.user.is_superuser):
             return http.HttpResponseForbidden('insufficient access')
+    hours = get_hours_by_date(entry.user, entry.start, entry.end)
     if request.method == 'POST':
-        form = forms.HoursForm(entry, data=request.POST)
+        form = forms.HoursForm(entry, data=request.POST, hours=hours)
         if form.is_valid():
             total_hours, is_edit = save_entry_hours(entry, form)
 
@@ -490,12 +515,11 @@ def hours(request, pk):
                            in extra_users.split(';')
                            if x.strip()]
 
-            success, email_addresses = send_email_notification(
+            email_addresses = send_email_notification(
               entry,
               extra_users,
               is_edit=is_edit,
             )
-            assert success
 
             #messages.info(request,
             #  '%s hours of vacation logged.' % total_hours
@@ -510,30 +534,27 @@ def hours(request, pk):
     else:
         initial = {}
         for date in utils.get_weekday_dates(entry.start, entry.end):
-            try:
-                #hours_ = Hours.objects.get(entry=entry, date=date)
-                hours_ = Hours.objects.get(date=date, entry__user=entry.user)
-                initial[date.strftime('d-%Y%m%d')] = hours_.hours
-            except Hours.DoesNotExist:
+            if date in hours:
+                initial[date.strftime('d-%Y%m%d')] = hours[date].hours
+            else:
                 initial[date.strftime('d-%Y%m%d')] = settings.WORK_DAY
 
-        form = forms.HoursForm(entry, initial=initial)
+        form = forms.HoursForm(entry, initial=initial, hours=hours)
     data['form'] = form
 
     if entry.total_hours:
         data['total_hours'] = entry.total_hours
     else:
         total_days = 0
+        entry_hours = dict(Hours.objects
+                           .filter(entry=entry)
+                           .values_list('date', 'hours'))
         for date in utils.get_weekday_dates(entry.start, entry.end):
-            try:
-                hours_ = Hours.objects.get(entry=entry, date=date)
-                print hours_.hours
-                if hours_.hours == settings.WORK_DAY:
-                    total_days += 1
-                elif hours_.hours:
-                    total_days += .5
-            except Hours.DoesNotExist:
+            hours_ = entry_hours.get(date)
+            if hours_ is None or hours_ == settings.WORK_DAY:
                 total_days += 1
+            elif hours_:
+                total_days += .5
         data['total_days'] = total_days
 
     notify = request.session.get('notify_extra', [])
@@ -544,7 +565,15 @@ def hours(request, pk):
 
 def save_entry_hours(entry, form):
     assert form.is_valid()
-
+    # the primary keys of the rows bulk inserted below are found by what
+    # wasn't there before, which only works if no other edit of the same
+    # user's entries inserts any in the meantime
+    _lock_user(entry.user)
+
+    # what's already logged on these dates, as loaded by the form
+    existing = form.hours
+    new_hours = []
+    nullified = {}
     total_hours = 0
     for date in utils.get_weekday_dates(entry.start, entry.end):
         hours = int(form.cleaned_data[date.strftime('d-%Y%m%d')])
@@ -553,46 +582,96 @@ def save_entry_hours(entry, form):
             birthday = True
             hours = 0
         assert hours >= 0 and hours <= settings.WORK_DAY, hours
-        try:
-            hours_ = Hours.objects.get(entry__user=entry.user,
-                                       date=date)
-            if hours_.hours:
-                # this nullifies the previous entry on this date
-                reverse_entry = Entry.objects.create(
-                  user=hours_.entry.user,
-                  start=date,
-                  end=date,
-                  details=hours_.entry.details,
-                  total_hours=hours_.hours * -1,
-                )
-                Hours.objects.create(
-                  entry=reverse_entry,
-                  hours=hours_.hours * -1,
-                  date=date,
-                )
-            #hours_.hours = hours  # nasty stuff!
-            #hours_.birthday = birthday
-            #hours_.save()
-        except Hours.DoesNotExist:
-            # nothing to credit
-            pass
-        Hours.objects.create(
+        hours_ = existing.get(date)
+        if hours_ is not None and hours_.hours:
+            # this nullifies the previous entry on this date
+            nullified[date] = hours_
+        new_hours.append(Hours(
           entry=entry,
+          user=entry.user,
           hours=hours,
           date=date,
           birthday=birthday,
-        )
+        ))
         total_hours += hours
-    #raise NotImplementedError
+
+    reversals = _make_reversals(entry.user, nullified)
+    previous = list(Hours.objects
+                    .filter(entry=entry)
+                    .values_list('pk', flat=True))
+    # the reversals go in first so the new hours are the latest on each date
+    Hours.objects.bulk_create(reversals + new_hours)
+    # which doesn't tell us the new primary keys for the change log
+    entry_ids = set([entry.pk] + [x.entry_id for x in reversals])
+    ChangeLog.objects.bulk_create([
+      make_change_log(ChangeLog.CREATE, x)
+      for x in (Hours.objects
+                .filter(entry__in=entry_ids)
+                .exclude(pk__in=previous)
+                .order_by('pk'))
+    ])
 
     is_edit = entry.total_hours is not None
     #if entry.total_hours is not None:
     entry.total_hours = total_hours
+    # HoursQuerySet.bulk_create() has updated the day summaries of the
+    # rows and saving recalculates this instance's from the same rows
     entry.save()
 
     return total_hours, is_edit
 
 
+def _lock_user(user):
+    """Lock the user's row until the end of the transaction, which
+    serializes anything else that takes the same lock."""
+    list(User.objects
+         .select_for_update()
+         .filter(pk=user.pk)
+         .values_list('pk', flat=True))
+
+
+def _make_reversals(user, nullified):
+    """Insert an Entry of negative hours for every date -> Hours in
+    `nullified` and return the (unsaved) Hours rows to go with them.
+    The caller must hold `_lock_user(user)`."""
+    if not nullified:
+        return []
+    details = dict(Entry.objects
+                   .filter(pk__in=set(x.entry_id for x in nullified.values()))
+                   .values_list('pk', 'details'))
+    reversals = Entry.objects.filter(user=user,
+                                     start__in=nullified.keys(),
+                                     total_hours__lt=0)
+    previous = list(reversals.values_list('pk', flat=True))
+    reverse_entries = []
+    for date, hours_ in sorted(nullified.items()):
+        reverse_entry = Entry(
+          user=user,
+          start=date,
+          end=date,
+          details=details[hours_.entry_id],
+          total_hours=hours_.hours * -1,
+        )
+        # negative hours never count as days so there's nothing to
+        # summarize beyond the number of weekdays
+        reverse_entry.update_day_summary()
+        reverse_entries.append(reverse_entry)
+    Entry.objects.bulk_create(reverse_entries)
+    # bulk_create() doesn't tell us the new primary keys
+    created = dict(reversals
+                   .exclude(pk__in=previous)
+                   .values_list('start', 'pk'))
+    for reverse_entry in reverse_entries:
+        reverse_entry.pk = created[reverse_entry.start]
+    ChangeLog.objects.bulk_create([make_change_log(ChangeLog.CREATE, x)
+                                   for x in reverse_entries])
+    return [
+      Hours(entry_id=created[date], user=user, hours=hours_.hours * -1,
+            date=date)
+      for date, hours_ in sorted(nullified.items())
+    ]
+
+
 def send_email_notification(entry, extra_users, is_edit=False):
     email_addresses = []
     for profile in (UserProfile.objects
@@ -622,7 +701,7 @@ def send_email_notification(entry, extra_users, is_edit=False):
       email=entry.user.email,
     )
 
-    message = template = loader.get_template('dates/notification.txt')
+    template = loader.get_template('dates/notification.txt')
     context = {
       'entry': entry,
       'user': entry.user,
@@ -631,18 +710,16 @@ def send_email_notification(entry, extra_users, is_edit=False):
       'start_date': entry.start.strftime(settings.DEFAULT_DATE_FORMAT),
     }
     body = template.render(Context(context)).strip()
-    connection = get_connection()
-    message = EmailMessage(
+    # queued rather than sent so the request doesn't wait on SMTP;
+    # the `send_queued_email` command does the actual sending
+    queue_email(
       subject=subject,
       body=body,
       from_email=entry.user.email,
       to=email_addresses,
       cc=entry.user.email and [entry.user.email] or None,
-      connection=connection
     )
-
-    success = message.send()
-    return success, email_addresses
+    return email_addresses
 
 
 @login_required
@@ -658,8 +735,9 @@ def emails_sent(request, pk):
         emails = [emails]
     data['emails'] = emails
     data['emailed_users'] = []
+    records = ldap_lookup.fetch_many_user_details(emails)
     for email in emails:
-        record = ldap_lookup.fetch_user_details(email)
+        record = records[email]
         if record:
             data['emailed_users'].append(record)
         else:
@@ -700,9 +778,13 @@ def list_(request):
 @login_required
 def list_csv(request):
     entries = get_entries_from_request(request.GET)
-    response = http.HttpResponse(mimetype='text/csv')
-    writer = CSVUnicodeWriter(response)
-    writer.writerow((
+    response = http.HttpResponse(iter_csv(_list_csv_rows(entries)),
+                                 mimetype='text/csv')
+    return response
+
+
+def _list_csv_rows(entries):
+    yield (
       'ID',
       'EMAIL',
       'FIRST NAME',
@@ -715,30 +797,54 @@ def list_csv(request):
       'CITY',
       'COUNTRY',
       'START DATE',
-    ))
+    )
 
-    profiles = {}  # basic memoization
-    for entry in entries:
-        if entry.user.pk not in profiles:
-            profiles[entry.user.pk] = entry.user.get_profile()
-        profile = profiles[entry.user.pk]
-        writer.writerow((
-          str(entry.pk),
-          entry.user.email,
-          entry.user.first_name,
-          entry.user.last_name,
-          entry.add_date.strftime('%Y-%m-%d'),
-          entry.start.strftime('%Y-%m-%d'),
-          entry.end.strftime('%Y-%m-%d'),
-          str(entry.total_days),
-          entry.details,
-          profile.city,
-          profile.country,
-          (profile.start_date and
-           profile.start_date.strftime('%Y-%m-%d') or ''),
-        ))
+    # the profile columns are joined in rather than fetched per user
+    for (pk, email, first_name, last_name, add_date, start, end,
+         total_hours, details, city, country, start_date) in (
+      entries.values_list(
+        'pk',
+        'user__email',
+        'user__first_name',
+        'user__last_name',
+        'add_date',
+        'start',
+        'end',
+        'total_hours',
+        'details',
+        'user__userprofile__city',
+        'user__userprofile__country',
+        'user__userprofile__start_date',
+      ).iterator()):
+        yield (
+          str(pk),
+          email,
+          first_name,
+          last_name,
+          add_date.strftime('%Y-%m-%d'),
+          start.strftime('%Y-%m-%d'),
+          end.strftime('%Y-%m-%d'),
+          str(hours_to_days(total_hours)),
+          details,
+          city or '',
+          country or '',
+          start_date and start_date.strftime('%Y-%m-%d') or '',
+        )
 
-    return response
+
+# the columns of the list table, in order, as ORDER BY expressions
+LIST_JSON_COLUMNS = (
+  'user__email',
+  'user__first_name',
+  'user__last_name',
+  'add_date',
+  'total_hours',
+  'start',
+  'end',
+  'user__userprofile__city',
+  'user__userprofile__country',
+  'details',
+)
 
 
 @json_view
@@ -746,26 +852,41 @@ def list_csv(request):
 def list_json(request):
     entries = get_entries_from_request(request.GET)
 
-    _managers = {}
+    # DataTables sends `sEcho` when it does the paging, sorting and
+    # searching on the server
+    server_side = 'sEcho' in request.GET
+    if server_side:
+        total_count = entries.count()
+        entries = _search_and_sort_entries(entries, request.GET,
+                                           request.user)
+        display_count = entries.count()
+        try:
+            echo = int(request.GET['sEcho'])
+            offset = max(0, int(request.GET.get('iDisplayStart', 0)))
+            limit = int(request.GET.get('iDisplayLength', 10))
+        except ValueError:
+            return http.HttpResponseBadRequest('Invalid paging')
+        if limit > 0:
+            entries = entries[offset:offset + limit]
+        else:
+            # -1 means "show all"
+            entries = entries[offset:]
+    entries = list(entries)
+
+    profiles = {}
+    for profile in (UserProfile.objects
+                    .filter(user__in=set(x.user_id for x in entries))):
+        profiles[profile.user_id] = profile
 
     def can_see_details(user):
         if request.user.is_superuser:
             return True
         if request.user.pk == user.pk:
             return True
-        if user.pk not in _managers:
-            _profile = user.get_profile()
-            _manager = None
-            if _profile and _profile.manager_user:
-                _manager = _profile.manager_user.pk
-            _managers[user.pk] = _manager
-        return _managers[user.pk] == request.user.pk
+        return profiles[user.pk].manager_user_id == request.user.pk
 
     data = []
-    profiles = {}
     for entry in entries:
-        if entry.user.pk not in profiles:
-            profiles[entry.user.pk] = entry.user.get_profile()
         profile = profiles[entry.user.pk]
         if entry.total_hours < 0:
             details = '*automatic edit*'
@@ -789,9 +910,59 @@ def list_json(request):
                ]
         data.append(row)
 
+    if server_side:
+        return {
+          'sEcho': echo,
+          'iTotalRecords': total_count,
+          'iTotalDisplayRecords': display_count,
+          'aaData': data,
+        }
     return {'aaData': data}
 
 
+def _search_and_sort_entries(entries, data, user):
+    """Search and sort like DataTables asks. The details are only
+    searched on the entries `user` can see the details of (see
+    `list_json`) and only superusers can sort on them, so that neither
+    tells anything about the ones they can't."""
+    search = data.get('sSearch', '').strip()
+    if search:
+        details = Q(details__icontains=search)
+        if not user.is_superuser:
+            details &= (Q(user=user) |
+                        Q(user__userprofile__manager_user=user))
+        entries = entries.filter(
+          Q(user__email__icontains=search) |
+          Q(user__first_name__icontains=search) |
+          Q(user__last_name__icontains=search) |
+          Q(user__userprofile__city__icontains=search) |
+          Q(user__userprofile__country__icontains=search) |
+          details
+        )
+
+    order_by = []
+    try:
+        sorting_cols = int(data.get('iSortingCols', 0))
+    except ValueError:
+        sorting_cols = 0
+    for i in range(sorting_cols):
+        try:
+            index = int(data.get('iSortCol_%d' % i))
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= index < len(LIST_JSON_COLUMNS):
+            continue
+        column = LIST_JSON_COLUMNS[index]
+        if column == 'details' and not user.is_superuser:
+            continue
+        if data.get('sSortDir_%d' % i) == 'desc':
+            column = '-' + column
+        order_by.append(column)
+    # a stable order is needed for LIMIT/OFFSET to page sensibly
+    order_by.append('pk')
+    return entries.order_by(*order_by)
+
+
 def get_entries_from_request(data):
     form = forms.ListFilterForm(date_format='%d %B %Y', data=data)
 
@@ -823,12 +994,53 @@ def get_entries_from_request(data):
             )
     if fdata.get('country'):
         country = fdata['country'].strip()
-        _users = UserProfile.objects.filter(country=country).values('user_id')
-        entries = entries.filter(user__id__in=_users)
+        entries = entries.filter(user__userprofile__country=country)
 
     return entries
 
 
+def _get_changes_from_request(data):
+    """Return `since`, the changes after it, at most `limit` of them, and
+    whether there are more. Raises ValueError on bad paging."""
+    since = int(data.get('since', 0))
+    limit = int(data.get('limit', settings.CHANGE_LOG_PAGE_SIZE))
+    if since < 0 or limit < 1:
+        raise ValueError(data)
+    changes, more = changelog.get_changes(
+      since,
+      min(limit, settings.CHANGE_LOG_PAGE_SIZE)
+    )
+    return since, changes, more
+
+
+@json_view
+@login_required
+def changes_json(request):
+    """The changes to entries and hours after the sequence number `since`,
+    oldest first. Ask again from `next` while `more` is true."""
+    try:
+        since, changes, more = _get_changes_from_request(request.GET)
+    except ValueError:
+        return http.HttpResponseBadRequest('Invalid paging')
+    return {
+      'changes': changelog.get_dicts(changes),
+      'next': changes and changes[-1].seq or since,
+      'more': more,
+    }
+
+
+@login_required
+def changes_csv(request):
+    """Like `changes_json` as CSV. Ask again from the last SEQ until there
+    are no rows."""
+    try:
+        __, changes, __ = _get_changes_from_request(request.GET)
+    except ValueError:
+        return http.HttpResponseBadRequest('Invalid paging')
+    rows = [changelog.CSV_HEADER] + changelog.get_csv_rows(changes)
+    return http.HttpResponse(iter_csv(rows), mimetype='text/csv')
+
+
 @login_required
 def following(request):
     data = {}
@@ -971,46 +1183,77 @@ def save_unfollowing(request):
     return data
 
 
+VCALENDAR_NAME = 'Mozilla Vacation'
+
+
 def calendar_vcal(request, key):
-    base_url = '%s://%s' % (request.is_secure() and 'https' or 'http',
-                            RequestSite(request).domain)
-    home_url = base_url + '/'
-    cal = vobject.iCalendar()
-    cal.add('x-wr-calname').value = 'Mozilla Vacation'
+    today = datetime.date.today()
+    feed = feeds.get_feed(key, today)
+    if feed is None:
+        try:
+            user = UserKey.objects.get(key=key).user
+        except UserKey.DoesNotExist:
+            return _vcalendar_response(
+              iter_vcalendar(_make_expired_events(request, key),
+                             VCALENDAR_NAME),
+              key
+            )
 
-    try:
-        user = UserKey.objects.get(key=key).user
-    except UserKey.DoesNotExist:
-        # instead of raising a HTTP error, respond a calendar
-        # that urges the user to update the stale URL
-        event = cal.add('vevent')
-        event.add('summary').value = (
-          "Calendar expired. Visit %s#calendarurl to get the "
-          "new calendar URL" % home_url
-        )
-        today = datetime.date.today()
-        event.add('dtstart').value = today
-        event.add('dtend').value = today
-        event.add('url').value = '%s#calendarurl' % (home_url,)
-        event.add('description').value = ("The calendar you used has expired "
-        "and is no longer associated with any user")
-        return _render_vcalendar(cal, key)
-
-    # always start on the first of this month
+        # the versions have to be fetched before the data they vouch for
+        versions = feeds.get_versions([user.pk])
+        observed_users = get_observed_users(user, max_depth=2)
+        versions.update(feeds.get_versions([x.pk for x in observed_users]))
+        events = _make_events(request, user, observed_users, today)
+        body = ''.join(iter_vcalendar(events, VCALENDAR_NAME))
+        feed = feeds.set_feed(key, today, versions, body)
+
+    if _not_modified(request, feed):
+        response = http.HttpResponseNotModified()
+    else:
+        response = _vcalendar_response(feed['body'], key)
+    response['ETag'] = quote_etag(feed['etag'])
+    response['Last-Modified'] = http_date(feed['last_modified'])
+    return response
+
+
+def _get_base_url(request):
+    return '%s://%s' % (request.is_secure() and 'https' or 'http',
+                        RequestSite(request).domain)
+
+
+def _make_expired_events(request, key):
+    # instead of raising a HTTP error, respond a calendar
+    # that urges the user to update the stale URL
+    home_url = _get_base_url(request) + '/'
     today = datetime.date.today()
-    #first = datetime.date(today.year, today.month, 1)
+    return [{
+      'uid': 'expired-%s@%s' % (key, RequestSite(request).domain),
+      'summary': ("Calendar expired. Visit %s#calendarurl to get the "
+                  "new calendar URL" % home_url),
+      'dtstart': today,
+      'dtend': today,
+      'url': '%s#calendarurl' % (home_url,),
+      'description': ("The calendar you used has expired "
+                      "and is no longer associated with any user"),
+    }]
+
+
+def _make_events(request, user, observed_users, today):
+    base_url = _get_base_url(request)
+    domain = RequestSite(request).domain
 
     user_ids = [user.pk]
-    for user_ in get_observed_users(user, max_depth=2):
+    for user_ in observed_users:
         user_ids.append(user_.pk)
 
-    entries = (Entry.objects
-               .filter(user__in=user_ids,
-                       total_hours__gte=0,
-                       total_hours__isnull=False,
-                       end__gte=today)
-               .select_related('user')
-               )
+    entries = list(Entry.objects
+                   .filter(user__in=user_ids,
+                           total_hours__gte=0,
+                           total_hours__isnull=False,
+                           end__gte=today)
+                   .select_related('user')
+                   )
+    titles = make_entry_titles(entries, user, include_details=False)
 
     _list_base_url = base_url + reverse('dates.list')
 
@@ -1024,26 +1267,31 @@ def calendar_vcal(request, key):
           'name': name
         }
         return _list_base_url + '?' + urlencode(data, True)
+
+    events = []
     for entry in entries:
-        event = cal.add('vevent')
-        event.add('summary').value = '%s Vacation' % make_entry_title(entry, user,
-                                                include_details=False)
-        event.add('dtstart').value = entry.start
-        event.add('dtend').value = entry.end
-        #url = (home_url + '?cal_y=%d&cal_m=%d' %
-        #       (slot.date.year, slot.date.month))
-        event.add('url').value = make_list_url(entry)
-        #event.add('description').value = entry.details
-        event.add('description').value = "Log in to see the details"
-
-    return _render_vcalendar(cal, key)
-
-
-def _render_vcalendar(cal, key):
-    #return http.HttpResponse(cal.serialize(),
-    #                         mimetype='text/plain;charset=utf-8'
-    #                         )
-    resp = http.HttpResponse(cal.serialize(),
+        events.append({
+          'uid': 'entry-%s@%s' % (entry.pk, domain),
+          'summary': '%s Vacation' % titles[entry.pk],
+          'dtstart': entry.start,
+          'dtend': entry.end,
+          'url': make_list_url(entry),
+          'description': "Log in to see the details",
+        })
+    return events
+
+
+def _not_modified(request, cached):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return cached['etag'] in etags or '*' in etags
+    since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    return since is not None and cached['last_modified'] <= since
+
+
+def _vcalendar_response(body, key):
+    resp = http.HttpResponse(body,
                              mimetype='text/calendar;charset=utf-8'
                              )
     filename = '%s.ics' % (key,)
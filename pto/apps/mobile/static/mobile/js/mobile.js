@@ -21,7 +21,30 @@ var Data = (function() {
             .replace(/"/g,'&quot;');
   }
 
+  // what bootstrap.json returned, used up the first time each page shows
+  var preloaded = {};
+  function get(part, url, callback) {
+    if (preloaded[part]) {
+      var response = preloaded[part];
+      delete preloaded[part];
+      callback(response);
+    } else {
+      $.getJSON(url, callback);
+    }
+  }
+
   return {
+     bootstrap: function(callback) {
+       $.getJSON('/mobile/bootstrap.json', function(response) {
+         if (response.logged_in) {
+           preloaded.rightnow = response.right_now;
+           preloaded.taken = response.taken;
+           preloaded.settings = response.settings;
+         }
+         callback(response);
+       });
+     },  // end bootstrap
+
      rightnow: function() {
 
        var container = $('#rightnow');
@@ -36,7 +59,7 @@ var Data = (function() {
        $('.now:visible', container).hide();
        $('.upcoming:visible', container).hide();
 
-       $.getJSON('/mobile/rightnow.json', function(response) {
+       get('rightnow', '/mobile/rightnow.json', function(response) {
          if (response.error) return _grr(response.error);
          $('.loading:visible', container).hide();
 
@@ -84,7 +107,7 @@ var Data = (function() {
        var container = $('#taken');
        $('.loading:hidden', container).show();
 
-       $.getJSON('/mobile/taken.json', function(response) {
+       get('taken', '/mobile/taken.json', function(response) {
          if (response.error) return _grr(response.error);
 
          $('.loading:visible', container).hide();
@@ -126,7 +149,7 @@ var Data = (function() {
 
     settings: function() {
       var container = $('#settings');
-      $.getJSON('/mobile/settings.json', function(response) {
+      get('settings', '/mobile/settings.json', function(response) {
         var html = "You're currently logged in as ";
         html += '<strong>' + html_escape(response.full_name) + '</strong>.';
         $('p.info', container).html(html);
@@ -204,7 +227,7 @@ var Notify = (function() {
 
 $(document).ready(function() {
   $('#index').bind('pageshow', function() {
-    $.getJSON($('#login form').attr('action'), function(response) {
+    Data.bootstrap(function(response) {
       if (!response.logged_in) {
         $.mobile.changePage('#login');
       }
@@ -2,6 +2,8 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this file,
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
+import time
+import calendar
 import datetime
 from collections import defaultdict
 from urlparse import urlparse
@@ -9,14 +11,21 @@ from nose.tools import eq_, ok_
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.core.cache import cache
 from django.utils import simplejson as json
 from pto.apps.dates.tests.test_views import ViewsTestMixin
-from pto.apps.dates.models import Entry, Hours
+from pto.apps.dates.models import Entry, Hours, FollowingUser
+from pto.apps.mobile import views as mobile_views
 from test_utils import TestCase
 
 
 class MobileViewsTest(TestCase, ViewsTestMixin):
 
+    def setUp(self):
+        super(MobileViewsTest, self).setUp()
+        # the country choices are cached
+        cache.clear()
+
     def xx_login(self):
         peter = User.objects.create(
           username='peter',
@@ -123,33 +132,32 @@ class MobileViewsTest(TestCase, ViewsTestMixin):
 
         today = datetime.date.today()
 
-        Entry.objects.create(
-          user=bobby,
-          total_hours=16,
-          start=today - datetime.timedelta(days=2),
-          end=today - datetime.timedelta(days=1),
-        )
-
-        Entry.objects.create(
-          user=freddy,
-          total_hours=16,
-          start=today - datetime.timedelta(days=1),
-          end=today,
-        )
-
-        Entry.objects.create(
-          user=dicky,
-          total_hours=4,
-          start=today,
-          end=today,
-        )
-
-        Entry.objects.create(
-          user=harry,
-          total_hours=16,
-          start=today + datetime.timedelta(days=1),
-          end=today + datetime.timedelta(days=2),
-        )
+        def create_entry(user, start, end, hours):
+            # who is out comes from the hours logged on each day
+            entry = Entry.objects.create(
+              user=user,
+              total_hours=hours * ((end - start).days + 1),
+              start=start,
+              end=end,
+            )
+            date = start
+            while date <= end:
+                Hours.objects.create(entry=entry, date=date, hours=hours)
+                date += datetime.timedelta(days=1)
+
+        create_entry(bobby,
+                     today - datetime.timedelta(days=2),
+                     today - datetime.timedelta(days=1),
+                     8)
+        create_entry(freddy,
+                     today - datetime.timedelta(days=1),
+                     today,
+                     8)
+        create_entry(dicky, today, today, 4)
+        create_entry(harry,
+                     today + datetime.timedelta(days=1),
+                     today + datetime.timedelta(days=2),
+                     8)
 
         user = self._login()
         response = self.client.get(url)
@@ -212,6 +220,141 @@ class MobileViewsTest(TestCase, ViewsTestMixin):
         from pto.apps.dates.views import get_taken_info
         eq_(struct, get_taken_info(user))
 
+    def test_bootstrap_json(self):
+        url = reverse('mobile.bootstrap')
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        eq_(json.loads(response.content), {'logged_in': False})
+
+        user = self._login()
+        profile = user.get_profile()
+        profile.country = 'US'
+        profile.save()
+        response = self.client.get(url)
+        eq_(response.status_code, 200)
+        eq_(response['Content-Type'], 'application/json')
+        struct = json.loads(response.content)
+        ok_(struct['logged_in'])
+        # the same as the separate requests would say
+        for key, name in (('settings', 'mobile.settings'),
+                          ('right_now', 'mobile.right_now'),
+                          ('taken', 'mobile.taken')):
+            separate = self.client.get(reverse(name))
+            eq_(struct[key], json.loads(separate.content))
+        etag = response['ETag']
+        ok_(etag)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 304)
+        eq_(response.content, '')
+        eq_(response['ETag'], etag)
+
+        profile.city = 'London'
+        profile.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        eq_(response.status_code, 200)
+        eq_(json.loads(response.content)['settings']['city'], 'London')
+
+    def test_sync_json(self):
+        url = reverse('mobile.sync')
+        response = self.client.get(url)
+        ok_(json.loads(response.content)['error'])
+
+        peter = self._login()
+        axel = User.objects.create(username='axel', email='axel@mozilla.com')
+        today = datetime.date.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        mine = Entry.objects.create(user=peter, start=tomorrow, end=tomorrow,
+                                    total_hours=8)
+        Entry.objects.create(user=peter, start=today - datetime.timedelta(7),
+                             end=today - datetime.timedelta(7),
+                             total_hours=8)
+        axels = Entry.objects.create(user=axel, start=tomorrow, end=tomorrow,
+                                     total_hours=4)
+        # so that they're older than any cursor
+        an_hour_ago = datetime.datetime.now() - datetime.timedelta(hours=1)
+        Entry.objects.all().update(modify_date=an_hour_ago)
+
+        def sync(cursor=None):
+            data = {}
+            if cursor:
+                data['cursor'] = cursor
+            response = self.client.get(url, data)
+            eq_(response.status_code, 200)
+            return json.loads(response.content)
+
+        struct = sync()
+        ok_(struct['reset'])
+        eq_([x['id'] for x in struct['entries']], [mine.pk])
+        eq_(struct['entries'][0]['user'], peter.pk)
+        eq_(struct['users'][0]['id'], peter.pk)
+        cursor = struct['cursor']
+
+        struct = sync(cursor)
+        ok_(not struct['reset'])
+        eq_(struct['entries'], [])
+        eq_(struct['removed'], [])
+
+        # logging hours changes the entry's days, which is sent again
+        Hours.objects.create(entry=mine, date=tomorrow, hours=8)
+        struct = sync(cursor)
+        eq_([(x['id'], x['days']) for x in struct['entries']],
+            [(mine.pk, 1)])
+        Entry.objects.all().update(modify_date=an_hour_ago)
+
+        # following somebody sends all of their entries
+        FollowingUser.objects.create(follower=peter, following=axel)
+        struct = sync(cursor)
+        eq_([x['id'] for x in struct['entries']], [axels.pk])
+        eq_([x['id'] for x in struct['users']], [peter.pk, axel.pk])
+
+        # changed and deleted entries
+        axels.total_hours = 8
+        axels.save()
+        mine_id = mine.pk
+        mine.delete()
+        struct = sync(cursor)
+        ok_(not struct['reset'])
+        eq_([x['total_hours'] for x in struct['entries']], [8])
+        eq_(struct['removed'], [mine_id])
+
+        # changes to the org chart between other people don't matter
+        carl = User.objects.create(username='carl')
+        dora = User.objects.create(username='dora')
+        profile = carl.get_profile()
+        profile.manager_user = dora
+        profile.save()
+        ok_(not sync(cursor)['reset'])
+
+        # but one that involves anybody observed means starting over
+        profile = axel.get_profile()
+        profile.manager_user = peter
+        profile.save()
+        ok_(sync(cursor)['reset'])
+
+        old = time.time() - settings.SYNC_TOMBSTONE_DAYS * 60 * 60 * 24
+        ok_(sync(str(int(old) - 1))['reset'])
+
+        response = self.client.get(url, {'cursor': 'xxx'})
+        eq_(response.status_code, 400)
+
+    def test_sync_cursor(self):
+        # the cursor trails by SYNC_SETTLE_SECONDS
+        with self.settings(SYNC_SETTLE_SECONDS=60):
+            self._login()
+            before = int(time.time())
+            response = self.client.get(reverse('mobile.sync'))
+            cursor = int(json.loads(response.content)['cursor'])
+            ok_(before - 60 <= cursor <= int(time.time()) - 60)
+
+        # 2am PDT on November 4 2012 was 1am PST again
+        fall_back = calendar.timegm((2012, 11, 4, 9, 0, 0))
+        _local_since = mobile_views._local_since
+        eq_(_local_since(fall_back - 60 * 30, fall_back + 60 * 30),
+            datetime.datetime(2012, 11, 4, 0, 30))
+        eq_(_local_since(fall_back + 60 * 30, fall_back + 60 * 90),
+            datetime.datetime(2012, 11, 4, 1, 30))
+
     def test_notify(self):
         url = reverse('mobile.notify')
         response = self.client.get(url)
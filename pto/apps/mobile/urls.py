@@ -8,7 +8,9 @@ import views
 urlpatterns = patterns('',
     url(r'^$', views.home, name='mobile.home'),
     url(r'^cache.appcache$', views.appcache, name='mobile.appcache'),
+    url(r'^bootstrap.json$', views.bootstrap, name='mobile.bootstrap'),
     url(r'^rightnow.json$', views.right_now, name='mobile.right_now'),
+    url(r'^sync.json$', views.sync, name='mobile.sync'),
     url(r'^taken.json$', views.taken, name='mobile.taken'),
     url(r'^settings.json$', views.settings_json, name='mobile.settings'),
     url(r'^settings/$', views.save_settings, name='mobile.save_settings'),
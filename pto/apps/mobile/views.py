@@ -3,6 +3,8 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import time
+import json
+import hashlib
 import datetime
 from django import http
 from django.db.models import Q
@@ -12,8 +14,10 @@ from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from django.shortcuts import redirect, get_object_or_404, render
+from django.utils.http import parse_etags, quote_etag
 from django.contrib.auth import login as auth_login, logout as auth_logout
-from pto.apps.dates.models import Entry, Hours
+from pto.apps.dates.models import Entry, Tombstone, get_hours_by_date
+from pto.apps.dates import daymap
 from pto.apps.dates.decorators import json_view
 from pto.apps.dates.utils import get_weekday_dates
 from pto.apps.users.forms import ProfileForm
@@ -42,33 +46,37 @@ def appcache(request):
 def right_now(request):
     if not request.user.is_authenticated():  # XXX improve this
         return {'error': 'Not logged in'}
+    return _get_right_now(request.user)
+
+
+def _get_right_now(user):
     from pto.apps.dates.helpers import format_date
-    from pto.apps.dates.views import get_observed_users, make_entry_title
+    from pto.apps.dates.views import get_observed_users
 
     now = []
     upcoming = []
-    user_ids = [request.user.pk]
-    for user_ in get_observed_users(request.user, max_depth=2):
-        user_ids.append(user_.pk)
-
-    start = today = datetime.datetime.utcnow()
-    end = start + datetime.timedelta(days=90)
-
-    for entry in (Entry.objects
-                   .filter(user__in=user_ids,
-                           total_hours__gte=0,
-                           total_hours__isnull=False)
-                   .select_related('user')
-                   .order_by('start')
-                   .exclude(Q(end__lt=start) | Q(start__gte=end))):
+    users = [user] + get_observed_users(user, max_depth=2)
+    users = dict((x.pk, x) for x in users)
+
+    today = datetime.datetime.utcnow().date()
+    end = today + datetime.timedelta(days=89)
+
+    absences = []
+    out = daymap.who_is_out_between(users.keys(), today, end)
+    for user_id, map_ in out.items():
+        for first, last in map_.absences(today, end):
+            absences.append((first, last, user_id))
+
+    for first, last, user_id in sorted(absences):
+        user_ = users[user_id]
         row = {}
-        name = entry.user.get_full_name()
+        name = user_.get_full_name()
         if not name:
-            name = entry.user.username
+            name = user_.username
         row['name'] = name
-        row['email'] = entry.user.email
-        if entry.start > today.date():
-            days = (entry.start - today.date()).days
+        row['email'] = user_.email
+        if first > today:
+            days = (first - today).days
             description = 'starts in '
             if days == 1:
                 description += '1 day '
@@ -78,17 +86,17 @@ def right_now(request):
                 description += '2 weeks '
             else:
                 description += '%d days ' % days
-            description += 'on %s' % format_date(None, entry.end, shorter=True)
+            description += 'on %s' % format_date(None, last, shorter=True)
             row['descriptions'] = [description]
             upcoming.append(row)
         else:
-            days_left = (entry.end - today.date()).days
+            days_left = (last - today).days
             description = 'ends in '
             if days_left == 1:
                 description += '1 day '
             else:
                 description += '%d days ' % days_left
-            description += 'on %s' % format_date(None, entry.end, shorter=True)
+            description += 'on %s' % format_date(None, last, shorter=True)
             row['descriptions'] = [description]
             now.append(row)
 
@@ -103,6 +111,141 @@ def taken(request):
     return get_taken_info(request.user)
 
 
+def bootstrap(request):
+    """Everything the app shows on launch in one response: whether you're
+    logged in and, if so, what settings.json, rightnow.json and taken.json
+    would say. Answers 304 if it's the same as the If-None-Match ETag."""
+    data = {'logged_in': request.user.is_authenticated()}
+    if data['logged_in']:
+        from pto.apps.dates.views import get_taken_info
+        # user.get_profile() caches the profile so it's only loaded once
+        data['settings'] = _get_settings(request.user)
+        data['right_now'] = _get_right_now(request.user)
+        data['taken'] = get_taken_info(request.user)
+
+    body = json.dumps(data)
+    etag = hashlib.md5(body).hexdigest()
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and etag in parse_etags(if_none_match):
+        response = http.HttpResponseNotModified()
+    else:
+        response = http.HttpResponse(body, content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    return response
+
+
+def _utc_offset(timestamp):
+    return (datetime.datetime.fromtimestamp(timestamp) -
+            datetime.datetime.utcfromtimestamp(timestamp))
+
+
+def _local_since(cursor, now):
+    """The server local time, which modify_date and Tombstone.add_date are
+    in, to look for changes from. If the clocks have gone back since the
+    `cursor` timestamp the rows written after that can have earlier local
+    times than it, so go back as far as the clocks did."""
+    since = datetime.datetime.fromtimestamp(cursor)
+    fallen_back = _utc_offset(cursor) - _utc_offset(now)
+    if fallen_back > datetime.timedelta(0):
+        since -= fallen_back
+    return since
+
+
+def _sync_entry(entry):
+    return {
+      'id': entry.pk,
+      'user': entry.user_id,
+      'start': entry.start.strftime(MOBILE_DATE_FORMAT),
+      'end': entry.end.strftime(MOBILE_DATE_FORMAT),
+      'total_hours': entry.total_hours,
+      'days': entry.days,
+    }
+
+
+@json_view
+def sync(request):
+    """The entries of you and the people you observe that end today or
+    later, for the app to keep locally.
+
+    Pass the `cursor` of the previous response to only get what changed
+    since: `entries` added or changed and the IDs of the ones `removed`.
+    `users` is always everyone observed, drop the entries of anybody not
+    in it. If `reset` is true the response has everything and the local
+    store should be replaced."""
+    if not request.user.is_authenticated():  # XXX improve this
+        return {'error': 'Not logged in'}
+    from pto.apps.dates.views import get_observed_users
+
+    # the cursor is a UTC timestamp. A row isn't visible until the
+    # transaction that wrote it commits, which can be a while after its
+    # modify_date, so the next sync starts that far back. Anything that
+    # gets sent twice just replaces itself.
+    now = int(time.time())
+    cursor = now - settings.SYNC_SETTLE_SECONDS
+    today = datetime.datetime.fromtimestamp(now).date()
+
+    since = None
+    if request.GET.get('cursor'):
+        try:
+            since = int(request.GET['cursor'])
+        except ValueError:
+            return http.HttpResponseBadRequest('Invalid cursor')
+        if since < now - settings.SYNC_TOMBSTONE_DAYS * 60 * 60 * 24:
+            since = None
+        else:
+            since = _local_since(since, now)
+
+    users = [request.user] + get_observed_users(request.user, max_depth=2)
+    user_ids = [x.pk for x in users]
+    visible = (Entry.objects
+               .filter(user__in=user_ids)
+               .exclude(total_hours__isnull=True)
+               .exclude(total_hours__lt=0))
+
+    removed = []
+    if since is not None:
+        tombstones = Tombstone.objects.filter(add_date__gte=since)
+        if (tombstones
+            .filter(kind=Tombstone.ORG)
+            .filter(Q(user_id__in=user_ids) | Q(object_id__in=user_ids))
+            .exists()):
+            # the user, or somebody they observe, changed managers or got
+            # a new report, so who they observe might have changed too.
+            # Nobody else's observed users change because of that.
+            since = None
+    if since is None:
+        entries = visible.filter(end__gte=today)
+    else:
+        # newly observed users need all their entries sent
+        refollowed = (tombstones
+                      .filter(user_id=request.user.pk,
+                              kind__in=(Tombstone.FOLLOWING,
+                                        Tombstone.BLACKLIST))
+                      .values_list('object_id', flat=True))
+        entries = visible.filter(Q(modify_date__gte=since) |
+                                 Q(user__in=list(refollowed),
+                                   end__gte=today))
+        # including the ones that are no longer visible
+        removed = list(tombstones
+                       .filter(kind=Tombstone.ENTRY, user_id__in=user_ids)
+                       .values_list('object_id', flat=True))
+        removed.extend(Entry.objects
+                       .filter(user__in=user_ids, modify_date__gte=since)
+                       .filter(Q(total_hours__isnull=True) |
+                               Q(total_hours__lt=0))
+                       .values_list('pk', flat=True))
+
+    return {
+      'cursor': str(cursor),
+      'reset': since is None,
+      'users': [{'id': x.pk,
+                 'name': x.get_full_name() or x.username,
+                 'email': x.email} for x in users],
+      'entries': [_sync_entry(x) for x in entries.order_by('start')],
+      'removed': sorted(removed),
+    }
+
+
 @csrf_exempt  # XXX fix this
 @require_POST
 @transaction.commit_on_success
@@ -153,7 +296,7 @@ def save_hours(request):
     form = HoursForm(entry, data=request.POST)
     if form.is_valid():
         total_hours, is_edit = save_entry_hours(entry, form)
-        success, email_addresses = send_email_notification(
+        send_email_notification(
           entry,
           '',  # extra users to send to
           is_edit=is_edit,
@@ -177,18 +320,12 @@ def hours_json(request):
         return http.HttpResponseForbidden("Not your entry")
     days = []
 
+    hours = get_hours_by_date(entry.user, entry.start, entry.end)
     for date in get_weekday_dates(entry.start, entry.end):
         key = date.strftime('d-%Y%m%d')
-        try:
-            hours_ = Hours.objects.get(
-              date=date,
-              entry__user=entry.user,
-              hours__gt=0,
-            )
-            #initial[date.strftime('d-%Y%m%d')] = hours_.hours
-            value = hours_.hours
-        except Hours.DoesNotExist:
-            #initial[date.strftime('d-%Y%m%d')] = settings.WORK_DAY
+        if date in hours and hours[date].hours > 0:
+            value = hours[date].hours
+        else:
             value = settings.WORK_DAY
         days.append({'key': key,
                      'value': value,
@@ -199,14 +336,17 @@ def hours_json(request):
 def settings_json(request):
     if not request.user.is_authenticated():  # XXX improve this
         return {'error': 'Not logged in'}
+    return _get_settings(request.user)
+
 
+def _get_settings(user):
     data = {
-      'username': request.user.username,
-      'email': request.user.email,
+      'username': user.username,
+      'email': user.email,
     }
     from pto.apps.dates.helpers import full_name_form
-    data['full_name'] = full_name_form(None, request.user)
-    profile = request.user.get_profile()
+    data['full_name'] = full_name_form(None, user)
+    profile = user.get_profile()
     if profile.start_date:
         data['start_date'] = profile.start_date.strftime(
           MOBILE_DATE_FORMAT)
@@ -7,6 +7,7 @@ import ldap
 from ldap.filter import filter_format
 from django.contrib.auth.models import User
 from django_auth_ldap.backend import LDAPBackend
+from pto.base.instrumentation import timed
 
 
 class MozillaLDAPBackend(LDAPBackend):
@@ -39,6 +40,11 @@ class MozillaLDAPBackend(LDAPBackend):
 
     supports_inactive_user = True
 
+    def authenticate(self, username, password):
+        # binding as the user, and the lookups that come with it
+        with timed('ldap', 'ldap_binds'):
+            return super(MozillaLDAPBackend, self).authenticate(username,
+                                                                password)
 
     def get_or_create_user(self, username, ldap_user):
         """
@@ -4,10 +4,15 @@
 
 from django import forms
 import django.contrib.auth.forms
-from .models import UserProfile
+from .models import UserProfile, get_profile_countries
 from pto.apps.dates.forms import BaseModelForm
 from lib.country_aliases import ALIASES as COUNTRY_ALIASES
 
+# country code -> the long form to show for it
+COUNTRY_LONG_FORMS = {}
+for _alias, _country in COUNTRY_ALIASES.items():
+    COUNTRY_LONG_FORMS.setdefault(_country, _alias)
+
 
 class EmailInput(forms.widgets.Input):
     input_type = 'email'
@@ -45,21 +50,14 @@ class ProfileForm(BaseModelForm):
         super(ProfileForm, self).__init__(*args, **kwargs)
 
         country_choices = []
-        _all_longforms = []
-        for each in (UserProfile.objects.exclude(country='')
-                     .values('country')
-                     .distinct()
-                     .order_by('country')):
-            country = each['country']
-            long_form = country
-            if long_form in COUNTRY_ALIASES.values():
-                long_form = [k for (k, v) in COUNTRY_ALIASES.items()
-                             if v == country][0]
-            _all_longforms.append(long_form)
+        _all_longforms = set()
+        for country in get_profile_countries():
+            long_form = COUNTRY_LONG_FORMS.get(country, country)
+            _all_longforms.add(long_form)
             country_choices.append((country, long_form))
         for alias, country in COUNTRY_ALIASES.items():
             if alias not in _all_longforms:
-                _all_longforms.append(alias)
+                _all_longforms.add(alias)
                 country_choices.append((country, alias))
 
         country_choices.sort(lambda x, y: cmp(x[1], y[1]))
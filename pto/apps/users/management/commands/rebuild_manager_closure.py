@@ -0,0 +1,36 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+from pto.apps.users.models import UserProfile, ManagerClosure
+
+
+class Command(NoArgsCommand):
+    help = """
+    Recreates the manager closure table from UserProfile.manager_user.
+    """
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        managers = dict(UserProfile.objects
+                        .exclude(manager_user__isnull=True)
+                        .values_list('user', 'manager_user'))
+
+        rows = []
+        for user_id in managers:
+            seen = set([user_id])
+            manager_id = managers[user_id]
+            depth = 1
+            while manager_id and manager_id not in seen:
+                rows.append(ManagerClosure(ancestor_id=manager_id,
+                                           descendant_id=user_id,
+                                           depth=depth))
+                seen.add(manager_id)
+                manager_id = managers.get(manager_id)
+                depth += 1
+
+        ManagerClosure.objects.all().delete()
+        ManagerClosure.objects.bulk_create(rows)
+        print "Created", len(rows), "manager closure rows"
@@ -4,7 +4,9 @@
 
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_save
+from django.core.cache import cache
+from django.db.models.signals import (post_save, pre_save, pre_delete,
+                                      post_delete)
 from django.dispatch import receiver
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
@@ -56,8 +58,136 @@ def explode_office_to_country_and_city(sender, instance, **kwargs):
         instance.country = country
 
 
+PROFILE_COUNTRIES_CACHE_KEY = 'profile_countries'
+PROFILE_CITIES_CACHE_KEY = 'profile_cities'
+PROFILE_CHOICES_TIMEOUT = 60 * 60 * 24
+
+
+def _get_distinct_values(cache_key, field):
+    values = cache.get(cache_key)
+    if values is None:
+        values = list(UserProfile.objects
+                      .exclude(**{field: ''})
+                      .values_list(field, flat=True)
+                      .distinct()
+                      .order_by(field))
+        cache.set(cache_key, values, PROFILE_CHOICES_TIMEOUT)
+    return values
+
+
+def get_profile_countries():
+    """Sorted list of every country used in a profile. Cached until a
+    profile's country changes."""
+    return _get_distinct_values(PROFILE_COUNTRIES_CACHE_KEY, 'country')
+
+
+def get_profile_cities():
+    """Sorted list of every city used in a profile. Cached until a
+    profile's city changes."""
+    return _get_distinct_values(PROFILE_CITIES_CACHE_KEY, 'city')
+
+
 @receiver(pre_save, sender=UserProfile)
 def explode_find_manager_user(sender, instance, **kwargs):
     if instance.manager and valid_email(instance.manager):
         for user in User.objects.filter(email__iexact=instance.manager):
             instance.manager_user = user
+
+
+class ManagerClosure(models.Model):
+    """One row for every (manager, report) pair in the reporting chain,
+    however many levels apart, so that "everyone under X" or "everyone
+    above Y" is a single indexed lookup.
+
+    Rows are derived from UserProfile.manager_user and kept up to date by
+    the signals below. Use the `rebuild_manager_closure` management
+    command to recreate the whole table.
+    """
+    ancestor = models.ForeignKey(User, related_name='closure_descendants')
+    descendant = models.ForeignKey(User, related_name='closure_ancestors')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ('ancestor', 'descendant')
+
+    def __repr__(self):  # pragma: no cover
+        return '<%s: %s > %s (%d)>' % (self.__class__.__name__,
+                                       self.ancestor_id,
+                                       self.descendant_id,
+                                       self.depth)
+
+
+def update_manager_closure(user_id, manager_id):
+    """Move `user_id`, and everyone reporting to them, in under
+    `manager_id` (or make them a root if `manager_id` is None)."""
+    subtree = dict(ManagerClosure.objects
+                   .filter(ancestor=user_id)
+                   .values_list('descendant', 'depth'))
+    subtree[user_id] = 0
+    # cut the subtree loose from everything that used to be above it
+    (ManagerClosure.objects
+     .filter(descendant__in=subtree.keys())
+     .exclude(ancestor__in=subtree.keys())
+     .delete())
+
+    if not manager_id or manager_id in subtree:
+        # no manager or a cycle in the org chart
+        return
+
+    ancestors = dict(ManagerClosure.objects
+                     .filter(descendant=manager_id)
+                     .values_list('ancestor', 'depth'))
+    ancestors[manager_id] = 0
+    ManagerClosure.objects.bulk_create([
+      ManagerClosure(ancestor_id=ancestor_id,
+                     descendant_id=descendant_id,
+                     depth=up + 1 + down)
+      for ancestor_id, up in ancestors.items()
+      for descendant_id, down in subtree.items()
+    ])
+
+
+@receiver(pre_save, sender=UserProfile)
+def remember_previous_values(sender, instance, **kwargs):
+    instance._previous_manager_user_id = None
+    instance._previous_country = instance._previous_city = None
+    if instance.pk:
+        for manager_user_id, country, city in (UserProfile.objects
+                                               .filter(pk=instance.pk)
+                                               .values_list('manager_user',
+                                                            'country',
+                                                            'city')):
+            instance._previous_manager_user_id = manager_user_id
+            instance._previous_country = country
+            instance._previous_city = city
+
+
+@receiver(post_save, sender=UserProfile)
+def manager_closure_update(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_manager_user_id', None)
+    if previous != instance.manager_user_id:
+        update_manager_closure(instance.user_id, instance.manager_user_id)
+
+
+@receiver(pre_delete, sender=User)
+def manager_closure_detach(sender, instance, **kwargs):
+    # reports of a deleted user lose their manager (SET_NULL) without
+    # any UserProfile signals firing, so detach them here
+    for report_id in (UserProfile.objects
+                      .filter(manager_user=instance)
+                      .values_list('user', flat=True)):
+        update_manager_closure(report_id, None)
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_choices_update(sender, instance, **kwargs):
+    # profiles are saved on every LDAP login so only invalidate on change
+    if getattr(instance, '_previous_country', None) != instance.country:
+        cache.delete(PROFILE_COUNTRIES_CACHE_KEY)
+    if getattr(instance, '_previous_city', None) != instance.city:
+        cache.delete(PROFILE_CITIES_CACHE_KEY)
+
+
+@receiver(post_delete, sender=UserProfile)
+def profile_choices_delete(sender, instance, **kwargs):
+    cache.delete_many([PROFILE_COUNTRIES_CACHE_KEY, PROFILE_CITIES_CACHE_KEY])
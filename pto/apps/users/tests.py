@@ -9,6 +9,7 @@ from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.cache import cache
 from nose.tools import eq_, ok_
 from test_utils import TestCase
 from mock import Mock
@@ -16,7 +17,7 @@ from mock import Mock
 import ldap
 from pto.apps.users.auth.backends import MozillaLDAPBackend
 from pto.apps.users.utils.ldap_mock import MockLDAP
-from pto.apps.users.models import UserProfile
+from pto.apps.users.models import UserProfile, ManagerClosure
 from pto.apps.users.utils import ldap_lookup
 
 RaiseInvalidCredentials = object()
@@ -85,6 +86,47 @@ class LDAPLookupTests(TestCase):
         details = func('mortal@mozilla.com', force_refresh=True)
         eq_(details['givenName'], u'Different')
 
+    def test_fetch_many_user_details(self):
+        func = ldap_lookup.fetch_many_user_details
+
+        def fake(email, given_name):
+            return ('mail=%s,o=com,dc=mozilla' % email,
+                    {'cn': ['Some Body'],
+                     'givenName': [given_name],
+                     'mail': [email],
+                     'sn': ['Body'],
+                     'uid': [email.split('@')[0]]})
+
+        _wrapper = ldap_lookup.account_wrap_search_filter
+        ldap.initialize = Mock(return_value=MockLDAP({
+          _wrapper('(|(mail=one@mozilla.com)(mail=two@mozilla.com)'
+                   '(mail=xxx@mozilla.com))'): [
+            fake('one@mozilla.com', 'One'),
+            fake('two@mozilla.com', 'Two'),
+          ],
+          _wrapper('mail=three@mozilla.com'): [
+            fake('three@mozilla.com', 'Three'),
+          ],
+        }))
+
+        emails = ['one@mozilla.com', 'two@mozilla.com', 'xxx@mozilla.com']
+        details = func(emails)
+        eq_(details['one@mozilla.com']['givenName'], u'One')
+        eq_(details['two@mozilla.com']['givenName'], u'Two')
+        eq_(details['xxx@mozilla.com'], {})
+        eq_(ldap.initialize.call_count, 1)
+
+        # now they're all cached
+        details = func(emails + ['three@mozilla.com'])
+        eq_(details['one@mozilla.com']['givenName'], u'One')
+        eq_(details['three@mozilla.com']['givenName'], u'Three')
+        eq_(ldap.initialize.call_count, 2)
+
+        # and shared with fetch_user_details()
+        eq_(ldap_lookup.fetch_user_details('two@mozilla.com')['givenName'],
+            u'Two')
+        eq_(ldap.initialize.call_count, 2)
+
     def test_search_users_uid_search(self):
         func = ldap_lookup.search_users
         fake_user = [
@@ -221,10 +263,110 @@ class LDAPLookupTests(TestCase):
         ok_(not result)
 
 
+class LDAPConnectionPoolTests(TestCase):
+
+    def setUp(self):
+        super(LDAPConnectionPoolTests, self).setUp()
+        self.fake_user = [
+          ('mail=mortal@mozilla.com,o=com,dc=mozilla',
+           {'cn': ['Peter Bengtsson'],
+            'givenName': ['Peter'],
+            'mail': ['mortal@mozilla.com'],
+            'sn': ['Bengtsson'],
+            'uid': ['pbengtsson']
+            })
+        ]
+        _key = ldap_lookup.account_wrap_search_filter('mail=mortal@mozilla.com')
+        self.search_result = {_key: self.fake_user}
+        ldap.initialize = Mock(side_effect=lambda uri:
+                               MockLDAP(self.search_result))
+
+    def tearDown(self):
+        super(LDAPConnectionPoolTests, self).tearDown()
+        ldap_lookup.reset_pool()
+
+    def _pool(self, **kwargs):
+        return ldap_lookup.LDAPConnectionPool('ldap://', 'dn', 'secret',
+                                              **kwargs)
+
+    def test_connections_are_reused(self):
+        pool = self._pool(size=2)
+        first = pool.acquire()
+        second = pool.acquire()
+        ok_(first is not second)
+        pool.release(first)
+        ok_(pool.acquire() is first)
+        eq_(pool.stats['misses'], 2)
+        eq_(pool.stats['hits'], 1)
+        eq_(ldap.initialize.call_count, 2)
+
+    def test_wait_timeout(self):
+        pool = self._pool(size=1, wait_timeout=0.01)
+        pool.acquire()
+        self.assertRaises(ldap_lookup.LDAPPoolTimeout, pool.acquire)
+        eq_(pool.stats['waits'], 1)
+        ok_(pool.stats['wait_time'] > 0)
+
+    def test_idle_connections_health_checked(self):
+        pool = self._pool(size=1, idle_timeout=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.whoami_s = Mock(side_effect=ldap.SERVER_DOWN)
+        ok_(pool.acquire() is not connection)
+        eq_(pool.stats['reconnects'], 1)
+
+    def test_reconnect_on_server_down(self):
+        pool = self._pool(size=1)
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.search_s = Mock(side_effect=ldap.SERVER_DOWN)
+        result = pool.call(lambda c: c.search_s('dc=mozilla', 0, 'x'))
+        eq_(result, [])
+        eq_(pool.stats['reconnects'], 1)
+        # the replacement went back in the pool
+        ok_(pool.acquire() is not connection)
+
+    def test_fetch_directory_pages(self):
+        from ldap.controls import SimplePagedResultsControl
+        connection = MockLDAP({})
+
+        def page(cookie, *uids):
+            control = SimplePagedResultsControl(ldap.LDAP_CONTROL_PAGE_OID,
+                                                True, (0, cookie))
+            return (ldap.RES_SEARCH_RESULT,
+                    [('uid=%s,dc=mozilla' % x, {'uid': [x]}) for x in uids],
+                    1, [control])
+
+        connection.search_ext = Mock(return_value=1)
+        connection.result3 = Mock(side_effect=[page('more', 'peter', 'laura'),
+                                               page('', 'axel')])
+        ldap.initialize = Mock(return_value=connection)
+        with self.settings(LDAP_POOL_SIZE=0):
+            eq_([x['uid'] for x in ldap_lookup.fetch_directory()],
+                ['peter', 'laura', 'axel'])
+        eq_(connection.search_ext.call_count, 2)
+        control, = connection.search_ext.call_args[1]['serverctrls']
+        eq_(control.controlValue,
+            (ldap_lookup.DIRECTORY_PAGE_SIZE, 'more'))
+
+    def test_search_users_uses_pool(self):
+        with self.settings(LDAP_POOL_SIZE=3):
+            ldap_lookup.reset_pool()
+            for i in range(3):
+                result = ldap_lookup.search_users('mortal@mozilla.com', 1)
+                eq_(result[0]['uid'], 'pbengtsson')
+            stats = ldap_lookup.get_pool().stats
+            eq_(stats['misses'], 1)
+            eq_(stats['hits'], 2)
+            eq_(ldap.initialize.call_count, 1)
+
+
 class UsersTests(TestCase):
 
     def setUp(self):
         super(UsersTests, self).setUp()
+        # the country choices are cached
+        cache.clear()
         ldap.open = Mock('ldap.open')
         ldap.open.mock_returns = Mock('ldap_connection')
         ldap.set_option = Mock(return_value=None)
@@ -553,3 +695,131 @@ class UsersTests(TestCase):
         regex = re.compile('<input.*?type="password".*?>')
         html = regex.findall(response.content)[0]
         ok_('autocomplete="off"' in html)
+
+
+class ManagerClosureTests(TestCase):
+
+    def _make_manager(self, user, manager):
+        profile = user.get_profile()
+        profile.manager_user = manager
+        profile.save()
+
+    def _paths(self):
+        return sorted((x.ancestor.username, x.descendant.username, x.depth)
+                      for x in ManagerClosure.objects.all())
+
+    def test_closure_follows_manager_changes(self):
+        gary = User.objects.create(username='gary')
+        todd = User.objects.create(username='todd')
+        mike = User.objects.create(username='mike')
+        laura = User.objects.create(username='laura')
+
+        self._make_manager(todd, gary)
+        self._make_manager(mike, todd)
+        self._make_manager(laura, mike)
+        eq_(self._paths(), [
+          ('gary', 'laura', 3),
+          ('gary', 'mike', 2),
+          ('gary', 'todd', 1),
+          ('mike', 'laura', 1),
+          ('todd', 'laura', 2),
+          ('todd', 'mike', 1),
+        ])
+
+        # mike and his team move to report straight to gary
+        self._make_manager(mike, gary)
+        eq_(self._paths(), [
+          ('gary', 'laura', 2),
+          ('gary', 'mike', 1),
+          ('gary', 'todd', 1),
+          ('mike', 'laura', 1),
+        ])
+
+        # saving without changing the manager leaves it alone
+        mike.get_profile().save()
+        eq_(len(self._paths()), 4)
+
+        # a cycle doesn't loop forever
+        self._make_manager(gary, laura)
+        eq_(self._paths(), [
+          ('gary', 'laura', 2),
+          ('gary', 'mike', 1),
+          ('gary', 'todd', 1),
+          ('mike', 'laura', 1),
+        ])
+
+        mike.delete()
+        eq_(self._paths(), [
+          ('gary', 'todd', 1),
+        ])
+
+    def test_rebuild_manager_closure(self):
+        from django.core.management import call_command
+        gary = User.objects.create(username='gary')
+        todd = User.objects.create(username='todd')
+        mike = User.objects.create(username='mike')
+        self._make_manager(todd, gary)
+        self._make_manager(mike, todd)
+        before = self._paths()
+
+        ManagerClosure.objects.all().delete()
+        call_command('rebuild_manager_closure')
+        eq_(self._paths(), before)
+
+
+class ProfileChoicesTests(TestCase):
+
+    def setUp(self):
+        super(ProfileChoicesTests, self).setUp()
+        cache.clear()
+
+    def test_countries_and_cities_cached(self):
+        from pto.apps.users.models import (get_profile_countries,
+                                           get_profile_cities)
+        eq_(get_profile_countries(), [])
+        eq_(get_profile_cities(), [])
+
+        bob = User.objects.create(username='bob')
+        profile = bob.get_profile()
+        profile.country = 'GB'
+        profile.city = 'London'
+        profile.save()
+        eq_(get_profile_countries(), ['GB'])
+        with self.assertNumQueries(0):
+            eq_(get_profile_countries(), ['GB'])
+            eq_(get_profile_cities(), ['London'])
+
+        # saving without changing either doesn't invalidate
+        profile.notes = 'Likes tea'
+        profile.save()
+        with self.assertNumQueries(0):
+            eq_(get_profile_countries(), ['GB'])
+
+        ted = User.objects.create(username='ted')
+        profile = ted.get_profile()
+        profile.country = 'US'
+        profile.save()
+        eq_(get_profile_countries(), ['GB', 'US'])
+        eq_(get_profile_cities(), ['London'])
+
+        bob.get_profile().delete()
+        eq_(get_profile_countries(), ['US'])
+        eq_(get_profile_cities(), [])
+
+    def test_profile_form_country_choices(self):
+        from pto.apps.users.forms import ProfileForm
+        bob = User.objects.create(username='bob')
+        profile = bob.get_profile()
+        profile.country = 'GB'
+        profile.save()
+        profile = User.objects.create(username='ted').get_profile()
+        profile.country = 'SE'
+        profile.save()
+
+        choices = ProfileForm().fields['country'].choices
+        eq_([x for x in choices if x[0] == 'SE'], [('SE', 'SE')])
+        ok_(('GB', 'United Kingdom') in choices or
+            ('GB', 'Great Britain') in choices)
+        ok_(('US', 'United States') in choices)
+        ok_(('FR', 'France') in choices)
+        eq_(choices, sorted(choices, key=lambda x: x[1]))
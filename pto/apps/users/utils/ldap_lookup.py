@@ -3,7 +3,10 @@
 # You can obtain one at http://mozilla.org/MPL/2.0/.
 
 import re
+import time
+import threading
 import ldap
+from ldap.controls import SimplePagedResultsControl
 from ldap.filter import filter_format
 from django.utils.encoding import smart_unicode
 from django.conf import settings
@@ -11,6 +14,7 @@ from django.core.cache import cache
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from django_auth_ldap.config import LDAPSearch
+from pto.base.instrumentation import timed
 
 
 def account_wrap_search_filter(search_filter):
@@ -46,13 +50,282 @@ def fetch_user_details(email, force_refresh=False):
     return result
 
 
-def search_users(query, limit, autocomplete=False):
+def fetch_many_user_details(emails, force_refresh=False):
+    """Like fetch_user_details() but for many email addresses at once.
+    Returns a dict of email -> details ({} if not found).
+
+    All cache keys are read with one get_many() and whatever is missing is
+    looked up in one OR-filter LDAP search."""
+    cache_keys = dict(('ldap_peeps_%s' % hash(x), x) for x in emails)
+    found = {}
+    if not force_refresh:
+        for key, result in cache.get_many(cache_keys.keys()).items():
+            found[cache_keys[key]] = result
+
+    missing = sorted(x for x in set(emails) if x not in found)
+    if not missing:
+        return found
+
+    # anything that isn't an email address goes the slow way
+    for email in [x for x in missing if not _valid_email(x)]:
+        found[email] = fetch_user_details(email, force_refresh=force_refresh)
+        missing.remove(email)
+    if not missing:
+        return found
+
+    search_filter = ''.join(filter_format('(mail=%s)', (x,))
+                            for x in missing)
+    if len(missing) > 1:
+        search_filter = '(|%s)' % search_filter
+    search_filter = account_wrap_search_filter(search_filter)
+    attrs = ['cn', 'sn', 'mail', 'givenName', 'uid', 'objectClass']
+    by_mail = {}
+    for dn, result in _search_s("dc=mozilla", ldap.SCOPE_SUBTREE,
+                                search_filter, attrs, 0):
+        _expand_result(result)
+        if isinstance(result.get('mail'), basestring):
+            by_mail[result['mail'].lower()] = result
+
+    found_keys = {}
+    not_found_keys = {}
+    for email in missing:
+        result = by_mail.get(email.lower(), {})
+        found[email] = result
+        if result:
+            found_keys['ldap_peeps_%s' % hash(email)] = result
+        else:
+            not_found_keys['ldap_peeps_%s' % hash(email)] = result
+    if found_keys:
+        cache.set_many(found_keys, 60 * 60)
+    if not_found_keys:
+        # tell the cache to not bother again, for a while
+        cache.set_many(not_found_keys, 60)
+    return found
+
+
+class LDAPPoolTimeout(Exception):
+    pass
+
+
+class LDAPConnectionPool(object):
+    """
+    A thread-safe pool of LDAP connections all bound as the same (service)
+    account.
+
+    Idle connections are reused most-recently-used first. Ones that have
+    sat idle for longer than `idle_timeout` seconds are health checked
+    with a WHOAMI before being handed out and replaced if that fails.
+    When all `size` connections are in use, callers wait up to
+    `wait_timeout` seconds for one to be released.
+    """
+
+    def __init__(self, uri, bind_dn, bind_password, size=5,
+                 idle_timeout=60, wait_timeout=10):
+        self.uri = uri
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._condition = threading.Condition()
+        self._idle = []  # (connection, last released) tuples
+        self._open = 0
+        self.stats = {
+          'hits': 0,
+          'misses': 0,
+          'waits': 0,
+          'wait_time': 0.0,
+          'reconnects': 0,
+        }
+
+    def _connect(self):
+        connection = ldap.initialize(self.uri)
+        connection.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
+        with timed('ldap', 'ldap_binds'):
+            connection.simple_bind_s(self.bind_dn, self.bind_password)
+        return connection
+
+    def _healthy(self, connection):
+        try:
+            connection.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def _close(self, connection):
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def acquire(self):
+        with self._condition:
+            waited_since = None
+            while not self._idle and self._open >= self.size:
+                now = time.time()
+                if waited_since is None:
+                    waited_since = now
+                    self.stats['waits'] += 1
+                remaining = waited_since + self.wait_timeout - now
+                if remaining <= 0:
+                    self.stats['wait_time'] += now - waited_since
+                    raise LDAPPoolTimeout(
+                      'No LDAP connection free after %s seconds' %
+                      self.wait_timeout
+                    )
+                self._condition.wait(remaining)
+            if waited_since is not None:
+                self.stats['wait_time'] += time.time() - waited_since
+
+            if self._idle:
+                connection, released = self._idle.pop()
+                self.stats['hits'] += 1
+            else:
+                connection = released = None
+                self._open += 1
+                self.stats['misses'] += 1
+
+        if connection is not None:
+            if time.time() - released < self.idle_timeout:
+                return connection
+            if self._healthy(connection):
+                return connection
+            self._close(connection)
+            with self._condition:
+                self.stats['reconnects'] += 1
+        try:
+            return self._connect()
+        except:
+            self.release(None, discard=True)
+            raise
+
+    def release(self, connection, discard=False):
+        if discard and connection is not None:
+            self._close(connection)
+        with self._condition:
+            if discard:
+                self._open -= 1
+            else:
+                self._idle.append((connection, time.time()))
+            self._condition.notify()
+
+    def call(self, function):
+        """Call `function` with a pooled connection and return what it
+        returns. If the server has gone away the connection is replaced and
+        `function` is tried once more."""
+        connection = self.acquire()
+        try:
+            try:
+                result = function(connection)
+            except ldap.SERVER_DOWN:
+                self._close(connection)
+                with self._condition:
+                    self.stats['reconnects'] += 1
+                connection = None
+                connection = self._connect()
+                result = function(connection)
+        except:
+            self.release(connection, discard=True)
+            raise
+        self.release(connection)
+        return result
+
+    def clear(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for connection, __ in idle:
+            self._close(connection)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the shared LDAPConnectionPool, or None if pooling is switched
+    off with settings.LDAP_POOL_SIZE = 0."""
+    global _pool
+    size = getattr(settings, 'LDAP_POOL_SIZE', 5)
+    if not size:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = LDAPConnectionPool(
+              settings.AUTH_LDAP_SERVER_URI,
+              settings.AUTH_LDAP_BIND_DN,
+              settings.AUTH_LDAP_BIND_PASSWORD,
+              size=size,
+              idle_timeout=getattr(settings, 'LDAP_POOL_IDLE_TIMEOUT', 60),
+              wait_timeout=getattr(settings, 'LDAP_POOL_WAIT_TIMEOUT', 10),
+            )
+        return _pool
+
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.clear()
+        _pool = None
+
+
+def _unpooled_connection():
     connection = ldap.initialize(settings.AUTH_LDAP_SERVER_URI)
     connection.set_option(ldap.OPT_PROTOCOL_VERSION, 3)
-    if limit > 0:
-        connection.set_option(ldap.OPT_SIZELIMIT, limit)
-    connection.simple_bind_s(settings.AUTH_LDAP_BIND_DN,
-                             settings.AUTH_LDAP_BIND_PASSWORD)
+    with timed('ldap', 'ldap_binds'):
+        connection.simple_bind_s(settings.AUTH_LDAP_BIND_DN,
+                                 settings.AUTH_LDAP_BIND_PASSWORD)
+    return connection
+
+
+def _search_s(base, scope, search_filter, attrs, limit):
+    pool = get_pool()
+    if pool is None:
+        connection = _unpooled_connection()
+        if limit > 0:
+            connection.set_option(ldap.OPT_SIZELIMIT, limit)
+        with timed('ldap', 'ldap_searches'):
+            return connection.search_s(base, scope, search_filter, attrs)
+
+    def search(connection):
+        # pooled connections are shared so always (re)set the limit
+        connection.set_option(ldap.OPT_SIZELIMIT, max(limit, 0))
+        with timed('ldap', 'ldap_searches'):
+            return connection.search_s(base, scope, search_filter, attrs)
+
+    return pool.call(search)
+
+
+def _search_paged(base, scope, search_filter, attrs, page_size):
+    """Like `_search_s` without a limit, asking for `page_size` results at
+    a time so that servers that cap the size of a result return them
+    all."""
+
+    def search(connection):
+        connection.set_option(ldap.OPT_SIZELIMIT, 0)
+        control = SimplePagedResultsControl(ldap.LDAP_CONTROL_PAGE_OID, True,
+                                            (page_size, ''))
+        results = []
+        while True:
+            with timed('ldap', 'ldap_searches'):
+                msgid = connection.search_ext(base, scope, search_filter,
+                                              attrs, serverctrls=[control])
+                __, data, __, controls = connection.result3(msgid)
+            results.extend(data)
+            cookies = [x.controlValue[1] for x in controls
+                       if x.controlType == ldap.LDAP_CONTROL_PAGE_OID]
+            if not cookies or not cookies[0]:
+                return results
+            control.controlValue = (page_size, cookies[0])
+
+    pool = get_pool()
+    if pool is None:
+        return search(_unpooled_connection())
+    return pool.call(search)
+
+
+def search_users(query, limit, autocomplete=False):
     if autocomplete:
         filter_elems = []
         if query.startswith(':'):
@@ -79,9 +352,10 @@ def search_users(query, limit, autocomplete=False):
     attrs = ['cn', 'sn', 'mail', 'givenName', 'uid', 'objectClass']
     search_filter = account_wrap_search_filter(search_filter)
 
-    rs = connection.search_s("dc=mozilla", ldap.SCOPE_SUBTREE,
-                            search_filter,
-                            attrs)
+    rs = _search_s("dc=mozilla", ldap.SCOPE_SUBTREE,
+                   search_filter,
+                   attrs,
+                   limit)
     results = []
     for each in rs:
         result = each[1]
@@ -92,6 +366,28 @@ def search_users(query, limit, autocomplete=False):
 
     return results
 
+
+# well under the most results servers return to a non-admin bind at once
+DIRECTORY_PAGE_SIZE = 500
+
+
+def fetch_directory():
+    """Return every account in the directory (uid, names and mail only)
+    for building local indexes."""
+    search_filter = account_wrap_search_filter('(uid=*)')
+    attrs = ['cn', 'sn', 'mail', 'givenName', 'uid']
+    results = []
+    for dn, result in _search_paged("dc=mozilla", ldap.SCOPE_SUBTREE,
+                                    search_filter, attrs,
+                                    DIRECTORY_PAGE_SIZE):
+        if dn is None:
+            # a referral
+            continue
+        _expand_result(result)
+        results.append(result)
+    return results
+
+
 def _expand_result(result):
     """
     Turn
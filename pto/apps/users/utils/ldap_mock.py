@@ -53,4 +53,4 @@ class MockLDAP:  # pragma: no cover
     def void(self, *args, **kwargs):
         pass
 
-    set_option = unbind_s = start_tls_s = void
+    set_option = unbind_s = start_tls_s = whoami_s = void
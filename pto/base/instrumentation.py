@@ -0,0 +1,151 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+"""Counts and times what a request spends on SQL, the cache, LDAP and
+email. See `pto.base.middleware.InstrumentationMiddleware`.
+
+Outside of an instrumented request (`start()` ... `stop()`) recording
+anything is a no-op.
+"""
+
+import time
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from django.db import connections
+
+_local = threading.local()
+
+# groups that get a Server-Timing metric, and the counters shown for each
+TIMING_GROUPS = (
+  ('sql', ('sql_queries',)),
+  ('cache', ('cache_gets', 'cache_hits', 'cache_sets', 'cache_deletes')),
+  ('ldap', ('ldap_searches', 'ldap_binds')),
+  ('email', ('emails',)),
+)
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.durations = defaultdict(float)  # group -> seconds
+        self.counts = defaultdict(int)
+        self._sql_start = {}
+
+    def record(self, group, counter, duration=0.0, count=1):
+        self.durations[group] += duration
+        self.counts[counter] += count
+
+    def summary(self):
+        """A flat dict of every counter plus <group>_ms and total_ms."""
+        summary = {
+          'total_ms': round((time.time() - self.start_time) * 1000, 1),
+        }
+        for group, counters in TIMING_GROUPS:
+            summary['%s_ms' % group] = round(self.durations[group] * 1000, 1)
+            for counter in counters:
+                summary[counter] = self.counts[counter]
+        return summary
+
+    def server_timing(self, summary):
+        """The value of a Server-Timing header for `summary()`."""
+        metrics = []
+        for group, counters in TIMING_GROUPS:
+            desc = ' '.join('%s=%s' % (x.split('_', 1)[1], summary[x])
+                            for x in counters)
+            metrics.append('%s;dur=%s;desc="%s"' %
+                           (group, summary['%s_ms' % group], desc))
+        metrics.append('total;dur=%s' % summary['total_ms'])
+        return ', '.join(metrics)
+
+
+def start():
+    """Start collecting for the current thread's request."""
+    stats = _local.stats = RequestStats()
+    # the debug cursor records every query with its time even when
+    # settings.DEBUG is off
+    for connection in connections.all():
+        stats._sql_start[connection.alias] = (connection.use_debug_cursor,
+                                              len(connection.queries))
+        connection.use_debug_cursor = True
+    return stats
+
+
+def stop():
+    """Stop collecting and return the RequestStats, if any."""
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    if stats is None:
+        return
+    for connection in connections.all():
+        if connection.alias not in stats._sql_start:
+            continue
+        use_debug_cursor, first = stats._sql_start[connection.alias]
+        connection.use_debug_cursor = use_debug_cursor
+        queries = connection.queries[first:]
+        stats.record('sql', 'sql_queries',
+                     sum(float(x['time']) for x in queries),
+                     len(queries))
+    return stats
+
+
+def record(group, counter, duration=0.0, count=1):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.record(group, counter, duration, count)
+
+
+@contextmanager
+def timed(group, counter):
+    """Time the block and count it as one `counter` in `group`."""
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        record(group, counter, time.time() - t0)
+
+
+_CACHE_COUNTERS = {
+  'get': 'cache_gets',
+  'get_many': 'cache_gets',
+  'set': 'cache_sets',
+  'set_many': 'cache_sets',
+  'add': 'cache_sets',
+  'incr': 'cache_sets',
+  'decr': 'cache_sets',
+  'delete': 'cache_deletes',
+  'delete_many': 'cache_deletes',
+}
+
+
+def _wrap_cache_method(name, method):
+    counter = _CACHE_COUNTERS[name]
+
+    def wrapper(*args, **kwargs):
+        stats = getattr(_local, 'stats', None)
+        if stats is None:
+            return method(*args, **kwargs)
+        t0 = time.time()
+        result = method(*args, **kwargs)
+        stats.record('cache', counter, time.time() - t0)
+        if name == 'get' and result is not None:
+            stats.record('cache', 'cache_hits')
+        elif name == 'get_many':
+            stats.record('cache', 'cache_hits', count=len(result))
+        return result
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+def instrument_cache(cache):
+    """Wrap the methods of the `cache` instance so they get recorded.
+    Everything does `from django.core.cache import cache` so wrapping the
+    instance covers every caller."""
+    if getattr(cache, '_instrumented', False):
+        return
+    for name in _CACHE_COUNTERS:
+        setattr(cache, name, _wrap_cache_method(name, getattr(cache, name)))
+    cache._instrumented = True
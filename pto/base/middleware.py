@@ -0,0 +1,59 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.urlresolvers import resolve, Resolver404
+from django.utils import simplejson as json
+from . import instrumentation
+
+logger = logging.getLogger('pto.instrumentation')
+
+
+class InstrumentationMiddleware(object):
+    """Reports how many SQL queries, cache calls, LDAP searches and binds
+    and emails a request needed, and how long they took, in a
+    Server-Timing header and a JSON log line. Requests that exceed their
+    URL's settings.INSTRUMENTATION_BUDGETS are logged as warnings.
+
+    Does nothing at all unless settings.INSTRUMENTATION_ENABLED.
+    """
+
+    def __init__(self):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed
+        instrumentation.instrument_cache(cache)
+
+    def process_request(self, request):
+        instrumentation.start()
+
+    def process_response(self, request, response):
+        stats = instrumentation.stop()
+        if stats is None:
+            return response
+
+        summary = stats.summary()
+        response['Server-Timing'] = stats.server_timing(summary)
+
+        try:
+            url_name = resolve(request.path_info).url_name
+        except Resolver404:
+            url_name = None
+        summary.update({
+          'url_name': url_name,
+          'method': request.method,
+          'path': request.path,
+          'status': response.status_code,
+        })
+        logger.info(json.dumps(summary, sort_keys=True))
+
+        budgets = getattr(settings, 'INSTRUMENTATION_BUDGETS', {})
+        for metric, limit in sorted(budgets.get(url_name, {}).items()):
+            if summary.get(metric, 0) > limit:
+                logger.warning('%s over budget: %s=%s (budget %s) %s',
+                               url_name, metric, summary[metric], limit,
+                               request.path)
+        return response
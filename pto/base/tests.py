@@ -0,0 +1,95 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import logging
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.utils import simplejson as json
+from nose.tools import eq_, ok_
+from test_utils import TestCase
+from pto.base import instrumentation
+
+
+class _RecordingHandler(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        super(InstrumentationTests, self).setUp()
+        self.handler = _RecordingHandler()
+        self.logger = logging.getLogger('pto.instrumentation')
+        self.logger.addHandler(self.handler)
+        self._level = self.logger.level
+        self.logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        super(InstrumentationTests, self).tearDown()
+        self.logger.removeHandler(self.handler)
+        self.logger.setLevel(self._level)
+
+    def test_recording(self):
+        instrumentation.instrument_cache(cache)
+        # nothing is recorded outside a request
+        instrumentation.record('email', 'emails')
+        cache.set('instrumented', 1)
+        eq_(instrumentation.stop(), None)
+
+        instrumentation.start()
+        cache.set('instrumented', 1)
+        eq_(cache.get('instrumented'), 1)
+        eq_(cache.get('not-instrumented'), None)
+        User.objects.count()
+        User.objects.count()
+        with instrumentation.timed('ldap', 'ldap_searches'):
+            pass
+        instrumentation.record('email', 'emails')
+        stats = instrumentation.stop()
+
+        summary = stats.summary()
+        eq_(summary['sql_queries'], 2)
+        eq_(summary['cache_sets'], 1)
+        eq_(summary['cache_gets'], 2)
+        eq_(summary['cache_hits'], 1)
+        eq_(summary['ldap_searches'], 1)
+        eq_(summary['ldap_binds'], 0)
+        eq_(summary['emails'], 1)
+        header = stats.server_timing(summary)
+        ok_('sql;dur=' in header)
+        ok_('desc="queries=2"' in header)
+        ok_('desc="gets=2 hits=1 sets=1 deletes=0"' in header)
+        ok_(header.endswith('total;dur=%s' % summary['total_ms']))
+
+    def test_middleware(self):
+        url = reverse('dates.home')
+        with self.settings(INSTRUMENTATION_ENABLED=False):
+            response = self.client.get(url)
+        ok_(not response.has_header('Server-Timing'))
+        eq_(self.handler.records, [])
+
+        budgets = {'dates.home': {'sql_queries': 1000, 'total_ms': -1}}
+        with self.settings(INSTRUMENTATION_ENABLED=True,
+                           INSTRUMENTATION_BUDGETS=budgets):
+            self.client = self.client_class()
+            response = self.client.get(url)
+        ok_('total;dur=' in response['Server-Timing'])
+
+        info, warning = self.handler.records
+        eq_(info.levelno, logging.INFO)
+        summary = json.loads(info.getMessage())
+        eq_(summary['url_name'], 'dates.home')
+        eq_(summary['path'], url)
+        eq_(summary['status'], response.status_code)
+        ok_('sql_queries' in summary)
+        eq_(warning.levelno, logging.WARNING)
+        ok_('total_ms' in warning.getMessage())
+        ok_('sql_queries' not in warning.getMessage())
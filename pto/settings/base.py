@@ -39,6 +39,10 @@ JINGO_EXCLUDE_APPS = (
 MIDDLEWARE_CLASSES = list(MIDDLEWARE_CLASSES)
 MIDDLEWARE_CLASSES.remove('funfactory.middleware.LocaleURLMiddleware')
 MIDDLEWARE_CLASSES = tuple(MIDDLEWARE_CLASSES)
+# first, so that it sees everything the other middlewares do too
+MIDDLEWARE_CLASSES = (
+    'pto.base.middleware.InstrumentationMiddleware',
+) + MIDDLEWARE_CLASSES
 MIDDLEWARE_CLASSES += (
     'mobility.middleware.DetectMobileMiddleware',
     'mobility.middleware.XMobileMiddleware',
@@ -101,7 +105,19 @@ TEST_RUNNER = 'test_utils.runner.RadicalTestSuiteRunner'
 #CELERY_IGNORE_RESULT = True
 
 # Logging
-LOGGING = dict(loggers=dict(playdoh={'level': logging.DEBUG}))
+LOGGING = dict(loggers={
+    'playdoh': {'level': logging.DEBUG},
+    'pto.instrumentation': {'level': logging.INFO},
+})
+
+# Count and time SQL queries, cache calls, LDAP searches/binds and emails
+# per request. Reported in a Server-Timing response header and logged, as
+# JSON, to the 'pto.instrumentation' logger.
+INSTRUMENTATION_ENABLED = False
+# URL name -> {metric: limit}. Requests over any limit are logged as
+# warnings. The metrics are the keys of the logged JSON, e.g.
+#   {'dates.home': {'sql_queries': 20, 'total_ms': 500}}
+INSTRUMENTATION_BUDGETS = {}
 
 AUTH_PROFILE_MODULE = 'users.UserProfile'
 
@@ -144,6 +160,35 @@ PASSWORD_HASHERS = (
 # If true, a python traceback and error message is shown on the 500.html page
 TRACEBACKS_ON_500 = False
 
+# Answer the user autocomplete from an in-process copy of the directory
+# that is rebuilt this often (seconds), or retried this often if that
+# fails. Keep it fresh in the cache with
+# `./manage.py refresh_directory_index` from cron.
+AUTOCOMPLETE_DIRECTORY_INDEX = False
+AUTOCOMPLETE_DIRECTORY_TTL = 60 * 15
+AUTOCOMPLETE_DIRECTORY_RETRY = 60 * 5
+
+# How long (seconds) a rendered ptocalendar.ics feed may be reused for.
+# Feeds are invalidated as soon as anything in them changes anyway.
+CALENDAR_FEED_CACHE_TIMEOUT = 60 * 60 * 24
+# Same for the calendar_events JSON behind the dashboard calendar.
+CALENDAR_EVENTS_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Days the tombstones of deleted entries and changed follows are kept for
+# the mobile sync. Clients that haven't synced for longer get everything
+# again. Prune them with `./manage.py prune_tombstones` from cron.
+SYNC_TOMBSTONE_DAYS = 30
+# Seconds the mobile sync cursor trails the time it's handed out, so that
+# rows in transactions that were still open then are picked up next time.
+SYNC_SETTLE_SECONDS = 60
+
+# The most changes to entries and hours that the change log endpoints
+# return at a time, see dates.changelog.
+CHANGE_LOG_PAGE_SIZE = 1000
+# Seconds a change has to be in the change log before it's returned, so
+# that changes in transactions that are still open aren't skipped.
+CHANGE_LOG_SETTLE_SECONDS = 60
+
 try:
     ## LDAP
     import ldap
@@ -177,6 +222,12 @@ try:
     )
     AUTH_LDAP_USER_DN_TEMPLATE = "mail=%(user)s,o=com,dc=mozilla"
 
+    # pool of connections bound as AUTH_LDAP_BIND_DN used for the
+    # lookups in pto.apps.users.utils.ldap_lookup (0 disables pooling)
+    LDAP_POOL_SIZE = 5
+    LDAP_POOL_IDLE_TIMEOUT = 60  # seconds before an idle one is re-checked
+    LDAP_POOL_WAIT_TIMEOUT = 10  # seconds to wait for a free connection
+
 except ImportError:
     AUTHENTICATION_BACKENDS = (
        'pto.apps.users.email_auth_backend.EmailOrUsernameModelBackend',
@@ -12,3 +12,10 @@ CACHES = {
 AUTH_LDAP_BIND_PASSWORD = 'anything'
 AUTH_LDAP_SERVER_URI = 'as long as its'
 AUTH_LDAP_BIND_DN = 'not blank'
+
+# tests swap out ldap.initialize all the time so don't hold on to
+# connections made by a previous mock
+LDAP_POOL_SIZE = 0
+
+# the tests mock LDAP per search so never answer from a directory index
+AUTOCOMPLETE_DIRECTORY_INDEX = False